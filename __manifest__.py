@@ -13,5 +13,11 @@
     "category": "Technical",
     "version": "5.0.0",
     # any module necessary for this one to work correctly
-    "depends": ["base", "sale", "purchase", "account"],
+    "depends": ["base", "stock", "sale", "purchase", "account"],
+    # always loaded
+    "data": [
+        "security/ir.model.access.csv",
+        "data/ir_cron.xml",
+    ],
+    "uninstall_hook": "uninstall_hook",
 }
@@ -8,6 +8,23 @@ import json
 
 class MasterData(http.Controller):
 
+    ## GET Estado de un trabajo de validación en segundo plano (complete_recepcion / complete_transfer asíncronos)
+    @http.route("/api/validation_job/<int:id_job>", auth="user", type="json", methods=["GET"])
+    def get_validation_job(self, id_job):
+        try:
+            user = request.env.user
+
+            job = request.env["api.validation.job"].sudo().search([("id", "=", id_job), ("user_id", "=", user.id)], limit=1)
+            if not job:
+                return {"code": 404, "msg": f"Trabajo de validación {id_job} no encontrado"}
+
+            return {"code": 200, "result": job.to_dict()}
+
+        except AccessError as e:
+            return {"code": 403, "msg": f"Acceso denegado: {str(e)}"}
+        except Exception as err:
+            return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
+
     ## GET Configuraciones
     @http.route("/api/configurations", auth="user", type="json", methods=["GET"])
     def get_configurations(self):
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import json
+
+from odoo import api
+from odoo.http import Response, request
+from odoo.tools import date_utils
+
+# Registros procesados por bloque antes de liberar la cache del ORM
+STREAM_CHUNK_SIZE = 50
+
+
+def respuesta_ndjson(generador, *args):
+    """Respuesta chunked ``application/x-ndjson`` con una línea JSON por cada elemento de ``generador``.
+
+    El cuerpo se genera después de que termina la petición, cuando su cursor ya está cerrado, por eso
+    ``generador(env, *args)`` se ejecuta con un cursor propio y el mismo usuario. El cursor es de solo
+    lectura: al terminar se hace rollback, cualquier escritura hecha al generar el cuerpo se descarta."""
+    registry = request.env.registry
+    uid = request.env.uid
+    context = dict(request.env.context)
+
+    def stream():
+        cr = registry.cursor()
+        try:
+            env = api.Environment(cr, uid, context)
+            try:
+                for linea in generador(env, *args):
+                    yield json.dumps(linea, default=date_utils.json_default) + "\n"
+            except Exception as err:
+                yield json.dumps({"code": 400, "msg": f"Error inesperado: {str(err)}"}) + "\n"
+        finally:
+            cr.rollback()
+            cr.close()
+
+    return Response(stream(), mimetype="application/x-ndjson", direct_passthrough=True)
+
+
+def respuesta_json(data):
+    """Respuesta JSON simple para los errores que se detectan antes de empezar el stream."""
+    return Response(json.dumps(data, default=date_utils.json_default), mimetype="application/json")
+
+
+def iterar_en_bloques(records):
+    """Recorre ``records`` en bloques de ``STREAM_CHUNK_SIZE``, liberando la cache del ORM entre bloques
+    para que la memoria del worker no crezca con el tamaño del resultado."""
+    for i in range(0, len(records), STREAM_CHUNK_SIZE):
+        yield records[i : i + STREAM_CHUNK_SIZE]
+        records.invalidate_cache()
@@ -2,9 +2,25 @@
 from odoo import http
 from odoo.http import request
 from odoo.exceptions import AccessError, ValidationError
+from odoo.tools import float_compare, float_is_zero, float_round
 from datetime import datetime, timedelta
 import pytz
 
+from .ndjsonStream import iterar_en_bloques, respuesta_json, respuesta_ndjson
+
+# Código de secuencia del tipo de operación de packing según los pasos de entrega del almacén
+SECUENCIA_PACKING_POR_PASOS = {
+    "ship_only": "OUT",  # 1 paso: Entregar bienes directamente
+    "pick_ship": "OUT",  # 2 pasos: Enviar bienes a ubicación de salida y entregar
+    "pick_pack_ship": "PACK",  # 3 pasos: Empaquetar, transferir bienes a ubicación de salida, y enviar
+}
+
+# Máximo de nombres de paquete que se pueden reservar en una petición
+MAX_PAQUETES_RESERVA = 200
+
+# Cache por proceso de los tipos de operación de packing por almacén: {base de datos: (versión, {id almacén: [ids de tipos]})}
+_TIPOS_PACKING_CACHE = {}
+
 
 class TransaccionDataPacking(http.Controller):
 
@@ -28,207 +44,10 @@ class TransaccionDataPacking(http.Controller):
             # ✅ Obtener la estrategia de picking
             picking_strategy = request.env["picking.strategy"].sudo().browse(1)
 
-            # ✅ Iterar sobre los almacenes permitidos y procesar cada uno
-            for warehouse in allowed_warehouses:
-
-                # Obtener el campo `delivery_steps` del almacén
-                delivery_steps = warehouse.delivery_steps
-                if not delivery_steps:
-                    continue  # Saltar si no hay información sobre `delivery_steps`
-
-                # Determinar el `sequence_code` basado en los pasos de entrega
-                if delivery_steps == "ship_only":
-                    # 1 paso: Entregar bienes directamente
-                    sequence_code = "OUT"
-                elif delivery_steps == "pick_ship":
-                    # 2 pasos: Enviar bienes a ubicación de salida y entregar
-                    sequence_code = "OUT"
-                elif delivery_steps == "pick_pack_ship":
-                    # 3 pasos: Empaquetar, transferir bienes a ubicación de salida, y enviar
-                    sequence_code = "PACK"
-                else:
-                    continue  # Si no hay una coincidencia válida, saltar este almacén
-
-                # ✅ Buscar lotes en progreso con secuencia
-                batches = (
-                    request.env["stock.picking.batch"]
-                    .sudo()
-                    .search(
-                        [
-                            ("state", "=", "in_progress"),
-                            ("picking_type_id.sequence_code", "=", sequence_code),
-                            ("picking_type_id.warehouse_id", "=", warehouse.id),  # Filtro por almacén actual
-                        ]
-                    )
-                )
-
-                for batch in batches:
-                    if batch.move_line_ids:
-                        user_info = {
-                            "user_id": batch.user_id.id if batch.user_id else 0,
-                            "user_name": batch.user_id.name if batch.user_id else "Desconocido",
-                        }
-
-                        array_batch_temp = {
-                            "id": batch.id,
-                            "name": batch.name,
-                            "scheduleddate": batch.scheduled_date,
-                            "state": batch.state,
-                            "user_id": user_info["user_id"],
-                            "user_name": user_info["user_name"],
-                            "order_by": picking_strategy.picking_priority_app if picking_strategy else "",
-                            "order_picking": picking_strategy.picking_order_app if picking_strategy else "",
-                            "picking_type_id": batch.picking_type_id.display_name if batch.picking_type_id else "N/A",
-                            "cantidad_pedidos": 0,
-                            "start_time_pack": batch.start_time_pack or "",
-                            "end_time_pack": batch.end_time_pack or "",
-                            "zona_entrega": batch.picking_ids[0].delivery_zone_id.name if batch.picking_ids and batch.picking_ids[0].delivery_zone_id else "N/A",
-                            "zona_entrega_tms": batch.picking_ids[0].delivery_zone_tms if batch.picking_ids and batch.picking_ids[0].delivery_zone_tms else "N/A",
-                            "order_tms": batch.picking_ids[0].order_tms if batch.picking_ids and batch.picking_ids[0].order_tms else "N/A",
-                            "lista_pedidos": [],
-                        }
-
-                        valid_pickings_found = False
-
-                        for picking in batch.picking_ids:
-                            pedido = {
-                                "id": picking.id,
-                                "batch_id": batch.id,
-                                "name": picking.name,
-                                "referencia": picking.origin,
-                                "contacto": picking.partner_id.id if picking.partner_id else 0,
-                                "contacto_name": picking.partner_id.name if picking.partner_id else "N/A",
-                                "tipo_operacion": picking.picking_type_id.name if picking.picking_type_id else "N/A",
-                                "cantidad_productos": len(picking.move_line_ids.filtered(lambda ml: not ml.is_done_item_pack)),
-                                "cantidad_productos_total": len(picking.move_line_ids),
-                                "zona_entrega": picking.delivery_zone_id.name if picking.delivery_zone_id else "",
-                                "zona_entrega_tms": picking.delivery_zone_tms if picking.delivery_zone_tms else "",
-                                "order_tms": picking.order_tms if picking.order_tms else "",
-                                "numero_paquetes": len(picking.move_line_ids.mapped("package_id")),
-                                "lista_productos": [],
-                                "lista_paquetes": [],
-                            }
-
-                            # ✅ Procesar líneas de movimiento
-                            for move_line in picking.move_line_ids:
-                                location = move_line.location_id
-                                location_dest = move_line.location_dest_id
-
-                                product = move_line.product_id
-                                lot = move_line.lot_id
-
-                                # ✅ Verificar dinámicamente la existencia de `barcode_ids`
-                                array_all_barcode = []
-                                if "barcode_ids" in product.fields_get():
-                                    array_all_barcode = [
-                                        {
-                                            "barcode": barcode.name,
-                                            "batch_id": batch.id,
-                                            "id_move": move_line.id,
-                                            "id_product": product.id,
-                                        }
-                                        for barcode in product.barcode_ids
-                                        if barcode.name  # Filtra solo los barcodes válidos
-                                    ]
-
-                                # ✅ Obtener empaques del producto
-                                array_packing = (
-                                    [
-                                        {
-                                            "barcode": pack.barcode,
-                                            "cantidad": pack.qty,
-                                            "batch_id": batch.id,
-                                            "id_move": move_line.id,
-                                            "id_product": product.id,
-                                        }
-                                        for pack in product.packaging_ids
-                                        if pack.barcode  # Incluye solo si barcode es válido
-                                    ]
-                                    if product.packaging_ids
-                                    else []
-                                )
-
-                                if move_line.is_done_item_pack == False:
-                                    productos = {
-                                        "id_move": move_line.id,
-                                        "product_id": [product.id, product.name],
-                                        "batch_id": batch.id,
-                                        "pedido_id": picking.id,
-                                        "id_product": product.id if product else 0,
-                                        "picking_id": picking.id,
-                                        "lote_id": lot.id if lot else "",
-                                        "lot_id": [lot.id, lot.name if lot else ""] if lot else [],
-                                        "expire_date": lot.expiration_date or "",
-                                        "location_id": [location.id, location.display_name if location else ""],
-                                        "barcode_location": location.barcode if location else "",
-                                        "location_dest_id": [location_dest.id, location_dest.name if location_dest else ""],
-                                        "barcode_location_dest": location_dest.barcode if location_dest else "",
-                                        "other_barcode": array_all_barcode,
-                                        "quantity": move_line.product_uom_qty,
-                                        "tracking": product.tracking if product else "",
-                                        "barcode": product.barcode if product else "",
-                                        "product_packing": array_packing,
-                                        "weight": product.weight if product else 0,
-                                        "unidades": product.uom_id.name if product.uom_id else "UND",
-                                        "rimoval_priority": location.priority_picking,
-                                    }
-
-                                    pedido["lista_productos"].append(productos)
-
-                            # ✅ Procesar paquetes con productos empaquetados (is_done_item_pack == True)
-                            move_lines_in_picking = picking.move_line_ids.filtered(lambda ml: ml.package_id or ml.result_package_id)
-                            unique_packages = move_lines_in_picking.mapped("package_id") + move_lines_in_picking.mapped("result_package_id")
-
-                            for pack in unique_packages:
-                                move_lines_in_package = move_lines_in_picking.filtered(lambda ml: (ml.package_id == pack or ml.result_package_id == pack) and ml.is_done_item_pack)
-
-                                cantidad_productos = len(move_lines_in_package)
-
-                                package = {
-                                    "name": pack.name,
-                                    "id": pack.id,
-                                    "batch_id": batch.id,
-                                    "pedido_id": picking.id,
-                                    "cantidad_productos": cantidad_productos,
-                                    "lista_productos_in_packing": [],
-                                    "is_sticker": pack.is_sticker,
-                                    "is_certificate": pack.is_certificate,
-                                    "fecha_creacion": pack.create_date.strftime("%Y-%m-%d") if pack.create_date else "",
-                                    "fecha_actualizacion": pack.write_date.strftime("%Y-%m-%d") if pack.write_date else "",
-                                    "is_sticker": pack.is_sticker,
-                                }
-                                pedido["lista_paquetes"].append(package)
-
-                                for move_line in move_lines_in_package:
-                                    product = move_line.product_id
-                                    lot = move_line.lot_id
-
-                                    product_in_packing = {
-                                        "id_move": move_line.id,
-                                        "pedido_id": picking.id,
-                                        "batch_id": batch.id,
-                                        "product_id": [product.id, product.name],
-                                        "package_name": pack.name,
-                                        "quantity_separate": move_line.qty_done,
-                                        "unidades": product.uom_id.name if product.uom_id else "UND",
-                                        "weight": product.weight if product else 0,
-                                        "lote_id": [lot.id, lot.name if lot else ""] if lot else [],
-                                        "observacion": move_line.new_observation_packing,
-                                        "id_package": pack.id,
-                                        "quantity": move_line.product_uom_qty,
-                                        "tracking": product.tracking if product else "",
-                                    }
-
-                                    package["lista_productos_in_packing"].append(product_in_packing)
-
-                            if pedido["lista_productos"]:
-                                array_batch_temp["lista_pedidos"].append(pedido)
-                                valid_pickings_found = True
-
-                        # Solo añadir el batch al array final si tiene pedidos válidos
-                        if valid_pickings_found:
-                            array_batch_temp["cantidad_pedidos"] = len(array_batch_temp["lista_pedidos"])
-                            array_batch.append(array_batch_temp)
+            for batch in buscar_batches_packing(allowed_warehouses):
+                array_batch_temp = construir_batch_packing(batch, picking_strategy)
+                if array_batch_temp:
+                    array_batch.append(array_batch_temp)
 
             return {"code": 200, "result": array_batch}
 
@@ -237,6 +56,28 @@ class TransaccionDataPacking(http.Controller):
         except Exception as err:
             return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
 
+    ## GET Transacciones batch de packing en streaming (NDJSON, un batch por línea)
+    @http.route("/api/batch_packing/stream", auth="user", type="http", methods=["GET"], csrf=False)
+    def get_batch_packing_stream(self, **kwargs):
+        try:
+            user = request.env.user
+            if not user:
+                return respuesta_json({"code": 401, "msg": "Usuario no autenticado"})
+
+            # Obtener almacenes del usuario
+            allowed_warehouses = obtener_almacenes_usuario(user)
+
+            # Verificar si es un error (diccionario con código y mensaje)
+            if isinstance(allowed_warehouses, dict) and "code" in allowed_warehouses:
+                return respuesta_json(allowed_warehouses)  # Devolver el error directamente
+
+            return respuesta_ndjson(iterar_batches_packing, buscar_batches_packing(allowed_warehouses).ids)
+
+        except AccessError as e:
+            return respuesta_json({"code": 403, "msg": f"Acceso denegado: {str(e)}"})
+        except Exception as err:
+            return respuesta_json({"code": 400, "msg": f"Error inesperado: {str(err)}"})
+
     ## GET Transacciones crear paquete para packing - V1
     @http.route("/api/create_package", auth="user", type="json", methods=["POST"])
     def create_packaging(self):
@@ -272,9 +113,48 @@ class TransaccionDataPacking(http.Controller):
         except Exception as err:
             return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
 
+    ## POST Reservar un bloque de nombres de paquete para un dispositivo (se crean al usarlos en send_packing)
+    @http.route("/api/reserve_packages", auth="user", type="json", methods=["POST"])
+    def reserve_packages(self, **auth):
+        try:
+            user = request.env.user
+            if not user:
+                return {"code": 401, "msg": "Usuario no autenticado"}
+
+            device_id = auth.get("device_id")
+            cantidad = int(auth.get("cantidad", 20))
+
+            if not device_id:
+                return {"code": 400, "msg": "Falta el identificador del dispositivo"}
+
+            if cantidad <= 0 or cantidad > MAX_PAQUETES_RESERVA:
+                return {"code": 400, "msg": f"La cantidad debe estar entre 1 y {MAX_PAQUETES_RESERVA}"}
+
+            # ✅ Reservar los nombres con vencimiento configurable
+            ttl_hours = int(request.env["ir.config_parameter"].sudo().get_param("api_onpoint.package_reservation_hours", 24))
+            reservations = request.env["api.package.reservation"].sudo().reserve(str(device_id), cantidad, ttl_hours)
+
+            return {
+                "code": 200,
+                "result": {
+                    "device_id": device_id,
+                    "expira": reservations[:1].expires_at.strftime("%Y-%m-%d %H:%M:%S"),
+                    "paquetes": reservations.mapped("name"),
+                },
+            }
+
+        except AccessError as e:
+            return {"code": 403, "msg": f"Acceso denegado: {str(e)}"}
+        except Exception as err:
+            return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
+
     # ## GET Transacciones crear paquete para packing
     @http.route("/api/send_packing", auth="user", type="json", methods=["POST"])
     def send_packing(self, **auth):
+        # ✅ Idempotencia: un reintento con el mismo id_operacion devuelve la respuesta ya procesada
+        return request.env["api.idempotency.key"].sudo().run_once(auth.get("id_operacion"), "/api/send_packing", lambda: self._send_packing(**auth))
+
+    def _send_packing(self, **auth):
         try:
             # ✅ Validar autenticación
             user = request.env.user
@@ -287,6 +167,7 @@ class TransaccionDataPacking(http.Controller):
             is_sticker = auth.get("is_sticker", False)
             is_certificate = auth.get("is_certificate", False)
             peso_total_paquete = auth.get("peso_total_paquete", 0)
+            name_paquete = auth.get("name_paquete")
 
             array_msg = []
 
@@ -295,66 +176,9 @@ class TransaccionDataPacking(http.Controller):
             if not batch.exists():
                 return {"code": 400, "msg": f"El id_batch {id_batch} no existe"}
 
-            # ✅ Procesar cada ítem en la lista
-            for move in list_item:
-                product_id = move.get("product_id")
-                location_id = move.get("location_id")
-                lote = move.get("lote", None)
-                cantidad_separada = move.get("cantidad_separada", 0)
-                id_move = move.get("id_move")
-                observacion = move.get("observacion", "")
-                id_operario = move.get("id_operario", 0)
-                fecha_transaccion = move.get("fecha_transaccion", "")
-
-                domain = [
-                    ("product_id", "=", product_id),
-                    ("location_id", "=", location_id),
-                ]
-
-                if lote:
-                    domain.append(("lot_id", "=", int(lote)))
-
-                # ✅ Actualizar stock.move.line con el paquete
-                move_line = request.env["stock.move.line"].sudo().browse(id_move)
-                if move_line.exists():
-                    if move_line.product_uom_qty >= cantidad_separada:
-                        move_line.write(
-                            {"qty_done": cantidad_separada, "new_observation_packing": observacion, "user_operator_id": id_operario, "date_transaction_packing": procesar_fecha_naive(fecha_transaccion, "America/Bogota") if fecha_transaccion else datetime.now(pytz.utc), "is_done_item_pack": True}
-                        )
-                    else:
-                        array_msg.append(
-                            {
-                                "code": 400,
-                                "msg": f"La cantidad separada es mayor a la cantidad del producto en stock.move.line {id_move}",
-                            }
-                        )
-                else:
-                    array_msg.append(
-                        {
-                            "code": 400,
-                            "msg": f"Error al actualizar el paquete en stock.move.line {id_move}",
-                        }
-                    )
-
-            # ✅ ejecutar la acción de empaquetar del batch
-            pack = batch.action_put_in_pack()
-
-            # ✅ Asignar valores a los paquetes creados
-            if pack:
-                pack.write({"is_sticker": is_sticker, "is_certificate": is_certificate})
-
-            # ✅ Verificar líneas divididas y actualizar `is_done_item_pack`
-            if pack:
-                move_lines = request.env["stock.move.line"].sudo().search([("picking_id", "in", batch.picking_ids.ids)])
-
-                for move_line in move_lines:
-                    # Si la línea tiene qty_done en 0, verificamos si fue dividida de otra línea
-                    if move_line.qty_done == 0:
-                        original_line = request.env["stock.move.line"].sudo().search([("move_id", "=", move_line.move_id.id), ("id", "!=", move_line.id), ("qty_done", ">", 0)], limit=1)  # Buscar la línea original procesada
-
-                        # Solo actualizar si es una línea nueva dividida
-                        if original_line:
-                            move_line.write({"is_done_item_pack": False})
+            # ✅ Registrar las cantidades y empacar solo las líneas enviadas
+            pack, errores = empacar_lineas(batch, list_item, is_sticker, is_certificate, name_paquete)
+            array_msg += errores
 
             array_msg.append(
                 {
@@ -378,6 +202,82 @@ class TransaccionDataPacking(http.Controller):
         except Exception as err:
             return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
 
+    ## POST Transacciones empacar varias cajas de un batch en una sola petición
+    @http.route("/api/send_packing_multiple", auth="user", type="json", methods=["POST"])
+    def send_packing_multiple(self, **auth):
+        # ✅ Idempotencia: un reintento con el mismo id_operacion devuelve la respuesta ya procesada
+        return request.env["api.idempotency.key"].sudo().run_once(auth.get("id_operacion"), "/api/send_packing_multiple", lambda: self._send_packing_multiple(**auth))
+
+    def _send_packing_multiple(self, **auth):
+        try:
+            # ✅ Validar autenticación
+            user = request.env.user
+            if not user:
+                return {"code": 401, "msg": "Usuario no autenticado"}
+
+            id_batch = auth.get("id_batch")
+            list_paquetes = auth.get("list_paquetes", [])
+
+            if not list_paquetes:
+                return {"code": 400, "msg": "No se enviaron paquetes"}
+
+            # ✅ Validar si el id_batch existe
+            batch = request.env["stock.picking.batch"].sudo().browse(id_batch)
+            if not batch.exists():
+                return {"code": 400, "msg": f"El id_batch {id_batch} no existe"}
+
+            array_result = []
+            MoveLine = request.env["stock.move.line"].sudo()
+
+            # ✅ Cada caja se procesa en su propio savepoint: si una falla se revierte solo esa caja
+            for index, caja in enumerate(list_paquetes):
+                list_item = caja.get("list_item", [])
+                is_sticker = caja.get("is_sticker", False)
+                is_certificate = caja.get("is_certificate", False)
+                peso_total_paquete = caja.get("peso_total_paquete", 0)
+                id_caja = caja.get("id_caja", index)
+                name_paquete = caja.get("name_paquete")
+
+                try:
+                    with request.env.cr.savepoint():
+                        pack, errores = empacar_lineas(batch, list_item, is_sticker, is_certificate, name_paquete)
+                except Exception as err:
+                    # El savepoint revirtió la caja, el cache del ORM puede tener valores de la caja revertida
+                    batch.invalidate_cache()
+                    array_result.append({"id_caja": id_caja, "code": 400, "msg": f"Error al empacar la caja: {str(err)}", "cantidad_productos_en_el_paquete": 0})
+                    continue
+
+                # ✅ Líneas que quedaron realmente en la caja (sin las que fallaron ni las que no se empacaron)
+                cantidad_empacada = MoveLine.search_count([("result_package_id", "=", pack.id)]) if pack else 0
+
+                array_result.append(
+                    {
+                        "id_caja": id_caja,
+                        "code": 400 if errores or not pack else 200,
+                        "errores": errores,
+                        "id_paquete": pack.id if pack else "",
+                        "name_paquete": pack.name if pack else "",
+                        "id_batch": batch.id,
+                        "cantidad_productos_en_el_paquete": cantidad_empacada,
+                        "is_sticker": is_sticker,
+                        "is_certificate": is_certificate,
+                        "peso": peso_total_paquete,
+                        "list_item": list_item,
+                    }
+                )
+
+            if any(result["code"] != 200 for result in array_result):
+                return {"code": 400, "result": array_result}
+
+            return {"code": 200, "result": array_result}
+
+        except AccessError as e:
+            return {"code": 403, "msg": f"Acceso denegado: {str(e)}"}
+        except ValidationError as e:
+            return {"code": 400, "msg": f"Error de validación: {str(e)}"}
+        except Exception as err:
+            return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
+
     ### POST Transacciones para desempacar paquete en packing
     @http.route("/api/unpacking", auth="user", type="json", methods=["POST"])
     def unpacking(self, **auth):
@@ -388,8 +288,10 @@ class TransaccionDataPacking(http.Controller):
                 return {"code": 401, "msg": "Usuario no autenticado"}
 
             id_batch = auth.get("id_batch")
-            id_paquete = auth.get("id_paquete")
-            list_item = auth.get("list_item", [])
+
+            # ✅ Varios paquetes en 'list_paquetes' o uno solo con 'id_paquete' y 'list_item'
+            varios = bool(auth.get("list_paquetes"))
+            list_paquetes = auth.get("list_paquetes") or [{"id_paquete": auth.get("id_paquete"), "list_item": auth.get("list_item", [])}]
 
             array_msg = []
 
@@ -398,48 +300,42 @@ class TransaccionDataPacking(http.Controller):
             if not batch.exists():
                 return {"code": 400, "msg": f"El id_batch {id_batch} no existe"}
 
-            # ✅ Validar si el paquete existe
-            paquete = request.env["stock.quant.package"].sudo().browse(id_paquete)
-            if not paquete.exists():
-                return {
-                    "code": 400,
-                    "msg": f"El paquete {id_paquete} no existe",
-                }
+            # ✅ Validar todos los paquetes y todas las líneas en una consulta cada uno
+            paquetes = request.env["stock.quant.package"].sudo().browse([paquete.get("id_paquete") for paquete in list_paquetes if paquete.get("id_paquete")]).exists()
+            paquetes_by_id = {paquete.id: paquete for paquete in paquetes}
 
-            # ✅ Procesar cada ítem en la lista
-            for move in list_item:
-                product_id = move.get("product_id")
-                location_id = move.get("location_id")
-                lote = move.get("lote", None)
-                cantidad_separada = move.get("cantidad_separada", 0)
-                id_move = move.get("id_move")
-                observacion = move.get("observacion", "")
-                id_operario = move.get("id_operario", 0)
-
-                domain = [
-                    ("product_id", "=", product_id),
-                    ("location_id", "=", location_id),
-                ]
-
-                if lote:
-                    domain.append(("lot_id", "=", int(lote)))
-
-                # ✅ Actualizar stock.move.line con el paquete
-                move_line = request.env["stock.move.line"].sudo().browse(id_move)
-
-                if move_line.exists():
-                    move_line.write(
-                        {
-                            "result_package_id": False,
-                            "new_observation_packing": observacion,
-                            "user_operator_id": id_operario,
-                            "date_transaction_packing": "",
-                            "qty_done": 0,
-                            "is_done_item_pack": False,
-                        }
-                    )
+            # Con un solo paquete se mantiene la respuesta de error general
+            if not varios and auth.get("id_paquete") not in paquetes_by_id:
+                return {"code": 400, "msg": f"El paquete {auth.get('id_paquete')} no existe"}
+
+            MoveLine = request.env["stock.move.line"].sudo()
+            move_lines = MoveLine.browse([move.get("id_move") for paquete in list_paquetes for move in paquete.get("list_item", []) if move.get("id_move")]).exists()
+            existing_line_ids = set(move_lines.ids)
 
-                    #
+            # Líneas a reiniciar agrupadas por (observación, operario), los demás valores son comunes
+            lines_by_values = {}
+            affected_package_ids = set()
+
+            for paquete_data in list_paquetes:
+                id_paquete = paquete_data.get("id_paquete")
+                list_item = paquete_data.get("list_item", [])
+
+                paquete = paquetes_by_id.get(id_paquete)
+                if not paquete:
+                    array_msg.append({"code": 400, "msg": f"El paquete {id_paquete} no existe"})
+                    continue
+
+                affected_package_ids.add(paquete.id)
+
+                # ✅ Procesar cada ítem en la lista
+                for move in list_item:
+                    id_move = move.get("id_move")
+
+                    if id_move not in existing_line_ids:
+                        array_msg.append({"code": 400, "msg": f"Error al actualizar el paquete en stock.move.line {id_move}"})
+                        continue
+
+                    lines_by_values.setdefault((move.get("observacion", ""), move.get("id_operario", 0)), []).append(id_move)
 
                     array_msg.append(
                         {
@@ -451,18 +347,38 @@ class TransaccionDataPacking(http.Controller):
                         }
                     )
 
-                else:
-                    array_msg.append(
-                        {
-                            "code": 400,
-                            "msg": f"Error al actualizar el paquete en stock.move.line {id_move}",
-                        }
-                    )
+            # ✅ Quitar el paquete de las líneas con un write por grupo de valores
+            for (observacion, id_operario), line_ids in lines_by_values.items():
+                MoveLine.browse(line_ids).write(
+                    {
+                        "result_package_id": False,
+                        "new_observation_packing": observacion,
+                        "user_operator_id": id_operario,
+                        "date_transaction_packing": "",
+                        "qty_done": 0,
+                        "is_done_item_pack": False,
+                    }
+                )
 
-            # si en el batch ninguna linea tiene el paquete asignado, se debe eliminar el paquete
-            if not batch.move_line_ids.filtered(lambda ml: ml.result_package_id):
-                paquete.unlink()
-                array_msg.append({"code": 200, "msg": f"El paquete {id_paquete} ha sido eliminado"})
+            # ✅ Eliminar los paquetes afectados que ya no se usan: sin líneas (de este u otros batches) ni stock
+            if affected_package_ids:
+                package_ids = list(affected_package_ids)
+                in_use = set()
+                for field_name in ("result_package_id", "package_id"):
+                    in_use |= {group[field_name][0] for group in MoveLine.read_group([(field_name, "in", package_ids)], [field_name], [field_name], lazy=False)}
+                in_use |= {group["package_id"][0] for group in request.env["stock.quant"].sudo().read_group([("package_id", "in", package_ids)], ["package_id"], ["package_id"], lazy=False)}
+                empty_ids = affected_package_ids - in_use
+
+                # Si la eliminación falla, los paquetes se conservan sin deshacer las líneas ya desempacadas y el error se informa
+                try:
+                    with request.env.cr.savepoint():
+                        request.env["stock.quant.package"].sudo().browse(list(empty_ids)).unlink()
+                except Exception as err:
+                    array_msg.append({"code": 400, "msg": f"No se pudieron eliminar los paquetes {sorted(empty_ids)}: {str(err)}"})
+                    empty_ids = set()
+
+                for id_paquete in sorted(empty_ids):
+                    array_msg.append({"code": 200, "msg": f"El paquete {id_paquete} ha sido eliminado"})
 
             return {"code": 200, "result": array_msg}
 
@@ -474,6 +390,331 @@ class TransaccionDataPacking(http.Controller):
             return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
 
 
+def empacar_lineas(batch, list_item, is_sticker, is_certificate, name_paquete=None):
+    """Registra las cantidades de ``list_item`` en sus líneas y las pone en un paquete nuevo.
+
+    Solo se empacan las líneas enviadas (no todo el batch), así el costo de cerrar una caja depende
+    del tamaño de la caja. Si llega ``name_paquete`` (reservado con /api/reserve_packages) el paquete
+    se crea con ese nombre. Devuelve el paquete creado (o False) y la lista de errores por línea."""
+    env = batch.env
+    errores = []
+
+    # ✅ Validar la reserva del nombre de paquete antes de escribir las líneas
+    reservation = env["api.package.reservation"].sudo().browse()
+    if name_paquete:
+        reservation = reservation.take(name_paquete)
+        if not reservation:
+            return False, [{"code": 400, "msg": f"El paquete {name_paquete} no está reservado para el usuario o ya fue usado"}]
+
+    # ✅ Validar todas las líneas enviadas en una sola consulta
+    move_lines = env["stock.move.line"].sudo().browse([move.get("id_move") for move in list_item if move.get("id_move")]).exists()
+    lines_by_id = {move_line.id: move_line for move_line in move_lines}
+
+    fecha_envio = datetime.now(pytz.utc)
+    to_pack = env["stock.move.line"].sudo()
+
+    for move in list_item:
+        cantidad_separada = move.get("cantidad_separada", 0)
+        id_move = move.get("id_move")
+        observacion = move.get("observacion", "")
+        id_operario = move.get("id_operario", 0)
+        fecha_transaccion = move.get("fecha_transaccion", "")
+
+        # ✅ Actualizar stock.move.line con el paquete
+        move_line = lines_by_id.get(id_move)
+        if not move_line:
+            errores.append({"code": 400, "msg": f"Error al actualizar el paquete en stock.move.line {id_move}"})
+            continue
+
+        if move_line.product_uom_qty < cantidad_separada:
+            errores.append({"code": 400, "msg": f"La cantidad separada es mayor a la cantidad del producto en stock.move.line {id_move}"})
+            continue
+
+        move_line.write(
+            {"qty_done": cantidad_separada, "new_observation_packing": observacion, "user_operator_id": id_operario, "date_transaction_packing": procesar_fecha_naive(fecha_transaccion, "America/Bogota") if fecha_transaccion else fecha_envio, "is_done_item_pack": True}
+        )
+        to_pack |= move_line
+
+    # ✅ Empacar las líneas con cantidad hecha que aún no tienen paquete (mismo criterio que action_put_in_pack del batch)
+    to_pack = to_pack.filtered(lambda ml: not ml.result_package_id and not float_is_zero(ml.qty_done, precision_rounding=ml.product_uom_id.rounding))
+    if batch.state in ("done", "cancel") or not to_pack or not batch.picking_ids:
+        return False, errores
+
+    if reservation:
+        # ✅ El paquete se crea con el nombre reservado, sin pedir otro número a la secuencia de paquetes
+        pack = env["stock.quant.package"].sudo().create({"name": reservation.name, "is_sticker": is_sticker, "is_certificate": is_certificate})
+        poner_en_paquete(to_pack, pack)
+        reservation.write({"package_id": pack.id})
+    else:
+        pack = batch.picking_ids[0]._put_in_pack(to_pack, False)
+        pack.write({"is_sticker": is_sticker, "is_certificate": is_certificate})
+
+    # ✅ Las líneas parcialmente empacadas se dividen: la copia queda en el paquete y la línea enviada
+    # conserva el saldo con qty_done en 0, esa es la que vuelve a quedar pendiente de empacar
+    to_pack.filtered(lambda ml: float_is_zero(ml.qty_done, precision_rounding=ml.product_uom_id.rounding)).write({"is_done_item_pack": False})
+
+    return pack, errores
+
+
+def poner_en_paquete(move_lines, package):
+    """Pone ``move_lines`` (con cantidad hecha) en ``package`` con el mismo criterio de ``stock.picking._put_in_pack``:
+    las líneas con cantidad parcial se dividen y la copia con la cantidad hecha es la que queda en el paquete."""
+    to_pack = move_lines.browse()
+    for move_line in move_lines:
+        rounding = move_line.product_uom_id.rounding
+        if float_compare(move_line.qty_done, move_line.product_uom_qty, precision_rounding=rounding) >= 0:
+            to_pack |= move_line
+            continue
+
+        done_to_keep = move_line.qty_done
+        new_move_line = move_line.copy(default={"product_uom_qty": 0, "qty_done": done_to_keep})
+        move_line.write({"product_uom_qty": float_round(move_line.product_uom_qty - done_to_keep, precision_rounding=rounding, rounding_method="HALF-UP"), "qty_done": 0.0})
+        new_move_line.write({"product_uom_qty": done_to_keep})
+        to_pack |= new_move_line
+
+    # Tipo de paquete del empaque de los productos, si es uno solo
+    package_type = to_pack.move_id.product_packaging_id.package_type_id
+    if not package.package_type_id and len(package_type) == 1:
+        package.package_type_id = package_type
+
+    to_pack.write({"result_package_id": package.id})
+
+
+def buscar_batches_packing(allowed_warehouses):
+    """Batches de packing en progreso de los almacenes permitidos, según sus pasos de entrega, en una sola búsqueda."""
+    tipos_por_almacen = obtener_tipos_packing(request.env)
+    picking_type_ids = [type_id for warehouse in allowed_warehouses for type_id in tipos_por_almacen.get(warehouse.id, [])]
+    if not picking_type_ids:
+        return request.env["stock.picking.batch"].sudo()
+
+    # ✅ Buscar lotes en progreso de todos los tipos de operación elegibles
+    return request.env["stock.picking.batch"].sudo().search([("state", "=", "in_progress"), ("picking_type_id", "in", picking_type_ids)])
+
+
+def obtener_tipos_packing(env):
+    """Devuelve ``{id almacén: [ids de tipos de operación de packing]}`` para todos los almacenes.
+
+    El tipo elegible sale de ``delivery_steps`` (``SECUENCIA_PACKING_POR_PASOS``). El mapa se guarda en una
+    cache del proceso junto con una versión (última modificación y número de registros de almacenes y
+    tipos de operación), así cualquier cambio de configuración la invalida también en los demás workers."""
+    Warehouse = env["stock.warehouse"].sudo()
+    PickingType = env["stock.picking.type"].sudo()
+
+    env.cr.execute(
+        f"""
+        SELECT (SELECT max(write_date) FROM {Warehouse._table}), (SELECT count(*) FROM {Warehouse._table}),
+               (SELECT max(write_date) FROM {PickingType._table}), (SELECT count(*) FROM {PickingType._table})
+        """
+    )
+    stamp = env.cr.fetchone()
+
+    cached = _TIPOS_PACKING_CACHE.get(env.cr.dbname)
+    if cached and cached[0] == stamp:
+        return cached[1]
+
+    # ✅ Código de secuencia de packing de cada almacén según sus pasos de entrega
+    sequence_by_warehouse = {row["id"]: SECUENCIA_PACKING_POR_PASOS.get(row["delivery_steps"]) for row in Warehouse.search_read([], ["delivery_steps"])}
+
+    tipos_por_almacen = {}
+    picking_types = PickingType.search_read([("warehouse_id", "in", list(sequence_by_warehouse)), ("sequence_code", "in", list(set(SECUENCIA_PACKING_POR_PASOS.values())))], ["warehouse_id", "sequence_code"])
+    for row in picking_types:
+        warehouse_id = row["warehouse_id"][0]
+        if row["sequence_code"] == sequence_by_warehouse.get(warehouse_id):
+            tipos_por_almacen.setdefault(warehouse_id, []).append(row["id"])
+
+    _TIPOS_PACKING_CACHE[env.cr.dbname] = (stamp, tipos_por_almacen)
+    return tipos_por_almacen
+
+
+def construir_batch_packing(batch, picking_strategy):
+    """Arma un batch de packing con sus pedidos, productos pendientes y paquetes.
+    Devuelve None si el batch no tiene pedidos con productos pendientes.
+
+    Las líneas de todos los pedidos se recorren una sola vez y se indexan por pedido y por paquete,
+    en lugar de filtrar las líneas de cada pedido por cada paquete."""
+    if not batch.move_line_ids:
+        return None
+
+    user_info = {
+        "user_id": batch.user_id.id if batch.user_id else 0,
+        "user_name": batch.user_id.name if batch.user_id else "Desconocido",
+    }
+
+    array_batch_temp = {
+        "id": batch.id,
+        "name": batch.name,
+        "scheduleddate": batch.scheduled_date,
+        "state": batch.state,
+        "user_id": user_info["user_id"],
+        "user_name": user_info["user_name"],
+        "order_by": picking_strategy.picking_priority_app if picking_strategy else "",
+        "order_picking": picking_strategy.picking_order_app if picking_strategy else "",
+        "picking_type_id": batch.picking_type_id.display_name if batch.picking_type_id else "N/A",
+        "cantidad_pedidos": 0,
+        "start_time_pack": batch.start_time_pack or "",
+        "end_time_pack": batch.end_time_pack or "",
+        "zona_entrega": batch.picking_ids[0].delivery_zone_id.name if batch.picking_ids and batch.picking_ids[0].delivery_zone_id else "N/A",
+        "zona_entrega_tms": batch.picking_ids[0].delivery_zone_tms if batch.picking_ids and batch.picking_ids[0].delivery_zone_tms else "N/A",
+        "order_tms": batch.picking_ids[0].order_tms if batch.picking_ids and batch.picking_ids[0].order_tms else "N/A",
+        "lista_pedidos": [],
+    }
+
+    # ✅ Indexar en una sola pasada las líneas de todos los pedidos del batch
+    lines_by_picking = {}
+    for move_line in batch.picking_ids.move_line_ids:
+        lines_by_picking.setdefault(move_line.picking_id.id, []).append(move_line)
+
+    # ✅ Códigos de barras y empaques por producto, calculados una sola vez
+    has_barcode_ids = "barcode_ids" in batch.env["product.product"]._fields
+    barcodes_by_product = {}
+
+    def datos_producto(product):
+        if product.id not in barcodes_by_product:
+            barcodes_by_product[product.id] = (
+                [barcode.name for barcode in product.barcode_ids if barcode.name] if has_barcode_ids else [],
+                [(pack.barcode, pack.qty) for pack in product.packaging_ids if pack.barcode],
+            )
+        return barcodes_by_product[product.id]
+
+    valid_pickings_found = False
+
+    for picking in batch.picking_ids:
+        move_lines = lines_by_picking.get(picking.id, [])
+
+        pedido = {
+            "id": picking.id,
+            "batch_id": batch.id,
+            "name": picking.name,
+            "referencia": picking.origin,
+            "contacto": picking.partner_id.id if picking.partner_id else 0,
+            "contacto_name": picking.partner_id.name if picking.partner_id else "N/A",
+            "tipo_operacion": picking.picking_type_id.name if picking.picking_type_id else "N/A",
+            "cantidad_productos": 0,
+            "cantidad_productos_total": len(move_lines),
+            "zona_entrega": picking.delivery_zone_id.name if picking.delivery_zone_id else "",
+            "zona_entrega_tms": picking.delivery_zone_tms if picking.delivery_zone_tms else "",
+            "order_tms": picking.order_tms if picking.order_tms else "",
+            "numero_paquetes": 0,
+            "lista_productos": [],
+            "lista_paquetes": [],
+        }
+
+        # Paquetes en orden de aparición (primero los de origen y luego los de destino) y líneas empacadas de cada uno
+        source_packages = {}
+        result_packages = {}
+        packed_lines_by_package = {}
+
+        # ✅ Procesar líneas de movimiento
+        for move_line in move_lines:
+            if move_line.package_id:
+                source_packages.setdefault(move_line.package_id.id, move_line.package_id)
+            if move_line.result_package_id:
+                result_packages.setdefault(move_line.result_package_id.id, move_line.result_package_id)
+
+            if move_line.is_done_item_pack:
+                for pack_id in {move_line.package_id.id, move_line.result_package_id.id} - {False}:
+                    packed_lines_by_package.setdefault(pack_id, []).append(move_line)
+                continue
+
+            location = move_line.location_id
+            location_dest = move_line.location_dest_id
+
+            product = move_line.product_id
+            lot = move_line.lot_id
+            barcodes, packagings = datos_producto(product)
+
+            productos = {
+                "id_move": move_line.id,
+                "product_id": [product.id, product.name],
+                "batch_id": batch.id,
+                "pedido_id": picking.id,
+                "id_product": product.id if product else 0,
+                "picking_id": picking.id,
+                "lote_id": lot.id if lot else "",
+                "lot_id": [lot.id, lot.name if lot else ""] if lot else [],
+                "expire_date": lot.expiration_date or "",
+                "location_id": [location.id, location.display_name if location else ""],
+                "barcode_location": location.barcode if location else "",
+                "location_dest_id": [location_dest.id, location_dest.name if location_dest else ""],
+                "barcode_location_dest": location_dest.barcode if location_dest else "",
+                "other_barcode": [{"barcode": barcode, "batch_id": batch.id, "id_move": move_line.id, "id_product": product.id} for barcode in barcodes],
+                "quantity": move_line.product_uom_qty,
+                "tracking": product.tracking if product else "",
+                "barcode": product.barcode if product else "",
+                "product_packing": [{"barcode": barcode, "cantidad": qty, "batch_id": batch.id, "id_move": move_line.id, "id_product": product.id} for barcode, qty in packagings],
+                "weight": product.weight if product else 0,
+                "unidades": product.uom_id.name if product.uom_id else "UND",
+                "rimoval_priority": location.priority_picking,
+            }
+
+            pedido["lista_productos"].append(productos)
+
+        pedido["cantidad_productos"] = len(pedido["lista_productos"])
+        pedido["numero_paquetes"] = len(source_packages)
+
+        # ✅ Procesar paquetes con productos empaquetados (is_done_item_pack == True)
+        for pack in list(source_packages.values()) + list(result_packages.values()):
+            move_lines_in_package = packed_lines_by_package.get(pack.id, [])
+
+            package = {
+                "name": pack.name,
+                "id": pack.id,
+                "batch_id": batch.id,
+                "pedido_id": picking.id,
+                "cantidad_productos": len(move_lines_in_package),
+                "lista_productos_in_packing": [],
+                "is_sticker": pack.is_sticker,
+                "is_certificate": pack.is_certificate,
+                "fecha_creacion": pack.create_date.strftime("%Y-%m-%d") if pack.create_date else "",
+                "fecha_actualizacion": pack.write_date.strftime("%Y-%m-%d") if pack.write_date else "",
+            }
+            pedido["lista_paquetes"].append(package)
+
+            for move_line in move_lines_in_package:
+                product = move_line.product_id
+                lot = move_line.lot_id
+
+                product_in_packing = {
+                    "id_move": move_line.id,
+                    "pedido_id": picking.id,
+                    "batch_id": batch.id,
+                    "product_id": [product.id, product.name],
+                    "package_name": pack.name,
+                    "quantity_separate": move_line.qty_done,
+                    "unidades": product.uom_id.name if product.uom_id else "UND",
+                    "weight": product.weight if product else 0,
+                    "lote_id": [lot.id, lot.name if lot else ""] if lot else [],
+                    "observacion": move_line.new_observation_packing,
+                    "id_package": pack.id,
+                    "quantity": move_line.product_uom_qty,
+                    "tracking": product.tracking if product else "",
+                }
+
+                package["lista_productos_in_packing"].append(product_in_packing)
+
+        if pedido["lista_productos"]:
+            array_batch_temp["lista_pedidos"].append(pedido)
+            valid_pickings_found = True
+
+    # Solo añadir el batch al array final si tiene pedidos válidos
+    if not valid_pickings_found:
+        return None
+
+    array_batch_temp["cantidad_pedidos"] = len(array_batch_temp["lista_pedidos"])
+    return array_batch_temp
+
+
+def iterar_batches_packing(env, batch_ids):
+    """Genera los batches de packing de ``batch_ids`` uno a uno, procesándolos por bloques."""
+    picking_strategy = env["picking.strategy"].sudo().browse(1)
+
+    for batches in iterar_en_bloques(env["stock.picking.batch"].sudo().browse(batch_ids)):
+        for batch in batches:
+            array_batch_temp = construir_batch_packing(batch, picking_strategy)
+            if array_batch_temp:
+                yield array_batch_temp
+
+
 def procesar_fecha_naive(fecha_transaccion, zona_horaria_cliente):
     if fecha_transaccion:
         # Convertir la fecha enviada a datetime y agregar la zona horaria del cliente
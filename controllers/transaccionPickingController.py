@@ -1,16 +1,46 @@
 # -*- coding: utf-8 -*-
-from odoo import http
+from odoo import fields, http
 from odoo.http import request
 from odoo.exceptions import AccessError
 from datetime import datetime, timedelta
 import pytz
+import re
+
+from psycopg2.extras import execute_values
+
+from .ndjsonStream import iterar_en_bloques, respuesta_json, respuesta_ndjson
+from ..models.api_cache_version import CACHE_UBICACIONES_USUARIO
+
+# Margen de solapamiento del cursor de sincronización, cubre transacciones que confirman después de tomar el cursor
+DELTA_SYNC_MARGIN = timedelta(seconds=30)
+
+# Campos de /api/send_batch con valor propio de cada línea (se escriben con un UPDATE por conjunto); el resto
+# se comparte entre las líneas de un envío y se escribe por grupos con el ORM
+CAMPOS_PROPIOS_LINEA = ("qty_done", "time", "date_transaction_picking")
+
+# Cache por proceso de las ubicaciones de cada usuario WMS: {(base de datos, id usuario WMS): (versión, ids de ubicaciones)}
+_UBICACIONES_USUARIO_CACHE = {}
+
+# Criterio de la ruta de picking para cada valor de picking.strategy.picking_priority_app (los campos de list_items
+# por los que ordenaba la app): "prioridad" = prioridad de picking y nombre de ubicación, "ubicacion" = solo el nombre
+ORDEN_RUTA = {
+    "rimoval_priority": "prioridad",
+    "location_id": "ubicacion",
+}
+ORDEN_RUTA_DEFECTO = "prioridad"
+
+# Sentido de la ruta para cada valor de picking.strategy.picking_order_app (True = descendente); por defecto ascendente
+SENTIDO_RUTA = {
+    "asc": False,
+    "desc": True,
+}
 
 
 class TransaccionDataPicking(http.Controller):
 
     ## GET Transacciones batchs para picking
     @http.route("/api/batchs", auth="user", type="json", methods=["GET"])
-    def get_batches(self):
+    def get_batches(self, **kwargs):
         try:
             user = request.env.user
 
@@ -18,6 +48,21 @@ class TransaccionDataPicking(http.Controller):
             if not user:
                 return {"code": 400, "msg": "Usuario no encontrado"}
 
+            # ✅ Cursor de sincronización: si llega 'since' solo se devuelven los cambios posteriores
+            since = kwargs.get("since")
+            since_dt = None
+            if since:
+                try:
+                    since_dt = fields.Datetime.to_datetime(since) - DELTA_SYNC_MARGIN
+                except ValueError:
+                    return {"code": 400, "msg": "Formato de 'since' inválido. Debe ser 'YYYY-MM-DD HH:MM:SS'"}
+
+            # Marca del servidor tomada antes de leer, para no perder cambios concurrentes
+            cursor = fields.Datetime.to_string(request.env.cr.now())
+
+            # ✅ Modo normalizado: catálogo de productos, ubicaciones, lotes y pedidos + referencias en las líneas
+            catalogo = nuevo_catalogo_picking() if kwargs.get("normalized") else None
+
             # obtener la configuracion picking de la app
             config_picking = request.env["picking.config.general"].sudo().browse(1)
 
@@ -30,164 +75,124 @@ class TransaccionDataPicking(http.Controller):
             if not user_wms or not user_wms.zone_ids:
                 return {"code": 400, "msg": "El usuario no tiene zonas asignadas"}
 
-            # ✅ Obtener ubicaciones de las zonas asignadas
-            all_location_ids = list({loc_id for zone in user_wms.zone_ids.sudo().read(["location_ids"]) for loc_id in zone["location_ids"]})
+            # ✅ Obtener ubicaciones de las zonas asignadas (cache por usuario)
+            user_location_ids = obtener_ubicaciones_usuario(user_wms)
 
-            if not all_location_ids:
+            if not user_location_ids:
                 return {"code": 400, "msg": "El usuario no tiene ubicaciones asociadas"}
 
-            # ✅ Obtener ubicaciones en bloques
-            chunk_size = 100
-            locations = []
-            for i in range(0, len(all_location_ids), chunk_size):
-                chunk = all_location_ids[i : i + chunk_size]
-                locations.extend(request.env["stock.location"].sudo().browse(chunk).read(["id", "name", "complete_name", "priority_picking", "barcode"]))
-
-            user_location_ids = [location["id"] for location in locations]
-
-            search_domain = [("state", "=", "in_progress"), ("picking_type_code", "=", "internal")]
-
-            # ✅ Filtrar por responsable si config_picking es 'responsible'
-            if config_picking.picking_type == "responsible":
-                search_domain.append(("user_id", "=", user.id))  # Agregar filtro por usuario responsable
-                print("Filtro por responsable")
-                print(config_picking)
+            search_domain = dominio_batches_picking(user, config_picking)
 
             batchs = request.env["stock.picking.batch"].sudo().search(search_domain)
 
+            # ✅ Sin registro de eliminaciones que cubra el cursor (modelo sin tabla o cursor más antiguo que la retención):
+            # se responde la sincronización completa y el cliente reemplaza sus datos
+            resync = False
+            if since_dt:
+                tracked_since = request.env["api.sync.tombstone"].sudo().tracked_since("move.line.unified")
+                if not tracked_since or since_dt < tracked_since:
+                    since_dt = None
+                    resync = True
+
             # ✅ Verificar si no hay lotes encontrados
-            if not batchs:
-                return {"code": 200, "msg": "No tienes batches asignados"}
+            if not batchs and not since_dt:
+                response = {"code": 200, "msg": "No tienes batches asignados", "cursor": cursor}
+                if resync:
+                    response["resync"] = True
+                return response
+
+            removed_batches = set()
+            removed_items = set()
+            visible_batch_ids = set()
+            if since_dt:
+                MoveUnified = request.env["move.line.unified"].sudo()
+                active_batch_ids = set(batchs.ids)
+                user_locations = set(user_location_ids)
+
+                # ✅ Líneas modificadas desde el cursor, también las que salieron de las zonas del usuario, y líneas eliminadas
+                changed_moves = MoveUnified.search_read(
+                    [("write_date", ">=", since_dt), "|", ("stock_picking_batch_id", "!=", False), ("location_id", "in", user_location_ids)],
+                    ["stock_picking_batch_id", "location_id", "is_done_item"],
+                )
+                deleted_moves = request.env["api.sync.tombstone"].sudo().deleted_since("move.line.unified", since_dt)
+
+                changed_batch_ids = {move["stock_picking_batch_id"][0] for move in changed_moves if move["stock_picking_batch_id"]}
+                changed_batch_ids |= set(request.env["stock.picking.batch"].sudo().search([("write_date", ">=", since_dt), ("picking_type_code", "=", "internal")]).ids)
+                changed_batch_ids |= {move["batch_id"] for move in deleted_moves if move["batch_id"]}
+
+                # ✅ Batches que el usuario pudo recibir: con líneas (pendientes o no) o líneas eliminadas en sus ubicaciones
+                visible_batch_ids = {
+                    group["stock_picking_batch_id"][0]
+                    for group in MoveUnified.read_group(
+                        [("stock_picking_batch_id", "in", list(changed_batch_ids)), ("location_id", "in", user_location_ids)],
+                        ["stock_picking_batch_id"],
+                        ["stock_picking_batch_id"],
+                        lazy=False,
+                    )
+                }
+                visible_batch_ids |= {move["batch_id"] for move in deleted_moves if move["batch_id"] and move["location_id"] in user_locations}
+
+                # Tombstones: batches visibles que ya no están en progreso; líneas completadas, fuera de un batch activo,
+                # fuera de las zonas del usuario o eliminadas
+                removed_batches = visible_batch_ids - active_batch_ids
+                for move in changed_moves:
+                    batch_id = move["stock_picking_batch_id"][0] if move["stock_picking_batch_id"] else False
+                    if batch_id and batch_id not in visible_batch_ids:
+                        continue
+                    if move["is_done_item"] or batch_id not in active_batch_ids or not move["location_id"] or move["location_id"][0] not in user_locations:
+                        removed_items.add(move["id"])
+                removed_items |= {move["res_id"] for move in deleted_moves if move["batch_id"] in visible_batch_ids or move["location_id"] in user_locations}
+
+                batchs = batchs.filtered(lambda b: b.id in changed_batch_ids)
+
+            # ✅ Cargar movimientos, productos, lotes, ubicaciones y pedidos de todos los batches en consultas por conjunto
+            datos = cargar_datos_picking(
+                batchs,
+                [("location_id", "in", user_location_ids), ("is_done_item", "=", False)],
+                ["product_id", "lot_id", "location_id", "location_dest_id", "product_uom_qty", "write_date"],
+            )
 
             array_batch = []
             for batch in batchs:
                 # ✅ Obtener movimientos unificados
-                move_unified_ids = request.env["move.line.unified"].sudo().search([("stock_picking_batch_id", "=", batch.id), ("location_id", "in", user_location_ids), ("is_done_item", "=", False)])
+                stock_moves = datos["moves_by_batch"].get(batch.id, [])
 
-                if not move_unified_ids:
+                if not stock_moves:
+                    if batch.id in visible_batch_ids:
+                        removed_batches.add(batch.id)
                     continue
 
-                stock_moves = move_unified_ids.read(["product_id", "lot_id", "location_id", "location_dest_id", "product_uom_qty"])
+                # En modo delta un batch modificado se envía completo; si no, solo sus líneas modificadas
+                full_sync = not since_dt or batch.write_date >= since_dt
 
-                array_batch_temp = {
-                    "id": batch.id,
-                    "name": batch.name or "",
-                    "user_name": user.name,
-                    "user_id": user.id,
-                    "responsable": batch.user_id and batch.user_id.name or "",
-                    "rol": user_wms.user_rol or "USER",
-                    "order_by": picking_strategy.picking_priority_app,
-                    "order_picking": picking_strategy.picking_order_app,
-                    "scheduleddate": batch.scheduled_date or "",
-                    "state": batch.state or "",
-                    "picking_type_id": batch.picking_type_id.display_name if batch.picking_type_id else "N/A",
-                    "observation": "",
-                    "is_wave": batch.is_wave,
-                    "muelle": batch.location_id.display_name if batch.location_id else "SIN-MUELLE",
-                    "id_muelle": batch.location_id.id if batch.location_id else 0,
-                    "barcode_muelle": batch.location_id.barcode or "",
-                    "count_items": len(stock_moves),
-                    "total_quantity_items": sum(move["product_uom_qty"] for move in stock_moves),
-                    "start_time_pick": batch.start_time_pick or "",
-                    "end_time_pick": batch.end_time_pick or "",
-                    "zona_entrega": batch.picking_ids[0].delivery_zone_id.name if batch.picking_ids and batch.picking_ids[0].delivery_zone_id else "SIN-ZONA",
-                    # "zona_entrega_tms": batch.picking_ids[0].delivery_zone_tms if batch.picking_ids and batch.picking_ids[0].delivery_zone_tms else "N/A",
-                    # "order_tms": batch.picking_ids[0].order_tms if batch.picking_ids and batch.picking_ids[0].order_tms else "N/A",
-                    "list_items": [],
-                }
-
-                product_ids = {move["product_id"][0] for move in stock_moves}
-                products = {prod.id: prod for prod in request.env["product.product"].sudo().browse(product_ids)}
+                array_batch_temp = construir_batch_picking(batch, user, user_wms, picking_strategy, stock_moves, datos["picking_by_batch"].get(batch.id))
 
-                location_ids = {move["location_id"][0] for move in stock_moves}
-                locations_dict = {loc.id: loc for loc in request.env["stock.location"].sudo().browse(location_ids)}
+                # ✅ Ordenar las líneas según la ruta de picking configurada
+                stock_moves = ordenar_moves_picking(stock_moves, datos, picking_strategy)
 
                 for move in stock_moves:
-                    product = products.get(move["product_id"][0])
-                    location = locations_dict.get(move["location_id"][0])
-                    location_dest = locations_dict.get(move["location_dest_id"][0])
-
-                    # ✅ Verificar si 'barcode_ids' existe en el modelo
-                    if "barcode_ids" in product.fields_get():
-                        array_all_barcode = (
-                            [
-                                {
-                                    "barcode": barcode.name,
-                                    "batch_id": batch.id,
-                                    "id_move": move["id"],
-                                    "product_id": [move["product_id"][0] if move["product_id"] else 0, move["product_id"][1] if len(move["product_id"]) > 1 else "N/A"],
-                                }
-                                for barcode in product.barcode_ids
-                            ]
-                            if product.barcode_ids
-                            else []
-                        )
-                    else:
-                        array_all_barcode = []
-
-                    # ✅ Obtener empaques del producto
-                    array_packing = (
-                        [
-                            {
-                                "barcode": pack.barcode,
-                                "cantidad": pack.qty,
-                                "batch_id": batch.id,
-                                "id_move": move["id"],
-                                "product_id": move["product_id"][0] if move["product_id"] else 0,
-                            }
-                            for pack in product.packaging_ids
-                            if pack.barcode  # Solo incluye si pack.barcode es válido
-                        ]
-                        if product.packaging_ids  # Verifica que product.packaging_ids no sea None o vacío
-                        else []
-                    )
-
-                    # ✅ Buscar el picking_id desde stock.move
-                    picking = request.env["stock.picking"].sudo().search([("batch_id", "=", batch.id)], limit=1)  # Obtiene un picking asociado al batch
-                    picking_id = picking.id if picking else 0
-
-                    # ✅ Obtener el nombre del pedido
-                    picking_name = picking.display_name if picking else ""
-
-                    # ✅ Obtener la zona de entrega del picking
-                    delivery_zone_name = picking.delivery_zone_id.display_name if picking and picking.delivery_zone_id else "SIN-ZONA"
-                    delivery_zone_id = picking.delivery_zone_id.id if picking and picking.delivery_zone_id else 0
-
-                    array_batch_temp["list_items"].append(
-                        {
-                            "batch_id": batch.id,
-                            "id_move": move["id"],
-                            "picking_id": picking_id,
-                            "id_product": move["product_id"][0] if move["product_id"] else 0,
-                            "product_id": [move["product_id"][0] if move["product_id"] else 0, move["product_id"][1] if len(move["product_id"]) > 1 else "N/A"],
-                            "lote_id": move["lot_id"][0] if move["lot_id"] else "",
-                            "lot_id": [
-                                move["lot_id"][0] if move.get("lot_id") and isinstance(move["lot_id"], (list, tuple)) and len(move["lot_id"]) > 0 else 0,
-                                move["lot_id"][1] if move.get("lot_id") and isinstance(move["lot_id"], (list, tuple)) and len(move["lot_id"]) > 1 else move["lot_id"] if isinstance(move["lot_id"], str) else "N/A",
-                            ],
-                            "expire_date": (str(request.env["stock.production.lot"].sudo().browse(move["lot_id"][0]).expiration_date or "") if move.get("lot_id") and isinstance(move["lot_id"], (list, tuple)) and len(move["lot_id"]) > 0 else ""),
-                            "location_id": move["location_id"],
-                            "rimoval_priority": location.priority_picking or 0,
-                            "barcode_location": location.barcode if location else "",
-                            "location_dest_id": move["location_dest_id"],
-                            "barcode_location_dest": location_dest.barcode if location_dest else "",
-                            "quantity": move["product_uom_qty"],
-                            "barcode": product.barcode if product else "",
-                            "other_barcode": array_all_barcode,
-                            "product_packing": array_packing,
-                            "weight": product.weight if product else 0,
-                            "unidades": product.uom_id.name if product else "",
-                            "zona_entrega": delivery_zone_name,
-                            "id_zona_entrega": delivery_zone_id,
-                            "pedido": picking_name,
-                            "pedido_id": picking_id,
-                        }
-                    )
+                    if full_sync or move["write_date"] >= since_dt:
+                        if catalogo is not None:
+                            array_batch_temp["list_items"].append(construir_item_normalizado(batch.id, move, datos, catalogo))
+                        else:
+                            array_batch_temp["list_items"].append(construir_item_picking(batch.id, move, datos))
 
                 if array_batch_temp["list_items"]:
+                    array_batch_temp["sync"] = "full" if full_sync else "delta"
                     array_batch.append(array_batch_temp)
 
-            return {"code": 200, "result": array_batch}
+            response = {"code": 200, "result": array_batch, "cursor": cursor}
+
+            if since_dt:
+                response.update({"removed_batches": sorted(removed_batches), "removed_items": sorted(removed_items)})
+
+            if resync:
+                response["resync"] = True
+
+            if catalogo is not None:
+                response["catalog"] = catalogo
+
+            return response
 
         except AccessError as e:
             return {"code": 403, "msg": f"Acceso denegado: {str(e)}"}
@@ -197,9 +202,43 @@ class TransaccionDataPicking(http.Controller):
                 return {"code": 400, "msg": "Indicar protocolo http o https de url_rpc"}
             return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
 
+    ## GET Transacciones batchs para picking en streaming (NDJSON, un batch por línea)
+    @http.route("/api/batchs/stream", auth="user", type="http", methods=["GET"], csrf=False)
+    def get_batches_stream(self, **kwargs):
+        try:
+            user = request.env.user
+
+            # ✅ Validar usuario
+            if not user:
+                return respuesta_json({"code": 400, "msg": "Usuario no encontrado"})
+
+            # obtener la configuracion picking de la app
+            config_picking = request.env["picking.config.general"].sudo().browse(1)
+
+            # ✅ Validar usuario WMS y sus zonas asignadas
+            user_wms = request.env["appwms.users_wms"].sudo().search([("user_id", "=", user.id)], limit=1)
+
+            if not user_wms or not user_wms.zone_ids:
+                return respuesta_json({"code": 400, "msg": "El usuario no tiene zonas asignadas"})
+
+            # ✅ Obtener ubicaciones de las zonas asignadas (cache por usuario)
+            user_location_ids = obtener_ubicaciones_usuario(user_wms)
+
+            if not user_location_ids:
+                return respuesta_json({"code": 400, "msg": "El usuario no tiene ubicaciones asociadas"})
+
+            batch_ids = request.env["stock.picking.batch"].sudo().search(dominio_batches_picking(user, config_picking)).ids
+
+            return respuesta_ndjson(iterar_batches_picking, user_wms.id, batch_ids, user_location_ids)
+
+        except AccessError as e:
+            return respuesta_json({"code": 403, "msg": f"Acceso denegado: {str(e)}"})
+        except Exception as err:
+            return respuesta_json({"code": 400, "msg": f"Error inesperado: {str(err)}"})
+
     ## GET Transacciones batchs para picking por ID
     @http.route("/api/batch/<int:id_batch>", auth="user", type="json", methods=["GET"])
-    def get_batch_by_id(self, id_batch):
+    def get_batch_by_id(self, id_batch, **kwargs):
         try:
             user = request.env.user
 
@@ -216,36 +255,29 @@ class TransaccionDataPicking(http.Controller):
             if not user_wms or not user_wms.zone_ids:
                 return {"code": 400, "msg": "El usuario no tiene zonas asignadas"}
 
-            # ✅ Obtener ubicaciones de las zonas asignadas
-            zone_locations = user_wms.zone_ids.sudo().read(["name", "warehouse_id", "location_ids"])
+            # ✅ Obtener ubicaciones de las zonas asignadas (cache por usuario)
+            user_location_ids = obtener_ubicaciones_usuario(user_wms)
 
-            all_location_ids = []
-            for zone in zone_locations:
-                all_location_ids.extend(zone["location_ids"])
-
-            all_location_ids = list(set(all_location_ids))  # Eliminar duplicados
-
-            # ✅ Obtener ubicaciones por bloques para evitar sobrecarga
-            chunk_size = 100
-            locations = []
-            for i in range(0, len(all_location_ids), chunk_size):
-                chunk = all_location_ids[i : i + chunk_size]
-                locations.extend(request.env["stock.location"].sudo().browse(chunk).read(["id", "name", "complete_name"]))
-
-            if not locations:
+            if not user_location_ids:
                 return {"code": 400, "msg": "El usuario no tiene ubicaciones asociadas"}
 
-            user_location_ids = [location["id"] for location in locations]
-
             # ✅ Obtener información del batch específico
             batch = request.env["stock.picking.batch"].sudo().browse(id_batch)
             if not batch.exists():
                 return {"code": 404, "msg": "Batch no encontrado"}
 
-            # ✅ Validar si el batch tiene movimientos unificados
-            move_unified_ids = request.env["move.line.unified"].sudo().search([("stock_picking_batch_id", "=", batch.id), ("is_done_item", "=", True), ("user_operator_id", "=", user.id)])
+            # ✅ Cargar movimientos unificados realizados por el usuario con sus datos relacionados
+            datos = cargar_datos_picking(
+                batch,
+                [("is_done_item", "=", True), ("user_operator_id", "=", user.id)],
+                ["product_id", "lot_id", "location_id", "location_dest_id", "product_uom_qty", "qty_done", "date_transaction_picking", "new_observation", "time", "user_operator_id", "is_done_item"],
+            )
 
-            stock_moves = move_unified_ids.read()
+            stock_moves = datos["moves_by_batch"].get(batch.id, [])
+            picking = datos["picking_by_batch"].get(batch.id)
+
+            # ✅ Modo normalizado: catálogo de productos, ubicaciones, lotes y pedidos + referencias en las líneas
+            catalogo = nuevo_catalogo_picking() if kwargs.get("normalized") else None
 
             array_batch_temp = {
                 "id": batch.id,
@@ -268,100 +300,32 @@ class TransaccionDataPicking(http.Controller):
                 "items_separado": sum(move["qty_done"] for move in stock_moves),
                 "start_time_pick": batch.start_time_pick or "",
                 "end_time_pick": batch.end_time_pick or "",
-                "zona_entrega": batch.picking_ids[0].delivery_zone_id.name if batch.picking_ids and batch.picking_ids[0].delivery_zone_id else "SIN-ZONA",
+                "zona_entrega": picking["zona_entrega"] if picking and picking["zona_entrega"] else "SIN-ZONA",
                 "list_items": [],
             }
 
             # ✅ Procesar movimientos unificados
             for move in stock_moves:
-                product = request.env["product.product"].sudo().browse(move["product_id"][0])
-                location = request.env["stock.location"].sudo().browse(move["location_id"][0])
-                location_dest = request.env["stock.location"].sudo().browse(move["location_dest_id"][0])
-
-                # ✅ Obtener códigos de barras adicionales de manera dinámica
-                array_all_barcode = []
-                if "barcode_ids" in product.fields_get():
-                    array_all_barcode = (
-                        [
-                            {
-                                "barcode": barcode.name,
-                                "batch_id": batch.id,
-                                "id_move": move["id"],
-                                "product_id": [move["product_id"][0] if move["product_id"] else 0, move["product_id"][1] if len(move["product_id"]) > 1 else "N/A"],
-                            }
-                            for barcode in product.barcode_ids
-                        ]
-                        if product.barcode_ids
-                        else []
-                    )
+                detalle = {
+                    "quantity_done": move["qty_done"],
+                    "fecha_transaccion": move["date_transaction_picking"] or "",
+                    "observation": move["new_observation"] or "",
+                    "time_line": move["time"] or "",
+                    "operator_id": move["user_operator_id"][0] if move["user_operator_id"] else 0,
+                    "done_item": move["is_done_item"],
+                }
 
-                # ✅ Obtener empaques del producto
-                array_packing = (
-                    [
-                        {
-                            "barcode": pack.barcode,
-                            "cantidad": pack.qty,
-                            "batch_id": batch.id,
-                            "id_move": move["id"],
-                            "product_id": move["product_id"][0] if move["product_id"] else 0,
-                        }
-                        for pack in product.packaging_ids
-                        if pack.barcode  # Incluye solo si barcode no es falso
-                    ]
-                    if product.packaging_ids
-                    else []
-                )
+                if catalogo is not None:
+                    item = construir_item_normalizado(batch.id, move, datos, catalogo)
+                else:
+                    item = construir_item_picking(batch.id, move, datos)
+                    item["lot_id"] = [move["lot_id"][0] if move["lot_id"] else "", move["lot_id"][1] if move["lot_id"] else "N/A"]
 
-                # ✅ Obtener fecha de vencimiento (lote)
-                expire_date = ""
-                if move["lot_id"]:
-                    lot = request.env["stock.production.lot"].sudo().browse(move["lot_id"][0])
-                    expire_date = lot.expiration_date if lot else ""
-
-                # ✅ Buscar el picking_id desde stock.move
-                picking = request.env["stock.picking"].sudo().search([("batch_id", "=", batch.id)], limit=1)  # Obtiene un picking asociado al batch
-                picking_id = picking.id if picking else 0
-
-                # ✅ Obtener el nombre del pedido
-                picking_name = picking.display_name if picking else ""
-
-                # ✅ Obtener la zona de entrega del picking
-                delivery_zone_name = picking.delivery_zone_id.display_name if picking and picking.delivery_zone_id else "SIN-ZONA"
-                delivery_zone_id = picking.delivery_zone_id.id if picking and picking.delivery_zone_id else 0
-
-                array_batch_temp["list_items"].append(
-                    {
-                        "batch_id": batch.id,
-                        "id_move": move["id"],
-                        "picking_id": picking_id,
-                        "id_product": move["product_id"][0] if move["product_id"] else 0,
-                        "product_id": [move["product_id"][0] if move["product_id"] else 0, move["product_id"][1] if len(move["product_id"]) > 1 else "N/A"],
-                        "lote_id": move["lot_id"][0] if move["lot_id"] else "",
-                        "lot_id": [move["lot_id"][0] if move["lot_id"] else "", move["lot_id"][1] if move["lot_id"] else "N/A"],
-                        "expire_date": expire_date,
-                        "location_id": move["location_id"],
-                        "rimoval_priority": location.priority_picking,  # Prioridad de remoción
-                        "barcode_location": location.barcode if location.barcode else "",
-                        "location_dest_id": move["location_dest_id"],
-                        "barcode_location_dest": location_dest.barcode if location_dest.barcode else "",
-                        "quantity": move["product_uom_qty"],
-                        "quantity_done": move["qty_done"],
-                        "fecha_transaccion": move["date_transaction_picking"] or "",
-                        "observation": move["new_observation"] or "",
-                        "time_line": move["time"] or "",
-                        "operator_id": move["user_operator_id"][0] if move["user_operator_id"] else 0,
-                        "done_item": move["is_done_item"],
-                        "barcode": product.barcode,
-                        "other_barcode": array_all_barcode,
-                        "product_packing": array_packing,
-                        "weight": product.weight,
-                        "unidades": product.uom_id.name,
-                        "zona_entrega": delivery_zone_name,
-                        "id_zona_entrega": delivery_zone_id,
-                        "pedido": picking_name,
-                        "pedido_id": picking_id,
-                    }
-                )
+                item.update(detalle)
+                array_batch_temp["list_items"].append(item)
+
+            if catalogo is not None:
+                return {"code": 200, "result": array_batch_temp, "catalog": catalogo}
 
             return {"code": 200, "result": array_batch_temp}
 
@@ -370,9 +334,81 @@ class TransaccionDataPicking(http.Controller):
         except Exception as err:
             return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
 
+    ## POST Reservar las siguientes líneas de un batch wave para el operario (varios operarios en la misma ola)
+    @http.route("/api/batch/claim", auth="user", type="json", methods=["POST"])
+    def claim_batch_lines(self, **auth):
+        try:
+            user = request.env.user
+
+            # ✅ Validar usuario autenticado
+            if not user:
+                return {"code": 400, "msg": "Usuario no encontrado"}
+
+            id_batch = auth.get("id_batch")
+            cantidad = int(auth.get("cantidad", 10))
+            if cantidad <= 0:
+                return {"code": 400, "msg": "La cantidad de líneas debe ser mayor a cero"}
+
+            # ✅ Validar usuario WMS y sus zonas asignadas
+            user_wms = request.env["appwms.users_wms"].sudo().search([("user_id", "=", user.id)], limit=1)
+
+            if not user_wms or not user_wms.zone_ids:
+                return {"code": 400, "msg": "El usuario no tiene zonas asignadas"}
+
+            user_location_ids = obtener_ubicaciones_usuario(user_wms)
+
+            if not user_location_ids:
+                return {"code": 400, "msg": "El usuario no tiene ubicaciones asociadas"}
+
+            # ✅ Validar que el batch exista y sea una ola
+            batch = request.env["stock.picking.batch"].sudo().browse(id_batch)
+            if not batch.exists():
+                return {"code": 404, "msg": "Batch no encontrado"}
+
+            if not batch.is_wave:
+                return {"code": 400, "msg": "El batch no es una ola (is_wave)"}
+
+            picking_strategy = request.env["picking.strategy"].sudo().browse(1)
+            Claim = request.env["api.picking.claim"].sudo()
+
+            # ✅ Líneas pendientes en orden de ruta, sin las reservadas por otros operarios.
+            # Las reservas vigentes del mismo operario se incluyen primero, así un reintento devuelve las mismas líneas
+            datos = cargar_datos_picking(
+                batch,
+                [("location_id", "in", user_location_ids), ("is_done_item", "=", False)],
+                ["product_id", "lot_id", "location_id", "location_dest_id", "product_uom_qty"],
+            )
+            stock_moves = ordenar_moves_picking(datos["moves_by_batch"].get(batch.id, []), datos, picking_strategy)
+            claims = Claim.active_claims(batch.id)
+            own_ids = [move["id"] for move in stock_moves if claims.get(move["id"]) == user.id]
+            candidate_ids = own_ids + [move["id"] for move in stock_moves if move["id"] not in claims]
+
+            # ✅ Reservar con bloqueo de filas (SKIP LOCKED) y vencimiento configurable
+            ttl_minutes = int(request.env["ir.config_parameter"].sudo().get_param("api_onpoint.picking_claim_minutes", 15))
+            claimed_ids = set(Claim.claim_lines(batch.id, candidate_ids, cantidad, ttl_minutes))
+
+            return {
+                "code": 200,
+                "result": {
+                    "id_batch": batch.id,
+                    "expira_en_minutos": ttl_minutes,
+                    "pendientes": len(candidate_ids) - len(claimed_ids),
+                    "list_items": [construir_item_picking(batch.id, move, datos) for move in stock_moves if move["id"] in claimed_ids],
+                },
+            }
+
+        except AccessError as e:
+            return {"code": 403, "msg": f"Acceso denegado: {str(e)}"}
+        except Exception as err:
+            return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
+
     ## POST Transacciones enviar cantidades para valores unificados - send batch picking
     @http.route("/api/send_batch", auth="user", type="json", methods=["POST"])
     def send_batch(self, **auth):
+        # ✅ Idempotencia: un reintento con el mismo id_operacion devuelve la respuesta ya procesada
+        return request.env["api.idempotency.key"].sudo().run_once(auth.get("id_operacion"), "/api/send_batch", lambda: self._send_batch(**auth))
+
+    def _send_batch(self, **auth):
         try:
             # ✅ Autenticación del usuario
             user = request.env.user
@@ -390,6 +426,17 @@ class TransaccionDataPicking(http.Controller):
 
             array_result = []
 
+            # ✅ Validar todos los id_move en una sola consulta
+            MoveUnified = request.env["move.line.unified"].sudo()
+            existing_moves = MoveUnified.browse([move.get("id_move") for move in list_item if move.get("id_move")]).exists()
+            moves_by_id = {move_unified.id: move_unified for move_unified in existing_moves}
+
+            # Valores a escribir por id_move (si un id se repite, prevalece el último enviado)
+            values_by_move = {}
+
+            # Fecha por defecto común a todo el envío (UTC sin zona horaria, como procesar_fecha_naive)
+            fecha_envio = datetime.now(pytz.utc).replace(tzinfo=None)
+
             # ✅ Iterar sobre los movimientos de la lista
             for move in list_item:
                 id_move = move.get("id_move")
@@ -401,8 +448,8 @@ class TransaccionDataPicking(http.Controller):
                 fecha_transaccion = move.get("fecha_transaccion", "")
 
                 # Validar si el id_move existe
-                move_unified = request.env["move.line.unified"].sudo().browse(id_move)
-                if not move_unified.exists():
+                move_unified = moves_by_id.get(id_move)
+                if not move_unified:
                     array_result.append({"error": f"No se encontró este id_move: {id_move}"})
                     continue
 
@@ -413,16 +460,46 @@ class TransaccionDataPicking(http.Controller):
                 seconds = time_line % 60
                 formatted_time = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
 
-                # ✅ Actualizar movimiento
-                update_values = {"qty_done": cantidad, "new_observation": novedad, "time": formatted_time, "location_dest_id": muelle, "is_done_item": True, "date_transaction_picking": procesar_fecha_naive(fecha_transaccion, "America/Bogota") if fecha_transaccion else datetime.now(pytz.utc)}
+                # ✅ Valores del movimiento
+                update_values = {"qty_done": cantidad, "new_observation": novedad, "time": formatted_time, "location_dest_id": muelle, "is_done_item": True, "date_transaction_picking": procesar_fecha_naive(fecha_transaccion, "America/Bogota") if fecha_transaccion else fecha_envio}
 
                 if id_operario:
                     update_values["user_operator_id"] = id_operario
 
-                move_unified.write(update_values)
+                values_by_move[id_move] = update_values
 
                 array_result.append({"id_move": id_move, "id_batch": id_batch, "id_product": move_unified.product_id.id, "complete": f"Se actualizó correctamente el id_move: {id_move}"})
 
+            # ✅ Valores propios de cada línea (cantidad, tiempo, fecha) en un solo UPDATE por conjunto. Van primero,
+            # así al marcar is_done_item cada línea ya tiene su cantidad
+            if values_by_move:
+                lines = MoveUnified.browse(list(values_by_move))
+                lines.flush(list(CAMPOS_PROPIOS_LINEA))
+                execute_values(
+                    request.env.cr._obj,
+                    f"""
+                    UPDATE {MoveUnified._table} AS line
+                    SET qty_done = data.qty_done, "time" = data.time, date_transaction_picking = data.fecha,
+                        write_uid = {int(user.id)}, write_date = now() AT TIME ZONE 'UTC'
+                    FROM (VALUES %s) AS data(id, qty_done, time, fecha)
+                    WHERE line.id = data.id
+                    """,
+                    [(id_move, values["qty_done"], values["time"], values["date_transaction_picking"]) for id_move, values in values_by_move.items()],
+                    template="(%s, %s::numeric, %s::varchar, %s::timestamp)",
+                )
+                # El ORM no vio el UPDATE: se descarta su cache y se recalculan los campos que dependen de estos valores
+                lines.invalidate_cache(list(CAMPOS_PROPIOS_LINEA) + ["write_uid", "write_date"], lines.ids)
+                lines.modified(list(CAMPOS_PROPIOS_LINEA))
+
+            # ✅ Valores compartidos (muelle, operario, novedad, is_done_item) agrupados, con un write por grupo
+            lines_by_shared_values = {}
+            for id_move, update_values in values_by_move.items():
+                shared_values = tuple(sorted((field_name, value) for field_name, value in update_values.items() if field_name not in CAMPOS_PROPIOS_LINEA))
+                lines_by_shared_values.setdefault(shared_values, []).append(id_move)
+
+            for values, move_ids in lines_by_shared_values.items():
+                MoveUnified.browse(move_ids).write(dict(values))
+
             # ✅ Formatear tiempo total en 'HH:MM:SS'
             total_hours = total_time // 3600
             total_minutes = (total_time % 3600) // 60
@@ -467,39 +544,43 @@ class TransaccionDataPicking(http.Controller):
             if not user_wms or not user_wms.zone_ids:
                 return {"code": 400, "msg": "El usuario no tiene zonas asignadas"}
 
-            # ✅ Obtener ubicaciones de las zonas asignadas
-            all_location_ids = list({loc_id for zone in user_wms.zone_ids.sudo().read(["location_ids"]) for loc_id in zone["location_ids"]})
+            # ✅ Obtener ubicaciones de las zonas asignadas (cache por usuario)
+            user_location_ids = obtener_ubicaciones_usuario(user_wms)
 
-            if not all_location_ids:
+            if not user_location_ids:
                 return {"code": 400, "msg": "El usuario no tiene ubicaciones asociadas"}
 
-            # ✅ Obtener ubicaciones en bloques
-            chunk_size = 100
-            locations = []
-            for i in range(0, len(all_location_ids), chunk_size):
-                chunk = all_location_ids[i : i + chunk_size]
-                locations.extend(request.env["stock.location"].sudo().browse(chunk).read(["id", "name", "complete_name", "priority_picking", "barcode"]))
-
-            user_location_ids = [location["id"] for location in locations]
-
             state_batch = ["done", "in_progress"]
 
-            fecha_inicio = datetime.strptime(fecha_batch + " 00:00:00", "%Y-%m-%d %H:%M:%S")
-            fecha_fin = datetime.strptime(fecha_batch + " 23:59:59", "%Y-%m-%d %H:%M:%S")
-
-            # ✅ Obtener lotes (batches)
-            batchs = request.env["stock.picking.batch"].sudo().search([("state", "in", state_batch), ("picking_type_code", "=", "internal"), ("write_date", ">=", fecha_inicio), ("write_date", "<=", fecha_fin)])
+            # ✅ Rango de fechas: 'fecha_inicio'/'fecha_fin' o el día de 'fecha_batch'
+            try:
+                fecha_inicio = datetime.strptime(auth.get("fecha_inicio", fecha_batch) + " 00:00:00", "%Y-%m-%d %H:%M:%S")
+                fecha_fin = datetime.strptime(auth.get("fecha_fin", auth.get("fecha_inicio", fecha_batch)) + " 23:59:59", "%Y-%m-%d %H:%M:%S")
+            except ValueError:
+                return {"code": 400, "msg": "Formato de fecha inválido. Debe ser 'YYYY-MM-DD'"}
+
+            # ✅ Paginación
+            limit = int(auth.get("limit", 0)) or None
+            offset = int(auth.get("offset", 0))
+
+            # ✅ Totales por batch en una sola consulta agrupada sobre los movimientos unificados del operario
+            domain = [
+                ("is_done_item", "=", True),
+                ("user_operator_id", "=", user.id),
+                ("stock_picking_batch_id.state", "in", state_batch),
+                ("stock_picking_batch_id.picking_type_code", "=", "internal"),
+                ("stock_picking_batch_id.write_date", ">=", fecha_inicio),
+                ("stock_picking_batch_id.write_date", "<=", fecha_fin),
+            ]
+            MoveUnified = request.env["move.line.unified"].sudo()
+            groups = MoveUnified.read_group(domain, ["product_uom_qty:sum", "qty_done:sum"], ["stock_picking_batch_id"], offset=offset, limit=limit, lazy=False)
+            total = len(groups) if not limit and not offset else len(MoveUnified.read_group(domain, ["stock_picking_batch_id"], ["stock_picking_batch_id"], lazy=False))
+
+            # ✅ Obtener lotes (batches) de la página
+            batchs = request.env["stock.picking.batch"].sudo().browse([group["stock_picking_batch_id"][0] for group in groups])
 
             array_batch = []
-            for batch in batchs:
-                # ✅ Obtener movimientos unificados
-                move_unified_ids = request.env["move.line.unified"].sudo().search([("stock_picking_batch_id", "=", batch.id), ("is_done_item", "=", True), ("user_operator_id", "=", user.id)])
-
-                if not move_unified_ids:
-                    continue
-
-                stock_moves = move_unified_ids.read(["product_id", "lot_id", "location_id", "location_dest_id", "product_uom_qty", "qty_done"])
-
+            for batch, group in zip(batchs, groups):
                 array_batch_temp = {
                     "id": batch.id,
                     "name": batch.name or "",
@@ -515,14 +596,14 @@ class TransaccionDataPicking(http.Controller):
                     "is_wave": batch.is_wave,
                     "muelle": batch.location_id.display_name if batch.location_id else "SIN-MUELLE",
                     "id_muelle": batch.location_id.id if batch.location_id else "",
-                    "count_items": len(stock_moves),
-                    "total_quantity_items": sum(move["product_uom_qty"] for move in stock_moves),
-                    "items_separado": sum(move["qty_done"] for move in stock_moves),
+                    "count_items": group["__count"],
+                    "total_quantity_items": group["product_uom_qty"] or 0,
+                    "items_separado": group["qty_done"] or 0,
                 }
 
                 array_batch.append(array_batch_temp)
 
-            return {"code": 200, "result": array_batch}
+            return {"code": 200, "result": array_batch, "total": total}
 
         except AccessError as e:
             return {"code": 403, "msg": f"Acceso denegado: {str(e)}"}
@@ -530,6 +611,301 @@ class TransaccionDataPicking(http.Controller):
             return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
 
 
+def dominio_batches_picking(user, config_picking):
+    """Dominio de los batches de picking en progreso visibles para el usuario."""
+    search_domain = [("state", "=", "in_progress"), ("picking_type_code", "=", "internal")]
+
+    # ✅ Filtrar por responsable si config_picking es 'responsible'
+    if config_picking.picking_type == "responsible":
+        search_domain.append(("user_id", "=", user.id))  # Agregar filtro por usuario responsable
+
+    return search_domain
+
+
+def iterar_batches_picking(env, user_wms_id, batch_ids, user_location_ids):
+    """Genera los batches de picking de ``batch_ids`` uno a uno, cargando sus datos por bloques."""
+    user = env.user
+    user_wms = env["appwms.users_wms"].sudo().browse(user_wms_id)
+    picking_strategy = env["picking.strategy"].sudo().browse(1)
+
+    for batchs in iterar_en_bloques(env["stock.picking.batch"].sudo().browse(batch_ids)):
+        datos = cargar_datos_picking(
+            batchs,
+            [("location_id", "in", user_location_ids), ("is_done_item", "=", False)],
+            ["product_id", "lot_id", "location_id", "location_dest_id", "product_uom_qty"],
+            env=env,
+        )
+
+        for batch in batchs:
+            stock_moves = datos["moves_by_batch"].get(batch.id, [])
+            if not stock_moves:
+                continue
+
+            array_batch_temp = construir_batch_picking(batch, user, user_wms, picking_strategy, stock_moves, datos["picking_by_batch"].get(batch.id))
+            array_batch_temp["list_items"] = [construir_item_picking(batch.id, move, datos) for move in ordenar_moves_picking(stock_moves, datos, picking_strategy)]
+            yield array_batch_temp
+
+
+def construir_batch_picking(batch, user, user_wms, picking_strategy, stock_moves, picking):
+    """Cabecera de un batch de picking, con ``list_items`` vacío."""
+    return {
+        "id": batch.id,
+        "name": batch.name or "",
+        "user_name": user.name,
+        "user_id": user.id,
+        "responsable": batch.user_id and batch.user_id.name or "",
+        "rol": user_wms.user_rol or "USER",
+        "order_by": picking_strategy.picking_priority_app,
+        "order_picking": picking_strategy.picking_order_app,
+        "scheduleddate": batch.scheduled_date or "",
+        "state": batch.state or "",
+        "picking_type_id": batch.picking_type_id.display_name if batch.picking_type_id else "N/A",
+        "observation": "",
+        "is_wave": batch.is_wave,
+        "muelle": batch.location_id.display_name if batch.location_id else "SIN-MUELLE",
+        "id_muelle": batch.location_id.id if batch.location_id else 0,
+        "barcode_muelle": batch.location_id.barcode or "",
+        "count_items": len(stock_moves),
+        "total_quantity_items": sum(move["product_uom_qty"] for move in stock_moves),
+        "start_time_pick": batch.start_time_pick or "",
+        "end_time_pick": batch.end_time_pick or "",
+        "zona_entrega": picking["zona_entrega"] if picking and picking["zona_entrega"] else "SIN-ZONA",
+        # "zona_entrega_tms": batch.picking_ids[0].delivery_zone_tms if batch.picking_ids and batch.picking_ids[0].delivery_zone_tms else "N/A",
+        # "order_tms": batch.picking_ids[0].order_tms if batch.picking_ids and batch.picking_ids[0].order_tms else "N/A",
+        "list_items": [],
+    }
+
+
+def cargar_datos_picking(batchs, domain_moves, fields_moves, env=None):
+    """Carga los movimientos unificados de los batches junto con sus productos, códigos de barras,
+    empaques, lotes, ubicaciones y pedidos en un número fijo de consultas, sin importar cuántos
+    batches o líneas haya. Devuelve diccionarios indexados por id para armar la respuesta en memoria."""
+    env = env or request.env
+
+    # ✅ Movimientos unificados de todos los batches en una sola consulta
+    stock_moves = env["move.line.unified"].sudo().search_read([("stock_picking_batch_id", "in", batchs.ids)] + domain_moves, ["stock_picking_batch_id"] + fields_moves)
+
+    moves_by_batch = {}
+    for move in stock_moves:
+        moves_by_batch.setdefault(move["stock_picking_batch_id"][0], []).append(move)
+
+    # ✅ Productos con sus códigos de barras adicionales y empaques
+    Product = env["product.product"].sudo()
+    has_barcode_ids = "barcode_ids" in Product._fields
+    product_ids = list({move["product_id"][0] for move in stock_moves if move["product_id"]})
+    product_rows = Product.browse(product_ids).read(["barcode", "weight", "uom_id", "packaging_ids"] + (["barcode_ids"] if has_barcode_ids else []))
+
+    barcode_names = {}
+    if has_barcode_ids:
+        barcode_ids = list({barcode_id for row in product_rows for barcode_id in row["barcode_ids"]})
+        barcode_model = env[Product._fields["barcode_ids"].comodel_name].sudo()
+        barcode_names = {row["id"]: row["name"] for row in barcode_model.browse(barcode_ids).read(["name"])}
+
+    packaging_ids = list({pack_id for row in product_rows for pack_id in row["packaging_ids"]})
+    packagings = {row["id"]: row for row in env["product.packaging"].sudo().browse(packaging_ids).read(["barcode", "qty"])}
+
+    products = {}
+    for row in product_rows:
+        products[row["id"]] = {
+            "barcode": row["barcode"],
+            "weight": row["weight"],
+            "unidades": row["uom_id"][1] if row["uom_id"] else "",
+            "other_barcode": [barcode_names[barcode_id] for barcode_id in row.get("barcode_ids", []) if barcode_id in barcode_names],
+            "product_packing": [packagings[pack_id] for pack_id in row["packaging_ids"] if pack_id in packagings and packagings[pack_id]["barcode"]],
+        }
+
+    # ✅ Fechas de vencimiento de los lotes
+    lot_ids = list({move["lot_id"][0] for move in stock_moves if move.get("lot_id")})
+    lots = {row["id"]: row["expiration_date"] for row in env["stock.production.lot"].sudo().browse(lot_ids).read(["expiration_date"])}
+
+    # ✅ Ubicaciones origen y destino
+    location_ids = {move["location_id"][0] for move in stock_moves if move.get("location_id")}
+    location_ids |= {move["location_dest_id"][0] for move in stock_moves if move.get("location_dest_id")}
+    locations = {row["id"]: row for row in env["stock.location"].sudo().browse(list(location_ids)).read(["priority_picking", "barcode", "complete_name"])}
+    for row in locations.values():
+        row["pick_key"] = clave_ruta_ubicacion(row)
+
+    # ✅ Primer pedido de cada batch con su zona de entrega
+    Picking = env["stock.picking"].sudo()
+    picking_rows = Picking.search_read([("batch_id", "in", batchs.ids)], ["batch_id", "display_name", "delivery_zone_id"])
+
+    zone_ids = list({row["delivery_zone_id"][0] for row in picking_rows if row["delivery_zone_id"]})
+    zone_names = {row["id"]: row["name"] for row in env[Picking._fields["delivery_zone_id"].comodel_name].sudo().browse(zone_ids).read(["name"])}
+
+    picking_by_batch = {}
+    for row in picking_rows:
+        batch_id = row["batch_id"][0]
+        if batch_id in picking_by_batch:
+            continue
+        zone = row["delivery_zone_id"]
+        picking_by_batch[batch_id] = {
+            "id": row["id"],
+            "name": row["display_name"],
+            "zona_entrega": zone_names.get(zone[0], "") if zone else "",
+            "zona_entrega_display": zone[1] if zone else "SIN-ZONA",
+            "id_zona_entrega": zone[0] if zone else 0,
+        }
+
+    return {
+        "moves_by_batch": moves_by_batch,
+        "products": products,
+        "lots": lots,
+        "locations": locations,
+        "picking_by_batch": picking_by_batch,
+    }
+
+
+def construir_item_picking(batch_id, move, datos):
+    """Arma un item de ``list_items`` a partir de un movimiento leído y los mapas de ``cargar_datos_picking``."""
+    product_id = move["product_id"][0] if move["product_id"] else 0
+    product_ref = [product_id, move["product_id"][1] if move["product_id"] and len(move["product_id"]) > 1 else "N/A"]
+    product = datos["products"].get(product_id, {})
+    location = datos["locations"].get(move["location_id"][0]) if move["location_id"] else None
+    location_dest = datos["locations"].get(move["location_dest_id"][0]) if move["location_dest_id"] else None
+    picking = datos["picking_by_batch"].get(batch_id)
+    lot = move.get("lot_id")
+
+    return {
+        "batch_id": batch_id,
+        "id_move": move["id"],
+        "picking_id": picking["id"] if picking else 0,
+        "id_product": product_id,
+        "product_id": product_ref,
+        "lote_id": lot[0] if lot else "",
+        "lot_id": [lot[0] if lot else 0, lot[1] if lot and len(lot) > 1 else "N/A"],
+        "expire_date": str(datos["lots"].get(lot[0]) or "") if lot else "",
+        "location_id": move["location_id"],
+        "rimoval_priority": location["priority_picking"] or 0 if location else 0,
+        "barcode_location": location["barcode"] if location else "",
+        "location_dest_id": move["location_dest_id"],
+        "barcode_location_dest": location_dest["barcode"] if location_dest else "",
+        "quantity": move["product_uom_qty"],
+        "barcode": product.get("barcode", ""),
+        "other_barcode": [{"barcode": barcode, "batch_id": batch_id, "id_move": move["id"], "product_id": product_ref} for barcode in product.get("other_barcode", [])],
+        "product_packing": [{"barcode": pack["barcode"], "cantidad": pack["qty"], "batch_id": batch_id, "id_move": move["id"], "product_id": product_id} for pack in product.get("product_packing", [])],
+        "weight": product.get("weight", 0),
+        "unidades": product.get("unidades", ""),
+        "zona_entrega": picking["zona_entrega_display"] if picking else "SIN-ZONA",
+        "id_zona_entrega": picking["id_zona_entrega"] if picking else 0,
+        "pedido": picking["name"] if picking else "",
+        "pedido_id": picking["id"] if picking else 0,
+    }
+
+
+def nuevo_catalogo_picking():
+    """Catálogo vacío para el modo normalizado de las respuestas de picking."""
+    return {"products": {}, "locations": {}, "lots": {}, "pickings": {}}
+
+
+def construir_item_normalizado(batch_id, move, datos, catalogo):
+    """Registra en ``catalogo`` el producto, las ubicaciones, el lote y el pedido del movimiento
+    (una sola vez por id) y devuelve el item de ``list_items`` solo con referencias y cantidades."""
+    product_id = move["product_id"][0] if move["product_id"] else 0
+    location_id = move["location_id"][0] if move["location_id"] else 0
+    location_dest_id = move["location_dest_id"][0] if move["location_dest_id"] else 0
+    lot_id = move["lot_id"][0] if move.get("lot_id") else 0
+    picking = datos["picking_by_batch"].get(batch_id)
+
+    if product_id and product_id not in catalogo["products"]:
+        product = datos["products"].get(product_id, {})
+        catalogo["products"][product_id] = {
+            "id": product_id,
+            "name": move["product_id"][1],
+            "barcode": product.get("barcode", ""),
+            "other_barcode": product.get("other_barcode", []),
+            "product_packing": [{"barcode": pack["barcode"], "cantidad": pack["qty"]} for pack in product.get("product_packing", [])],
+            "weight": product.get("weight", 0),
+            "unidades": product.get("unidades", ""),
+        }
+
+    for location_ref in (move["location_id"], move["location_dest_id"]):
+        if location_ref and location_ref[0] not in catalogo["locations"]:
+            location = datos["locations"].get(location_ref[0], {})
+            catalogo["locations"][location_ref[0]] = {
+                "id": location_ref[0],
+                "name": location_ref[1],
+                "barcode": location.get("barcode") or "",
+                "rimoval_priority": location.get("priority_picking") or 0,
+            }
+
+    if lot_id and lot_id not in catalogo["lots"]:
+        catalogo["lots"][lot_id] = {"id": lot_id, "name": move["lot_id"][1], "expire_date": str(datos["lots"].get(lot_id) or "")}
+
+    if picking and picking["id"] not in catalogo["pickings"]:
+        catalogo["pickings"][picking["id"]] = {
+            "id": picking["id"],
+            "name": picking["name"],
+            "zona_entrega": picking["zona_entrega_display"],
+            "id_zona_entrega": picking["id_zona_entrega"],
+        }
+
+    return {
+        "batch_id": batch_id,
+        "id_move": move["id"],
+        "picking_id": picking["id"] if picking else 0,
+        "id_product": product_id,
+        "lot_id": lot_id,
+        "location_id": location_id,
+        "location_dest_id": location_dest_id,
+        "quantity": move["product_uom_qty"],
+    }
+
+
+def obtener_ubicaciones_usuario(user_wms):
+    """Devuelve los ids de las ubicaciones de las zonas asignadas al usuario WMS.
+
+    El resultado se guarda en una cache del proceso junto con la versión ``ubicaciones_usuario`` de
+    ``api.cache.version`` (una lectura por índice). La versión la incrementan los hooks de
+    ``stock.location`` y, en las tablas de los modelos WMS (de un módulo del que este no depende),
+    triggers por sentencia creados al instalar el módulo, así cualquier cambio invalida la cache
+    también en los demás workers. Sin esos triggers las ubicaciones se leen en cada petición."""
+    env = request.env
+    user_wms = user_wms.sudo()
+    Version = env["api.cache.version"].sudo()
+
+    use_cache = Version.has_triggers(CACHE_UBICACIONES_USUARIO)
+    version = Version.get(CACHE_UBICACIONES_USUARIO) if use_cache else None
+
+    key = (env.cr.dbname, user_wms.id)
+    cached = _UBICACIONES_USUARIO_CACHE.get(key)
+    if use_cache and cached and cached[0] == version:
+        return cached[1]
+
+    location_ids = list({loc_id for zone in user_wms.zone_ids.read(["location_ids"]) for loc_id in zone["location_ids"]})
+    if use_cache:
+        _UBICACIONES_USUARIO_CACHE[key] = (version, location_ids)
+    return location_ids
+
+
+def clave_natural(texto):
+    """Clave de orden natural: 'A-2' queda antes que 'A-10'."""
+    return tuple((0, int(parte), "") if parte.isdigit() else (1, 0, parte.lower()) for parte in re.split(r"(\d+)", texto or "") if parte)
+
+
+def clave_ruta_ubicacion(location):
+    """Clave de ruta de picking de una ubicación leída: prioridad de picking + orden natural de ``complete_name``."""
+    return (location["priority_picking"] or 0, clave_natural(location["complete_name"]))
+
+
+def ordenar_moves_picking(stock_moves, datos, picking_strategy):
+    """Ordena los movimientos leídos según la ruta de picking de la estrategia configurada
+    (``picking_priority_app`` según ``ORDEN_RUTA`` y ``picking_order_app`` según ``SENTIDO_RUTA``),
+    para que todos los operarios reciban la misma ruta.
+
+    El sentido descendente solo invierte la ruta; los desempates (producto e id) siempre son ascendentes."""
+    criterio = ORDEN_RUTA.get(picking_strategy.picking_priority_app if picking_strategy else None, ORDEN_RUTA_DEFECTO)
+    descendente = SENTIDO_RUTA.get(picking_strategy.picking_order_app if picking_strategy else None, False)
+
+    def ruta(move):
+        location = datos["locations"].get(move["location_id"][0]) if move["location_id"] else None
+        prioridad, nombre = location["pick_key"] if location else (0, ())
+        return (nombre,) if criterio == "ubicacion" else (prioridad, nombre)
+
+    # Orden estable: primero los desempates y luego la ruta, que es la única que se invierte
+    stock_moves = sorted(stock_moves, key=lambda move: (move["product_id"][1] if move["product_id"] else "", move["id"]))
+    return sorted(stock_moves, key=ruta, reverse=descendente)
+
+
 def procesar_fecha_naive(fecha_transaccion, zona_horaria_cliente):
     if fecha_transaccion:
         # Convertir la fecha enviada a datetime y agregar la zona horaria del cliente
@@ -3,9 +3,18 @@ from odoo import http
 from odoo.http import request
 from odoo.exceptions import AccessError
 from datetime import datetime, timedelta
+from collections import OrderedDict
+import threading
 import pytz
 from odoo.fields import Date
 
+from .ndjsonStream import iterar_en_bloques, respuesta_json, respuesta_ndjson
+
+# Cache LRU por proceso de la orden de compra de cada origen: {(base de datos, origen): (id, nombre)}
+_ORDENES_POR_ORIGEN_CACHE = OrderedDict()
+_ORDENES_POR_ORIGEN_LOCK = threading.Lock()
+ORDENES_POR_ORIGEN_MAX = 1024
+
 
 class TransaccionRecepcionController(http.Controller):
 
@@ -29,205 +38,20 @@ class TransaccionRecepcionController(http.Controller):
                 return allowed_warehouses  # Devolver el error directamente
 
             # ✅ Obtener recepciones pendientes directamente de los almacenes permitidos
-            for warehouse in allowed_warehouses:
-                # Buscar todas las recepciones pendientes (no completadas ni canceladas) para este almacén
-                recepciones_pendientes = (
-                    request.env["stock.picking"]
-                    .sudo()
-                    .search(
-                        [
-                            ("state", "=", "assigned"),
-                            ("picking_type_code", "=", "incoming"),
-                            ("picking_type_id.warehouse_id", "=", warehouse.id),
-                            ("is_return_picking", "=", False),
-                            "|",  # <- OR lógico para incluir ambos casos
-                            ("user_id", "=", user.id),  # Recepciones asignadas al usuario actual
-                            ("user_id", "=", False),  # Recepciones sin responsable asignado
-                        ]
-                    )
-                )
+            # Buscar todas las recepciones pendientes (no completadas ni canceladas) de cada almacén
+            recepciones_por_almacen = [(warehouse, request.env["stock.picking"].sudo().search(dominio_recepciones_pendientes(user, warehouse))) for warehouse in allowed_warehouses]
 
-                for picking in recepciones_pendientes:
-                    # Verificar si hay movimientos pendientes
-                    # movimientos_pendientes = picking.move_lines.filtered(lambda m: m.state not in ["done", "cancel"])
-                    movimientos_pendientes = picking.move_lines.filtered(lambda m: m.state == "assigned")
-
-                    # Si no hay movimientos pendientes, omitir esta recepción
-                    if not movimientos_pendientes:
-                        continue
-
-                    # Obtener la orden de compra relacionada (si existe)
-                    purchase_order = picking.purchase_id or (picking.origin and request.env["purchase.order"].sudo().search([("name", "=", picking.origin)], limit=1))
-
-                    # Calcular peso total
-                    peso_total = sum(move.product_id.weight * move.product_qty for move in movimientos_pendientes if move.product_id.weight)
-
-                    # Calcular número de ítems (suma total de cantidades)
-                    numero_items = sum(move.product_qty for move in movimientos_pendientes)
-
-                    recepcion_info = {
-                        "id": picking.id,
-                        "name": picking.name,  # Nombre de la recepción
-                        "fecha_creacion": picking.create_date,  # Fecha con hora
-                        "proveedor_id": picking.partner_id.id,
-                        "proveedor": picking.partner_id.name,  # Proveedor
-                        "location_dest_id": picking.location_dest_id.id,
-                        "location_dest_name": picking.location_dest_id.display_name,  # Ubicación destino
-                        "purchase_order_id": purchase_order.id if purchase_order else 0,
-                        "purchase_order_name": purchase_order.name if purchase_order else "",  # Orden de compra
-                        "numero_entrada": picking.name,  # Número de entrada
-                        "peso_total": peso_total,  # Peso total
-                        "numero_lineas": 0,  # Número de líneas (productos)
-                        "numero_items": 0,  # Número de ítems (cantidades)
-                        "state": picking.state,
-                        "origin": picking.origin or "",
-                        "priority": picking.priority,
-                        "warehouse_id": warehouse.id,
-                        "warehouse_name": warehouse.name,
-                        "location_id": picking.location_id.id,
-                        "location_name": picking.location_id.display_name,
-                        "responsable_id": picking.user_id.id or 0,
-                        "responsable": picking.user_id.name or "",
-                        "picking_type": picking.picking_type_id.name,
-                        "start_time_reception": picking.start_time_reception or "",
-                        "end_time_reception": picking.end_time_reception or "",
-                        "lineas_recepcion": [],
-                        "lineas_recepcion_enviadas": [],
-                    }
+            # ✅ Vencimiento más próximo de cada producto con lote, en una sola consulta para todas las recepciones
+            movimientos = request.env["stock.move"].sudo().union(*[recepciones.move_lines for _warehouse, recepciones in recepciones_por_almacen])
+            vencimientos = vencimientos_por_producto(request.env, movimientos.filtered(lambda m: m.state == "assigned"))
+
+            # ✅ Órdenes de compra de los orígenes sin purchase_id, en una sola búsqueda
+            ordenes = ordenes_por_origen(request.env, request.env["stock.picking"].sudo().union(*[recepciones for _warehouse, recepciones in recepciones_por_almacen]))
 
-                    # ✅ Procesar solo las líneas pendientes
-                    for move in movimientos_pendientes:
-                        product = move.product_id
-                        purchase_line = move.purchase_line_id
-
-                        quantity_ordered = purchase_line.product_qty if purchase_line else move.product_qty
-                        quantity_done = move.quantity_done
-
-                        # ⚠️ Saltar líneas totalmente recepcionadas
-                        if quantity_done < quantity_ordered:
-
-                            # Obtener códigos de barras adicionales
-                            array_barcodes = []
-                            if "barcode_ids" in product.fields_get():
-                                array_barcodes = [
-                                    {
-                                        "barcode": barcode.name,
-                                        "id_move": move.id,
-                                        "id_product": product.id,
-                                        "batch_id": picking.id,
-                                    }
-                                    for barcode in product.barcode_ids
-                                    if barcode.name
-                                ]
-
-                            # Obtener empaques del producto
-                            array_packing = []
-                            if "packaging_ids" in product.fields_get():
-                                array_packing = [
-                                    {
-                                        "barcode": pack.barcode,
-                                        "cantidad": pack.qty,
-                                        "id_move": move.id,
-                                        "id_product": product.id,
-                                    }
-                                    for pack in product.packaging_ids
-                                    if pack.barcode
-                                ]
-
-                            # obtener la fecha de vencimiento del producto pero la que esta mas cerca a vencer
-                            if product.tracking == "lot":
-                                lot = request.env["stock.production.lot"].search([("product_id", "=", product.id)], order="expiration_date asc", limit=1)
-                                if lot:
-                                    fecha_vencimiento = lot.expiration_date
-                                else:
-                                    fecha_vencimiento = ""
-                            else:
-                                fecha_vencimiento = ""
-
-                            # Generar información de la línea de recepción
-                            linea_info = {
-                                "id": move.id,
-                                "id_move": move.id,
-                                "id_recepcion": picking.id,
-                                "product_id": product.id,
-                                "product_name": product.name,
-                                "product_code": product.default_code or "",
-                                "product_barcode": product.barcode or "",
-                                "product_tracking": product.tracking or "",
-                                "fecha_vencimiento": fecha_vencimiento or "",
-                                "dias_vencimiento": product.expiration_time or "",
-                                "other_barcodes": array_barcodes,
-                                "product_packing": array_packing,
-                                "quantity_ordered": purchase_line.product_qty if purchase_line else move.product_qty,
-                                "quantity_to_receive": move.product_qty,
-                                "quantity_done": move.quantity_done,
-                                "uom": move.product_uom.name if move.product_uom else "UND",
-                                "location_dest_id": move.location_dest_id.id or 0,
-                                "location_dest_name": move.location_dest_id.display_name or "",
-                                "location_dest_barcode": move.location_dest_id.barcode or "",
-                                "location_id": move.location_id.id or 0,
-                                "location_name": move.location_id.display_name or "",
-                                "location_barcode": move.location_id.barcode or "",
-                                "weight": product.weight or 0,
-                            }
-
-                            recepcion_info["lineas_recepcion"].append(linea_info)
-
-                        # ✅ Agregar las líneas de move_line que tengan is_done_item en True
-                        move_lines_done = move.move_line_ids.filtered(lambda ml: ml.is_done_item)
-                        for move_line in move_lines_done:
-                            # Crear información de la línea enviada
-                            linea_enviada_info = {
-                                "id": move_line.id,
-                                "id_move_line": move_line.id,
-                                "id_move": move.id,
-                                "id_recepcion": picking.id,
-                                "product_id": product.id,
-                                "product_name": product.name,
-                                "product_code": product.default_code or "",
-                                "product_barcode": product.barcode or "",
-                                "product_tracking": product.tracking or "",
-                                "quantity_ordered": purchase_line.product_qty if purchase_line else move.product_qty,
-                                "quantity_to_receive": move.product_qty,
-                                "quantity_done": move_line.qty_done,
-                                "uom": move_line.product_uom_id.name if move_line.product_uom_id else "UND",
-                                "location_dest_id": move_line.location_dest_id.id or 0,
-                                "location_dest_name": move_line.location_dest_id.display_name or "",
-                                "location_dest_barcode": move_line.location_dest_id.barcode or "",
-                                "location_id": move_line.location_id.id or 0,
-                                "location_name": move_line.location_id.display_name or "",
-                                "location_barcode": move_line.location_id.barcode or "",
-                                "is_done_item": move_line.is_done_item,
-                                "date_transaction": move_line.date_transaction or "",
-                                "observation": move_line.new_observation or "",
-                                "time": move_line.time or "",
-                                "user_operator_id": move_line.user_operator_id.id or 0,
-                            }
-
-                            # Agregar información del lote si existe
-                            if move_line.lot_id:
-                                linea_enviada_info.update(
-                                    {
-                                        "lot_id": move_line.lot_id.id,
-                                        "lot_name": move_line.lot_id.name,
-                                        "fecha_vencimiento": move_line.lot_id.expiration_date or "",
-                                    }
-                                )
-                            elif move_line.lot_name:
-                                linea_enviada_info.update(
-                                    {
-                                        "lot_id": 0,
-                                        "lot_name": move_line.lot_name,
-                                        "fecha_vencimiento": "",
-                                    }
-                                )
-
-                            recepcion_info["lineas_recepcion_enviadas"].append(linea_enviada_info)
-
-                    # Solo añadir recepciones que tengan líneas pendientes
-                    if recepcion_info["lineas_recepcion"]:
-                        recepcion_info["numero_lineas"] = len(recepcion_info["lineas_recepcion"])
-                        recepcion_info["numero_items"] = sum(linea["quantity_to_receive"] for linea in recepcion_info["lineas_recepcion"])
+            for warehouse, recepciones_pendientes in recepciones_por_almacen:
+                for picking in recepciones_pendientes:
+                    recepcion_info = construir_recepcion(request.env, picking, warehouse, vencimientos, ordenes)
+                    if recepcion_info:
                         array_recepciones.append(recepcion_info)
 
             return {"code": 200, "result": array_recepciones}
@@ -237,6 +61,34 @@ class TransaccionRecepcionController(http.Controller):
         except Exception as err:
             return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
 
+    ## GET Transaccion Recepcion en streaming (NDJSON, una recepción por línea)
+    @http.route("/api/recepciones/stream", auth="user", type="http", methods=["GET"], csrf=False)
+    def get_recepciones_stream(self, **kwargs):
+        try:
+            user = request.env.user
+
+            # ✅ Validar usuario
+            if not user:
+                return respuesta_json({"code": 400, "msg": "Usuario no encontrado"})
+
+            # Obtener almacenes del usuario
+            allowed_warehouses = obtener_almacenes_usuario(user)
+
+            # Verificar si es un error (diccionario con código y mensaje)
+            if isinstance(allowed_warehouses, dict) and "code" in allowed_warehouses:
+                return respuesta_json(allowed_warehouses)  # Devolver el error directamente
+
+            picking_ids = []
+            for warehouse in allowed_warehouses:
+                picking_ids += request.env["stock.picking"].sudo().search(dominio_recepciones_pendientes(user, warehouse)).ids
+
+            return respuesta_ndjson(iterar_recepciones, picking_ids)
+
+        except AccessError as e:
+            return respuesta_json({"code": 403, "msg": f"Acceso denegado: {str(e)}"})
+        except Exception as err:
+            return respuesta_json({"code": 400, "msg": f"Error inesperado: {str(err)}"})
+
     ## GET Transaccion Recepcion por ID
     @http.route("/api/recepciones/<int:id>", auth="user", type="json", methods=["GET"])
     def get_recepcion_by_id(self, id):
@@ -264,7 +116,7 @@ class TransaccionRecepcionController(http.Controller):
                 return {"code": 400, "msg": "La recepción no tiene movimientos pendientes"}
 
             # ✅ Obtener la orden de compra relacionada (si existe)
-            purchase_order = recepcion.purchase_id or (recepcion.origin and request.env["purchase.order"].sudo().search([("name", "=", recepcion.origin)], limit=1))
+            purchase_order = orden_compra_recepcion(recepcion, ordenes_por_origen(request.env, recepcion))
 
             # Calcular peso total
             peso_total = sum(move.product_id.weight * move.product_qty for move in movimientos_pendientes if move.product_id.weight)
@@ -272,6 +124,9 @@ class TransaccionRecepcionController(http.Controller):
             # Calcular número de ítems (suma total de cantidades)
             numero_items = sum(move.product_qty for move in movimientos_pendientes)
 
+            # ✅ Vencimiento más próximo de cada producto con lote, en una sola consulta
+            vencimientos = vencimientos_por_producto(request.env, movimientos_pendientes)
+
             # Generar información de la recepción
             recepcion_info = {
                 "id": recepcion.id,
@@ -282,8 +137,8 @@ class TransaccionRecepcionController(http.Controller):
                 "proveedor": recepcion.partner_id.name,  # Proveedor
                 "location_dest_id": recepcion.location_dest_id.id,
                 "location_dest_name": recepcion.location_dest_id.display_name,  # Ubicación destino
-                "purchase_order_id": purchase_order.id if purchase_order else 0,
-                "purchase_order_name": purchase_order.name if purchase_order else "",  # Orden de compra
+                "purchase_order_id": purchase_order["id"] if purchase_order else 0,
+                "purchase_order_name": purchase_order["name"] if purchase_order else "",  # Orden de compra
                 "numero_entrada": recepcion.name,  # Número de entrada
                 "peso_total": peso_total,  # Peso total
                 "numero_lineas": len(movimientos_pendientes),  # Número de líneas (productos)
@@ -334,14 +189,7 @@ class TransaccionRecepcionController(http.Controller):
                     ]
 
                 # obtener la fecha de vencimiento del producto pero la que esta mas cerca a vencer
-                if product.tracking == "lot":
-                    lot = request.env["stock.production.lot"].search([("product_id", "=", product.id)], order="expiration_date asc", limit=1)
-                    if lot:
-                        fecha_vencimiento = lot.expiration_date
-                    else:
-                        fecha_vencimiento = ""
-                else:
-                    fecha_vencimiento = ""
+                fecha_vencimiento = vencimientos.get(product.id, "") if product.tracking == "lot" else ""
 
                 # Generar información de la línea de recepción
                 linea_info = {
@@ -505,6 +353,10 @@ class TransaccionRecepcionController(http.Controller):
     ## POST Completar Recepcion
     @http.route("/api/send_recepcion", auth="user", type="json", methods=["POST"], csrf=False)
     def send_recepcion(self, **auth):
+        # ✅ Idempotencia: un reintento con el mismo id_operacion devuelve la respuesta ya procesada
+        return request.env["api.idempotency.key"].sudo().run_once(auth.get("id_operacion"), "/api/send_recepcion", lambda: self._send_recepcion(**auth))
+
+    def _send_recepcion(self, **auth):
         try:
             user = request.env.user
 
@@ -523,6 +375,22 @@ class TransaccionRecepcionController(http.Controller):
 
             array_result = []
 
+            # ✅ Resolver productos, lotes y movimientos de todos los ítems en memoria (una consulta por modelo)
+            products_by_id = {product.id: product for product in request.env["product.product"].sudo().browse([item.get("id_producto") for item in list_items if item.get("id_producto")]).exists()}
+            lots_by_id = {lot.id: lot for lot in request.env["stock.production.lot"].sudo().browse([item.get("lote_producto") for item in list_items if item.get("lote_producto")]).exists()}
+
+            moves_by_id = {}
+            moves_by_product = {}
+            for move in recepcion.move_lines:
+                moves_by_id[move.id] = move
+                moves_by_product.setdefault(move.product_id.id, move)
+
+            # Fecha por defecto común a todo el envío
+            fecha_envio = datetime.now(pytz.utc)
+
+            # ✅ Preparar los valores de todas las líneas, incluidos los campos propios, antes de crear
+            vals_list = []
+            lineas = []
             for item in list_items:
                 move_id = item.get("id_move")
                 product_id = item.get("id_producto")
@@ -538,15 +406,15 @@ class TransaccionRecepcionController(http.Controller):
                 if not product_id or not cantidad:
                     continue
 
-                product = request.env["product.product"].sudo().browse(product_id)
-                if not product.exists():
+                product = products_by_id.get(product_id)
+                if not product:
                     continue
                 # Si tienes un move_id en los datos de entrada
                 if move_id:
-                    move = recepcion.move_lines.filtered(lambda m: m.id == move_id)
+                    move = moves_by_id.get(move_id)
                 else:
                     # Fallback al método actual
-                    move = recepcion.move_lines.filtered(lambda m: m.product_id.id == product_id)
+                    move = moves_by_product.get(product_id)
 
                 if not move:
                     return {"code": 400, "msg": f"El producto {product.name} no está en la recepción"}
@@ -559,6 +427,12 @@ class TransaccionRecepcionController(http.Controller):
                     "location_id": move.location_id.id,  # Ubicación de origen
                     "location_dest_id": ubicacion_destino or move.location_dest_id.id,  # Ubicación de destino
                     "product_uom_id": move.product_uom.id,
+                    # registrar los campos date_transaction new_observation time user_operator_id is_done_item
+                    "date_transaction": procesar_fecha_naive(fecha_transaccion, "America/Bogota") if fecha_transaccion else fecha_envio,
+                    "new_observation": observacion,
+                    "time": time_line,
+                    "user_operator_id": id_operario,
+                    "is_done_item": True,
                 }
 
                 # Inicializar lot como None
@@ -568,24 +442,20 @@ class TransaccionRecepcionController(http.Controller):
                 if product.tracking == "lot":
                     if not lote_id:
                         return {"code": 400, "msg": f"El producto {product.name} requiere un lote"}
-                    else:
-                        lot = request.env["stock.production.lot"].sudo().browse(lote_id)
-                        if not lot.exists():
-                            return {"code": 400, "msg": f"Lote no encontrado para el producto {product.name}"}
 
-                        move_line_vals["lot_id"] = lot.id
+                    lot = lots_by_id.get(lote_id)
+                    if not lot:
+                        return {"code": 400, "msg": f"Lote no encontrado para el producto {product.name}"}
 
-                # ✅ Crear la línea de movimiento
-                move_line = request.env["stock.move.line"].sudo().create(move_line_vals)
+                    move_line_vals["lot_id"] = lot.id
 
-                if move_line:
-                    # registrar los campos date_transaction new_observation time user_operator_id is_done_item
-                    move_line.date_transaction = procesar_fecha_naive(fecha_transaccion, "America/Bogota") if fecha_transaccion else datetime.now(pytz.utc)
-                    move_line.new_observation = observacion
-                    move_line.time = time_line
-                    move_line.user_operator_id = id_operario
-                    move_line.is_done_item = True
+                vals_list.append(move_line_vals)
+                lineas.append((product, cantidad, lot, ubicacion_destino, fecha_transaccion))
+
+            # ✅ Crear todas las líneas de movimiento con un solo create
+            move_lines = request.env["stock.move.line"].sudo().create(vals_list)
 
+            for move_line, (product, cantidad, lot, ubicacion_destino, fecha_transaccion) in zip(move_lines, lineas):
                 array_result.append(
                     {
                         "producto": product.name,
@@ -665,44 +535,15 @@ class TransaccionRecepcionController(http.Controller):
             if not recepcion:
                 return {"code": 400, "msg": f"Recepción no encontrada o ya completada con ID {id_recepcion}"}
 
-            # Intentar validar la recepción
-            result = recepcion.sudo().button_validate()
-
-            # Si el resultado es un diccionario, significa que se requiere acción adicional (un wizard)
-            if isinstance(result, dict) and result.get("res_model"):
-                wizard_model = result.get("res_model")
-
-                # Para asistente de backorder
-                if wizard_model == "stock.backorder.confirmation":
-                    # Crear el wizard con los valores del contexto
-                    wizard_context = result.get("context", {})
-
-                    # Crear el asistente con los valores correctos según tu JSON
-                    wizard_vals = {"pick_ids": [(4, id_recepcion)], "show_transfers": wizard_context.get("default_show_transfers", False)}  # Enlazar con la recepción actual
+            Job = request.env["api.validation.job"].sudo()
 
-                    wizard = request.env[wizard_model].sudo().with_context(**wizard_context).create(wizard_vals)
+            # ✅ Modo asíncrono: encolar la validación y devolver el id del trabajo de inmediato
+            if auth.get("asincrono"):
+                job = Job.enqueue("recepcion", recepcion, crear_backorder)
+                return {"code": 200, "msg": "Validación de la recepción en cola", "job_id": job.id, "estado": job.state}
 
-                    # Procesar según la opción de crear_backorder
-                    if crear_backorder:
-                        wizard.sudo().process()
-                        return {"code": 200, "msg": f"Recepción parcial completada y backorder creado - ID {wizard.id or 0}"}
-                    else:
-                        wizard.sudo().process_cancel_backorder()
-                        return {"code": 200, "msg": "Recepción parcial completada sin crear backorder"}
-
-                # Para asistente de transferencia inmediata
-                elif wizard_model == "stock.immediate.transfer":
-                    wizard_context = result.get("context", {})
-                    wizard = request.env[wizard_model].sudo().with_context(**wizard_context).create({"pick_ids": [(4, id_recepcion)]})
-
-                    wizard.sudo().process()
-                    return {"code": 200, "msg": "Recepción procesada con transferencia inmediata"}
-
-                else:
-                    return {"code": 400, "msg": f"Se requiere un asistente no soportado: {wizard_model}"}
-
-            # Si llegamos aquí, button_validate completó la validación sin necesidad de asistentes
-            return {"code": 200, "msg": "Recepción completada correctamente"}
+            # Validar la recepción en la misma petición
+            return Job._validar_recepcion(recepcion, crear_backorder)
 
         except Exception as e:
             # Registrar el error completo para depuración
@@ -829,6 +670,269 @@ class TransaccionRecepcionController(http.Controller):
             return {"code": 500, "msg": f"Error interno: {str(e)}"}
 
 
+def dominio_recepciones_pendientes(user, warehouse):
+    """Recepciones pendientes del almacén asignadas al usuario o sin responsable."""
+    return [
+        ("state", "=", "assigned"),
+        ("picking_type_code", "=", "incoming"),
+        ("picking_type_id.warehouse_id", "=", warehouse.id),
+        ("is_return_picking", "=", False),
+        "|",  # <- OR lógico para incluir ambos casos
+        ("user_id", "=", user.id),  # Recepciones asignadas al usuario actual
+        ("user_id", "=", False),  # Recepciones sin responsable asignado
+    ]
+
+
+def construir_recepcion(env, picking, warehouse, vencimientos=None, ordenes=None):
+    """Arma una recepción con sus líneas pendientes y enviadas. Devuelve None si no tiene líneas pendientes.
+
+    ``vencimientos`` y ``ordenes`` son los mapas de ``vencimientos_por_producto`` y ``ordenes_por_origen``
+    compartidos entre recepciones; si no llegan se calculan solo para esta recepción."""
+    # Verificar si hay movimientos pendientes
+    # movimientos_pendientes = picking.move_lines.filtered(lambda m: m.state not in ["done", "cancel"])
+    movimientos_pendientes = picking.move_lines.filtered(lambda m: m.state == "assigned")
+
+    # Si no hay movimientos pendientes, omitir esta recepción
+    if not movimientos_pendientes:
+        return None
+
+    if vencimientos is None:
+        vencimientos = vencimientos_por_producto(env, movimientos_pendientes)
+
+    # Obtener la orden de compra relacionada (si existe)
+    if ordenes is None:
+        ordenes = ordenes_por_origen(env, picking)
+    purchase_order = orden_compra_recepcion(picking, ordenes)
+
+    # Calcular peso total
+    peso_total = sum(move.product_id.weight * move.product_qty for move in movimientos_pendientes if move.product_id.weight)
+
+    # Calcular número de ítems (suma total de cantidades)
+    numero_items = sum(move.product_qty for move in movimientos_pendientes)
+
+    recepcion_info = {
+        "id": picking.id,
+        "name": picking.name,  # Nombre de la recepción
+        "fecha_creacion": picking.create_date,  # Fecha con hora
+        "proveedor_id": picking.partner_id.id,
+        "proveedor": picking.partner_id.name,  # Proveedor
+        "location_dest_id": picking.location_dest_id.id,
+        "location_dest_name": picking.location_dest_id.display_name,  # Ubicación destino
+        "purchase_order_id": purchase_order["id"] if purchase_order else 0,
+        "purchase_order_name": purchase_order["name"] if purchase_order else "",  # Orden de compra
+        "numero_entrada": picking.name,  # Número de entrada
+        "peso_total": peso_total,  # Peso total
+        "numero_lineas": 0,  # Número de líneas (productos)
+        "numero_items": 0,  # Número de ítems (cantidades)
+        "state": picking.state,
+        "origin": picking.origin or "",
+        "priority": picking.priority,
+        "warehouse_id": warehouse.id,
+        "warehouse_name": warehouse.name,
+        "location_id": picking.location_id.id,
+        "location_name": picking.location_id.display_name,
+        "responsable_id": picking.user_id.id or 0,
+        "responsable": picking.user_id.name or "",
+        "picking_type": picking.picking_type_id.name,
+        "start_time_reception": picking.start_time_reception or "",
+        "end_time_reception": picking.end_time_reception or "",
+        "lineas_recepcion": [],
+        "lineas_recepcion_enviadas": [],
+    }
+
+    # ✅ Procesar solo las líneas pendientes
+    for move in movimientos_pendientes:
+        product = move.product_id
+        purchase_line = move.purchase_line_id
+
+        quantity_ordered = purchase_line.product_qty if purchase_line else move.product_qty
+        quantity_done = move.quantity_done
+
+        # ⚠️ Saltar líneas totalmente recepcionadas
+        if quantity_done < quantity_ordered:
+
+            # Obtener códigos de barras adicionales
+            array_barcodes = []
+            if "barcode_ids" in product.fields_get():
+                array_barcodes = [
+                    {
+                        "barcode": barcode.name,
+                        "id_move": move.id,
+                        "id_product": product.id,
+                        "batch_id": picking.id,
+                    }
+                    for barcode in product.barcode_ids
+                    if barcode.name
+                ]
+
+            # Obtener empaques del producto
+            array_packing = []
+            if "packaging_ids" in product.fields_get():
+                array_packing = [
+                    {
+                        "barcode": pack.barcode,
+                        "cantidad": pack.qty,
+                        "id_move": move.id,
+                        "id_product": product.id,
+                    }
+                    for pack in product.packaging_ids
+                    if pack.barcode
+                ]
+
+            # obtener la fecha de vencimiento del producto pero la que esta mas cerca a vencer
+            fecha_vencimiento = vencimientos.get(product.id, "") if product.tracking == "lot" else ""
+
+            # Generar información de la línea de recepción
+            linea_info = {
+                "id": move.id,
+                "id_move": move.id,
+                "id_recepcion": picking.id,
+                "product_id": product.id,
+                "product_name": product.name,
+                "product_code": product.default_code or "",
+                "product_barcode": product.barcode or "",
+                "product_tracking": product.tracking or "",
+                "fecha_vencimiento": fecha_vencimiento or "",
+                "dias_vencimiento": product.expiration_time or "",
+                "other_barcodes": array_barcodes,
+                "product_packing": array_packing,
+                "quantity_ordered": purchase_line.product_qty if purchase_line else move.product_qty,
+                "quantity_to_receive": move.product_qty,
+                "quantity_done": move.quantity_done,
+                "uom": move.product_uom.name if move.product_uom else "UND",
+                "location_dest_id": move.location_dest_id.id or 0,
+                "location_dest_name": move.location_dest_id.display_name or "",
+                "location_dest_barcode": move.location_dest_id.barcode or "",
+                "location_id": move.location_id.id or 0,
+                "location_name": move.location_id.display_name or "",
+                "location_barcode": move.location_id.barcode or "",
+                "weight": product.weight or 0,
+            }
+
+            recepcion_info["lineas_recepcion"].append(linea_info)
+
+        # ✅ Agregar las líneas de move_line que tengan is_done_item en True
+        move_lines_done = move.move_line_ids.filtered(lambda ml: ml.is_done_item)
+        for move_line in move_lines_done:
+            # Crear información de la línea enviada
+            linea_enviada_info = {
+                "id": move_line.id,
+                "id_move_line": move_line.id,
+                "id_move": move.id,
+                "id_recepcion": picking.id,
+                "product_id": product.id,
+                "product_name": product.name,
+                "product_code": product.default_code or "",
+                "product_barcode": product.barcode or "",
+                "product_tracking": product.tracking or "",
+                "quantity_ordered": purchase_line.product_qty if purchase_line else move.product_qty,
+                "quantity_to_receive": move.product_qty,
+                "quantity_done": move_line.qty_done,
+                "uom": move_line.product_uom_id.name if move_line.product_uom_id else "UND",
+                "location_dest_id": move_line.location_dest_id.id or 0,
+                "location_dest_name": move_line.location_dest_id.display_name or "",
+                "location_dest_barcode": move_line.location_dest_id.barcode or "",
+                "location_id": move_line.location_id.id or 0,
+                "location_name": move_line.location_id.display_name or "",
+                "location_barcode": move_line.location_id.barcode or "",
+                "is_done_item": move_line.is_done_item,
+                "date_transaction": move_line.date_transaction or "",
+                "observation": move_line.new_observation or "",
+                "time": move_line.time or "",
+                "user_operator_id": move_line.user_operator_id.id or 0,
+            }
+
+            # Agregar información del lote si existe
+            if move_line.lot_id:
+                linea_enviada_info.update(
+                    {
+                        "lot_id": move_line.lot_id.id,
+                        "lot_name": move_line.lot_id.name,
+                        "fecha_vencimiento": move_line.lot_id.expiration_date or "",
+                    }
+                )
+            elif move_line.lot_name:
+                linea_enviada_info.update(
+                    {
+                        "lot_id": 0,
+                        "lot_name": move_line.lot_name,
+                        "fecha_vencimiento": "",
+                    }
+                )
+
+            recepcion_info["lineas_recepcion_enviadas"].append(linea_enviada_info)
+
+    # Solo añadir recepciones que tengan líneas pendientes
+    if not recepcion_info["lineas_recepcion"]:
+        return None
+
+    recepcion_info["numero_lineas"] = len(recepcion_info["lineas_recepcion"])
+    recepcion_info["numero_items"] = sum(linea["quantity_to_receive"] for linea in recepcion_info["lineas_recepcion"])
+    return recepcion_info
+
+
+def vencimientos_por_producto(env, moves):
+    """Fecha de vencimiento más próxima de los lotes de cada producto con lote de ``moves``,
+    ``{id producto: fecha}``, calculada en una sola consulta agrupada."""
+    product_ids = moves.mapped("product_id").filtered(lambda product: product.tracking == "lot").ids
+    if not product_ids:
+        return {}
+
+    grupos = env["stock.production.lot"].read_group([("product_id", "in", product_ids)], ["expiration_date:min"], ["product_id"])
+    return {grupo["product_id"][0]: grupo["expiration_date"] or "" for grupo in grupos}
+
+
+def ordenes_por_origen(env, pickings):
+    """Orden de compra (``{"id", "name"}``) de cada origen de ``pickings`` sin ``purchase_id``.
+
+    Los orígenes que no están en la cache LRU del proceso se resuelven con una sola búsqueda
+    ``name in [...]``; los que no tienen orden de compra no se guardan en la cache."""
+    origins = {picking.origin for picking in pickings if not picking.purchase_id and picking.origin}
+    dbname = env.cr.dbname
+    ordenes = {}
+
+    with _ORDENES_POR_ORIGEN_LOCK:
+        for origin in origins:
+            cached = _ORDENES_POR_ORIGEN_CACHE.get((dbname, origin))
+            if cached:
+                _ORDENES_POR_ORIGEN_CACHE.move_to_end((dbname, origin))
+                ordenes[origin] = {"id": cached[0], "name": cached[1]}
+
+    missing = list(origins - set(ordenes))
+    if not missing:
+        return ordenes
+
+    for row in env["purchase.order"].sudo().search_read([("name", "in", missing)], ["name"]):
+        ordenes.setdefault(row["name"], {"id": row["id"], "name": row["name"]})
+
+    with _ORDENES_POR_ORIGEN_LOCK:
+        for origin in missing:
+            if origin in ordenes:
+                _ORDENES_POR_ORIGEN_CACHE[(dbname, origin)] = (ordenes[origin]["id"], ordenes[origin]["name"])
+        while len(_ORDENES_POR_ORIGEN_CACHE) > ORDENES_POR_ORIGEN_MAX:
+            _ORDENES_POR_ORIGEN_CACHE.popitem(last=False)
+
+    return ordenes
+
+
+def orden_compra_recepcion(picking, ordenes):
+    """Orden de compra de la recepción: su ``purchase_id`` o la resuelta por origen en ``ordenes``."""
+    if picking.purchase_id:
+        return {"id": picking.purchase_id.id, "name": picking.purchase_id.name}
+    return ordenes.get(picking.origin)
+
+
+def iterar_recepciones(env, picking_ids):
+    """Genera las recepciones de ``picking_ids`` una a una, procesándolas por bloques."""
+    for pickings in iterar_en_bloques(env["stock.picking"].sudo().browse(picking_ids)):
+        vencimientos = vencimientos_por_producto(env, pickings.move_lines.filtered(lambda m: m.state == "assigned"))
+        ordenes = ordenes_por_origen(env, pickings)
+        for picking in pickings:
+            recepcion_info = construir_recepcion(env, picking, picking.picking_type_id.warehouse_id, vencimientos, ordenes)
+            if recepcion_info:
+                yield recepcion_info
+
+
 def procesar_fecha_naive(fecha_transaccion, zona_horaria_cliente):
     if fecha_transaccion:
         # Convertir la fecha enviada a datetime y agregar la zona horaria del cliente
@@ -3,8 +3,19 @@ from odoo import http
 from odoo.http import request
 from odoo.exceptions import AccessError
 from datetime import datetime, timedelta
+from collections import OrderedDict
+import threading
 import pytz
 
+from .ndjsonStream import iterar_en_bloques, respuesta_json, respuesta_ndjson
+from ..models.api_cache_version import CACHE_CODIGOS
+
+# Cache LRU por proceso de la resolución de códigos escaneados: {(base de datos, código): (versión, (tipo, modelo, id, id producto))}
+# Solo guarda códigos encontrados; la versión "codigos" de api.cache.version sube con cada escritura del índice
+_CODIGOS_CACHE = OrderedDict()
+_CODIGOS_LOCK = threading.Lock()
+CODIGOS_CACHE_MAX = 4096
+
 
 class TransaccionTransferenciasController(http.Controller):
 
@@ -29,157 +40,12 @@ class TransaccionTransferenciasController(http.Controller):
             # ✅ Obtener transferencias pendientes directamente de los almacenes permitidos
             for warehouse in allowed_warehouses:
                 # Buscar todas las transferencias pendientes (no completadas ni canceladas) para este almacén
-                transferencias_pendientes = (
-                    request.env["stock.picking"]
-                    .sudo()
-                    .search(
-                        [
-                            ("state", "=", "assigned"),
-                            ("picking_type_code", "=", "internal"),  # Transferencia interna
-                            ("picking_type_id.warehouse_id", "=", warehouse.id),
-                            ("picking_type_id.sequence_code", "=", "INT"),  # Transferencia interna
-                            "|",  # <- OR lógico para incluir ambos casos
-                            ("user_id", "=", user.id),  # Transferencias asignadas al usuario actual
-                            ("user_id", "=", False),  # Transferencias sin responsable asignado
-                        ]
-                    )
-                )
+                transferencias_pendientes = request.env["stock.picking"].sudo().search(dominio_transferencias_pendientes(user, warehouse))
 
                 for picking in transferencias_pendientes:
-                    # Verificar si hay movimientos pendientes - CORREGIDO AQUÍ
-                    # movimientos_pendientes = picking.move_lines.mapped("move_line_ids").filtered(lambda ml: ml.state == "assigned")
-                    movimientos_pendientes = picking.move_lines.mapped("move_line_ids")
-
-                    # Si no hay movimientos pendientes, omitir esta transferencia
-                    if not movimientos_pendientes:
-                        continue
-
-                    # Calcular peso total
-                    peso_total = sum(move.product_id.weight * move.qty_done for move in movimientos_pendientes if move.product_id.weight)
-
-                    # Calcular número de ítems (suma total de cantidades)
-                    numero_items = sum(move.qty_done for move in movimientos_pendientes)
-
-                    transferencia_info = {
-                        "id": picking.id,
-                        "name": picking.name,  # Nombre de la transferencia
-                        "fecha_creacion": picking.create_date,  # Fecha con hora
-                        "location_id": picking.location_id.id,
-                        "location_name": picking.location_id.display_name,  # Ubicación origen
-                        "location_dest_id": picking.location_dest_id.id,
-                        "location_dest_name": picking.location_dest_id.display_name,  # Ubicación destino
-                        "numero_transferencia": picking.name,  # Número de transferencia
-                        "peso_total": peso_total,  # Peso total
-                        "numero_lineas": 0,  # Número de líneas (productos)
-                        "numero_items": 0,  # Número de ítems (cantidades)
-                        "state": picking.state,
-                        "origin": picking.origin or "",
-                        "priority": picking.priority,
-                        "warehouse_id": warehouse.id,
-                        "warehouse_name": warehouse.name,
-                        "responsable_id": picking.user_id.id or 0,
-                        "responsable": picking.user_id.name or "",
-                        "picking_type": picking.picking_type_id.name,
-                        "start_time_transfer": picking.start_time_transfer or "",
-                        "end_time_transfer": picking.end_time_transfer or "",
-                        "backorder_id": picking.backorder_id.id or 0,
-                        "backorder_name": picking.backorder_id.name or "",
-                        "show_check_availability": picking.show_check_availability,
-                        "lineas_transferencia": [],  # Líneas pendientes (is_done_item = False)
-                        "lineas_transferencia_enviadas": [],  # Líneas procesadas (is_done_item = True)
-                    }
-
-                    # ✅ Procesar las líneas de movimiento
-                    for move_line in movimientos_pendientes:
-                        product = move_line.product_id
-
-                        # Obtener códigos de barras adicionales
-                        array_barcodes = []
-                        if "barcode_ids" in product.fields_get():
-                            array_barcodes = [
-                                {
-                                    "barcode": barcode.name,
-                                    "id_move": move_line.move_id.id,
-                                    "id_product": product.id,
-                                    "batch_id": picking.id,
-                                }
-                                for barcode in product.barcode_ids
-                                if barcode.name
-                            ]
-
-                        # Obtener empaques del producto
-                        array_packing = []
-                        if "packaging_ids" in product.fields_get():
-                            array_packing = [
-                                {
-                                    "barcode": pack.barcode,
-                                    "cantidad": pack.qty,
-                                    "id_move": move_line.move_id.id,
-                                    "id_product": product.id,
-                                    "batch_id": picking.id,
-                                }
-                                for pack in product.packaging_ids
-                                if pack.barcode
-                            ]
-
-                        # Generar la información base común para todas las líneas
-                        linea_info = {
-                            "id": move_line.id,
-                            "id_move": move_line.id,
-                            "id_transferencia": picking.id,
-                            "product_id": product.id,
-                            "product_name": product.name,
-                            "product_code": product.default_code or "",
-                            "product_barcode": product.barcode or "",
-                            "product_tracking": product.tracking or "",
-                            "dias_vencimiento": product.expiration_time or "",
-                            "other_barcodes": array_barcodes,
-                            "product_packing": array_packing,
-                            "quantity_ordered": move_line.product_qty,
-                            "quantity_to_transfer": move_line.product_qty,
-                            "quantity_done": move_line.qty_done,
-                            "uom": move_line.product_uom_id.name if move_line.product_uom_id else "UND",
-                            "location_dest_id": move_line.location_dest_id.id or 0,
-                            "location_dest_name": move_line.location_dest_id.display_name or "",
-                            "location_dest_barcode": move_line.location_dest_id.barcode or "",
-                            "location_id": move_line.location_id.id or 0,
-                            "location_name": move_line.location_id.display_name or "",
-                            "location_barcode": move_line.location_id.barcode or "",
-                            "weight": product.weight or 0,
-                            "is_done_item": move_line.is_done_item,
-                            "date_transaction": move_line.date_transaction or "",
-                            "observation": move_line.new_observation or "",
-                            "time": move_line.time or 0,
-                            "user_operator_id": move_line.user_operator_id.id or 0,
-                        }
-
-                        # Añadir información específica del lote
-                        if move_line.lot_id:
-                            linea_info.update(
-                                {
-                                    "lot_id": move_line.lot_id.id,
-                                    "lot_name": move_line.lot_id.name,
-                                    "fecha_vencimiento": move_line.lot_id.expiration_date or "",
-                                }
-                            )
-                        else:
-                            linea_info.update(
-                                {
-                                    "lot_id": 0,
-                                    "lot_name": "",
-                                    "fecha_vencimiento": "",
-                                }
-                            )
-
-                        # Determinar a qué lista añadir la línea según is_done_item
-                        if hasattr(move_line, "is_done_item") and move_line.is_done_item:
-                            transferencia_info["lineas_transferencia_enviadas"].append(linea_info)
-                        else:
-                            transferencia_info["lineas_transferencia"].append(linea_info)
-
-                    transferencia_info["numero_lineas"] = len(transferencia_info["lineas_transferencia"])
-                    transferencia_info["numero_items"] = sum(linea["quantity_to_transfer"] for linea in transferencia_info["lineas_transferencia"])
-                    array_transferencias.append(transferencia_info)
+                    transferencia_info = construir_transferencia(request.env, picking, warehouse)
+                    if transferencia_info:
+                        array_transferencias.append(transferencia_info)
 
             return {"code": 200, "result": array_transferencias}
 
@@ -188,6 +54,33 @@ class TransaccionTransferenciasController(http.Controller):
         except Exception as err:
             return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
 
+    ## GET Transferencias internas en streaming (NDJSON, una transferencia por línea)
+    @http.route("/api/transferencias/stream", auth="user", type="http", methods=["GET"], csrf=False)
+    def get_transferencias_stream(self, **kwargs):
+        try:
+            user = request.env.user
+
+            # ✅ Validar usuario
+            if not user:
+                return respuesta_json({"code": 400, "msg": "Usuario no encontrado"})
+
+            allowed_warehouses = obtener_almacenes_usuario(user)
+
+            # Verificar si es un error (diccionario con código y mensaje)
+            if isinstance(allowed_warehouses, dict) and "code" in allowed_warehouses:
+                return respuesta_json(allowed_warehouses)  # Devolver el error directamente
+
+            picking_ids = []
+            for warehouse in allowed_warehouses:
+                picking_ids += request.env["stock.picking"].sudo().search(dominio_transferencias_pendientes(user, warehouse)).ids
+
+            return respuesta_ndjson(iterar_transferencias, picking_ids)
+
+        except AccessError as e:
+            return respuesta_json({"code": 403, "msg": f"Acceso denegado: {str(e)}"})
+        except Exception as err:
+            return respuesta_json({"code": 400, "msg": f"Error inesperado: {str(err)}"})
+
     ## GET Obtener tranferencia por id
     @http.route("/api/transferencias/<int:id>", auth="user", type="json", methods=["GET"])
     def get_transferencia_by_id(self, id):
@@ -383,6 +276,10 @@ class TransaccionTransferenciasController(http.Controller):
     ## POST Enviar cantidad de producto en transferencia
     @http.route("/api/send_transfer", auth="user", type="json", methods=["POST"], csrf=False)
     def send_transfer(self, **auth):
+        # ✅ Idempotencia: un reintento con el mismo id_operacion devuelve la respuesta ya procesada
+        return request.env["api.idempotency.key"].sudo().run_once(auth.get("id_operacion"), "/api/send_transfer", lambda: self._send_transfer(**auth))
+
+    def _send_transfer(self, **auth):
         try:
             user = request.env.user
 
@@ -529,52 +426,15 @@ class TransaccionTransferenciasController(http.Controller):
             if not transferencia.move_ids_without_package:
                 return {"code": 400, "msg": "La transferencia no tiene líneas de movimiento"}
 
-            # Intentar validar la transferencia
-            result = transferencia.with_context(skip_backorder=not crear_backorder).sudo().button_validate()
-            # Si el resultado es un diccionario, significa que se requiere acción adicional (un wizard)
-            if isinstance(result, dict) and result.get("res_model"):
-                wizard_model = result.get("res_model")
-
-                # Para asistente de backorder
-                if wizard_model == "stock.backorder.confirmation":
-                    wizard_context = result.get("context", {})
-
-                    wizard_vals = {"pick_ids": [(6, 0, [transferencia.id])], "show_transfers": wizard_context.get("default_show_transfers", False)}
-
-                    wizard = request.env[wizard_model].sudo().with_context(**wizard_context).create(wizard_vals)
-
-                    # Procesar según la opción de crear_backorder
-                    if crear_backorder:
-                        # En lugar de llamar al método process, vamos a completar la transferencia directamente
-                        transferencia.sudo()._action_done()
+            Job = request.env["api.validation.job"].sudo()
 
-                        # Verificar si se creó una backorder
-                        backorder = request.env["stock.picking"].sudo().search([("backorder_id", "=", transferencia.id), ("state", "not in", ["done", "cancel"])], limit=1)
+            # ✅ Modo asíncrono: encolar la validación y devolver el id del trabajo de inmediato
+            if auth.get("asincrono"):
+                job = Job.enqueue("transferencia", transferencia, crear_backorder)
+                return {"code": 200, "msg": "Validación de la transferencia en cola", "job_id": job.id, "estado": job.state}
 
-                        return {"code": 200, "msg": "Transferencia procesada directamente", "original_id": transferencia.id, "original_state": transferencia.state, "backorder_id": backorder.id if backorder else False}
-                    else:
-                        transferencia.sudo()._action_done()
-
-                        return {"code": 200, "msg": "Transferencia completada sin backorder", "original_id": transferencia.id, "original_state": transferencia.state}
-
-                # Para asistente de transferencia inmediata
-                elif wizard_model == "stock.immediate.transfer":
-                    wizard_context = result.get("context", {})
-                    wizard = request.env[wizard_model].sudo().with_context(**wizard_context).create({})
-
-                    # En lugar de usar el wizard, completar directamente
-                    transferencia.sudo()._action_done()
-
-                    return {"code": 200, "msg": "Transferencia completada con éxito", "original_id": transferencia.id, "original_state": transferencia.state}
-
-                else:
-                    return {"code": 400, "msg": f"Acción adicional requerida no soportada: {wizard_model}"}
-
-            elif isinstance(result, bool) and result:
-                # Si button_validate retornó True, la transferencia se completó correctamente
-                return {"code": 200, "msg": "Transferencia completada directamente", "original_id": transferencia.id, "original_state": transferencia.state}
-            else:
-                return {"code": 400, "msg": f"No se pudo completar la transferencia: {result}"}
+            # Validar la transferencia en la misma petición
+            return Job._validar_transferencia(transferencia, crear_backorder)
 
         except Exception as e:
             return {"code": 500, "msg": f"Error interno: {str(e)}"}
@@ -757,20 +617,8 @@ class TransaccionTransferenciasController(http.Controller):
             if not barcode:
                 return {"code": 400, "msg": "Código de barras no proporcionado"}
 
-            # Buscar PRODUCTO por barcode directo
-            product = request.env["product.product"].sudo().search([("barcode", "=", barcode)], limit=1)
-
-            # Buscar PRODUCTO por paquete
-            if not product:
-                packaging = request.env["product.packaging"].sudo().search([("barcode", "=", barcode)], limit=1)
-                if packaging:
-                    product = packaging.product_id
-
-            # Buscar PRODUCTO por lote
-            if not product:
-                lot = request.env["stock.production.lot"].sudo().search([("name", "=", barcode)], limit=1)
-                if lot:
-                    product = lot.product_id
+            # ✅ Resolver el código (producto, empaque, código adicional, lote o ubicación) con el índice unificado
+            product, location = resolver_codigo(request.env, barcode)
 
             # Obtener almacenes del usuario
             allowed_warehouses = obtener_almacenes_usuario(user)
@@ -781,32 +629,41 @@ class TransaccionTransferenciasController(http.Controller):
 
             # PRODUCTO encontrado
             if product:
-                # CAMBIO PRINCIPAL: Buscar quants considerando TODOS los almacenes permitidos
-                quants = request.env["stock.quant"].sudo().search([("product_id", "=", product.id), ("available_quantity", ">", 0), ("location_id.usage", "=", "internal"), ("location_id.warehouse_id", "in", allowed_warehouses.ids)])
+                # CAMBIO PRINCIPAL: Buscar quants considerando TODOS los almacenes permitidos (una sola lectura)
+                quants = request.env["stock.quant"].sudo().search_read(
+                    [("product_id", "=", product.id), ("api_available_quantity", ">", 0), ("location_id.usage", "=", "internal"), ("location_id.warehouse_id", "in", allowed_warehouses.ids)],
+                    ["location_id", "lot_id", "api_available_quantity", "reserved_quantity", "quantity", "removal_date", "in_date"],
+                )
+
+                # ✅ Ubicaciones de los quants en una sola lectura y nombres de almacén desde los almacenes permitidos
+                location_ids = list({quant["location_id"][0] for quant in quants})
+                locations = {row["id"]: row for row in request.env["stock.location"].sudo().browse(location_ids).read(["complete_name", "barcode", "warehouse_id"])}
+                warehouse_names = {warehouse.id: warehouse.name for warehouse in allowed_warehouses}
 
                 ubicaciones = []
                 for quant in quants:
-                    # Verificar que el almacén esté en los permitidos
-                    warehouse = request.env["stock.warehouse"].sudo().search([("id", "=", quant.location_id.warehouse_id.id), ("id", "in", allowed_warehouses.ids)], limit=1)
+                    location = locations[quant["location_id"][0]]
+                    warehouse_id = location["warehouse_id"][0] if location["warehouse_id"] else False
 
-                    if not warehouse:
+                    # Verificar que el almacén esté en los permitidos
+                    if warehouse_id not in warehouse_names:
                         continue  # Saltar si no pertenece a un almacén del usuario
 
                     ubicaciones.append(
                         {
-                            "id_move": quant.id,
-                            "id_almacen": warehouse.id,
-                            "nombre_almacen": warehouse.name,
-                            "id_ubicacion": quant.location_id.id,
-                            "ubicacion": quant.location_id.complete_name or "",
-                            "cantidad": quant.available_quantity or 0,
-                            "reservado": quant.reserved_quantity or 0,
-                            "cantidad_mano": quant.quantity - quant.reserved_quantity,
-                            "codigo_barras": quant.location_id.barcode or "",
-                            "lote": quant.lot_id.name if quant.lot_id else "",
-                            "lote_id": quant.lot_id.id if quant.lot_id else 0,
-                            "fecha_eliminacion": quant.removal_date or "",
-                            "fecha_entrada": quant.in_date or "",
+                            "id_move": quant["id"],
+                            "id_almacen": warehouse_id,
+                            "nombre_almacen": warehouse_names[warehouse_id],
+                            "id_ubicacion": location["id"],
+                            "ubicacion": location["complete_name"] or "",
+                            "cantidad": quant["api_available_quantity"] or 0,
+                            "reservado": quant["reserved_quantity"] or 0,
+                            "cantidad_mano": quant["quantity"] - quant["reserved_quantity"],
+                            "codigo_barras": location["barcode"] or "",
+                            "lote": quant["lot_id"][1] if quant["lot_id"] else "",
+                            "lote_id": quant["lot_id"][0] if quant["lot_id"] else 0,
+                            "fecha_eliminacion": quant["removal_date"] or "",
+                            "fecha_entrada": quant["in_date"] or "",
                         }
                     )
 
@@ -832,29 +689,40 @@ class TransaccionTransferenciasController(http.Controller):
                     },
                 }
 
-            # Buscar UBICACIÓN por código de barras
-            location = request.env["stock.location"].sudo().search([("barcode", "=", barcode), ("usage", "=", "internal")], limit=1)  # Solo internas
-
+            # UBICACIÓN encontrada (solo internas)
             if location:
-                quants = request.env["stock.quant"].sudo().search([("location_id", "=", location.id), ("available_quantity", ">", 0)])
+                limit = int(kwargs["limit"]) if kwargs.get("limit") else None
+                offset = int(kwargs.get("offset", 0))
+
+                # ✅ Disponible por producto y lote en una consulta agrupada sobre el disponible almacenado (se pide un grupo extra para saber si hay más)
+                grupos = request.env["stock.quant"].sudo().read_group(
+                    [("location_id", "=", location.id), ("api_available_quantity", ">", 0)],
+                    ["api_available_quantity:sum"],
+                    ["product_id", "lot_id"],
+                    offset=offset,
+                    limit=limit + 1 if limit else None,
+                    orderby="product_id, lot_id",
+                    lazy=False,
+                )
+                hay_mas = bool(limit) and len(grupos) > limit
+                grupos = grupos[:limit] if limit else grupos
 
-                productos_dict = {}
-                for quant in quants:
-                    prod = quant.product_id
-                    if prod.id not in productos_dict:
-                        productos_dict[prod.id] = {
-                            "id": prod.id,
-                            "producto": prod.display_name,
-                            "cantidad": 0.0,
-                            "codigo_barras": prod.barcode,
-                            "lot_id": quant.lot_id.id if quant.lot_id else 0,
-                            "lote": quant.lot_id.name if quant.lot_id else "",
-                            "id_almacen": location.warehouse_id.id if location.warehouse_id else 0,
-                            "nombre_almacen": location.warehouse_id.name if location.warehouse_id else "",
-                        }
-                    productos_dict[prod.id]["cantidad"] += quant.available_quantity
+                product_ids = list({grupo["product_id"][0] for grupo in grupos})
+                barcodes = {row["id"]: row["barcode"] for row in request.env["product.product"].sudo().browse(product_ids).read(["barcode"])}
 
-                productos = list(productos_dict.values())
+                productos = [
+                    {
+                        "id": grupo["product_id"][0],
+                        "producto": grupo["product_id"][1],
+                        "cantidad": grupo["api_available_quantity"],
+                        "codigo_barras": barcodes.get(grupo["product_id"][0]) or False,
+                        "lot_id": grupo["lot_id"][0] if grupo["lot_id"] else 0,
+                        "lote": grupo["lot_id"][1] if grupo["lot_id"] else "",
+                        "id_almacen": location.warehouse_id.id if location.warehouse_id else 0,
+                        "nombre_almacen": location.warehouse_id.name if location.warehouse_id else "",
+                    }
+                    for grupo in grupos
+                ]
 
                 return {
                     "code": 200,
@@ -868,6 +736,9 @@ class TransaccionTransferenciasController(http.Controller):
                         "tipo_ubicacion": location.usage,
                         "codigo_barras": location.barcode,
                         "productos": productos,
+                        "offset": offset,
+                        "limit": limit or 0,
+                        "hay_mas": hay_mas,
                     },
                 }
 
@@ -891,19 +762,34 @@ class TransaccionTransferenciasController(http.Controller):
             id_ubicacion_destino = auth.get("id_ubicacion_destino", 0)
             id_ubicacion_origen = auth.get("id_ubicacion_origen", 0)
             id_responsable = auth.get("id_operario", 0)
-            id_producto = auth.get("id_producto", 0)
-            cantidad_enviada = auth.get("cantidad_enviada", 0)
-            id_lote = auth.get("id_lote", 0)
-            fecha_transaccion = auth.get("fecha_transaccion", "")
-            novedad = auth.get("observacion", "")
-            time_line = int(auth.get("time_line", 0))
+
+            # ✅ Varias líneas en 'list_items' o una sola con los parámetros de la cabecera
+            list_items = auth.get("list_items")
+            una_linea = not list_items
+            if una_linea:
+                list_items = [auth]
 
             # ✅ Validar parámetros obligatorios
             if not id_almacen or not id_ubicacion_destino or not id_ubicacion_origen:
                 return {"code": 400, "msg": "Faltan parámetros de ubicación"}
 
-            if not id_producto or cantidad_enviada <= 0:
-                return {"code": 400, "msg": "Cantidad o producto inválido"}
+            lineas = []
+            for item in list_items:
+                linea = {
+                    "id_producto": item.get("id_producto", 0),
+                    "cantidad_enviada": item.get("cantidad_enviada", 0),
+                    "id_lote": item.get("id_lote", 0),
+                    "id_ubicacion_origen": item.get("id_ubicacion_origen") or id_ubicacion_origen,
+                    "id_ubicacion_destino": item.get("id_ubicacion_destino") or id_ubicacion_destino,
+                    "fecha_transaccion": item.get("fecha_transaccion", ""),
+                    "novedad": item.get("observacion", ""),
+                    "time_line": int(item.get("time_line", 0)),
+                }
+
+                if not linea["id_producto"] or linea["cantidad_enviada"] <= 0:
+                    return {"code": 400, "msg": "Cantidad o producto inválido"}
+
+                lineas.append(linea)
 
             # ✅ Buscar tipo de picking interno
             picking_type = request.env["stock.picking.type"].sudo().search([("warehouse_id", "=", id_almacen), ("code", "=", "internal")], limit=1)
@@ -911,15 +797,25 @@ class TransaccionTransferenciasController(http.Controller):
             if not picking_type:
                 return {"code": 404, "msg": "Tipo de transferencia interna no encontrado"}
 
-            # ✅ Verificar disponibilidad de stock
-            product = request.env["product.product"].sudo().browse(id_producto)
-            if not product:
-                return {"code": 404, "msg": "Producto no encontrado"}
+            # ✅ Verificar que existan los productos (una sola consulta)
+            products = request.env["product.product"].sudo().browse(list({linea["id_producto"] for linea in lineas})).exists()
+            products_by_id = {product.id: product for product in products}
+            for linea in lineas:
+                if linea["id_producto"] not in products_by_id:
+                    return {"code": 404, "msg": "Producto no encontrado"}
 
-            # Verificar stock disponible en ubicación de origen
-            available_stock = product.with_context(location=id_ubicacion_origen).qty_available
-            if available_stock < cantidad_enviada:
-                return {"code": 400, "msg": f"Stock insuficiente. Disponible: {available_stock}"}
+            # ✅ Verificar stock disponible en las ubicaciones de origen de todas las líneas con una consulta agrupada
+            disponible = stock_por_producto_y_origen(request.env, products.ids, list({linea["id_ubicacion_origen"] for linea in lineas}))
+
+            solicitado = {}
+            for linea in lineas:
+                key = (linea["id_producto"], linea["id_ubicacion_origen"])
+                solicitado[key] = solicitado.get(key, 0) + linea["cantidad_enviada"]
+
+            for (id_producto, id_origen), cantidad in solicitado.items():
+                available_stock = disponible.get((id_producto, id_origen), 0)
+                if available_stock < cantidad:
+                    return {"code": 400, "msg": f"Stock insuficiente. Disponible: {available_stock}", "id_producto": id_producto}
 
             # ✅ Crear picking (transferencia)
             picking = (
@@ -937,24 +833,28 @@ class TransaccionTransferenciasController(http.Controller):
                 )
             )
 
-            # ✅ Crear movimiento (stock.move)
-            move = (
+            # ✅ Crear todos los movimientos (stock.move) con un solo create
+            moves = (
                 request.env["stock.move"]
                 .sudo()
                 .create(
-                    {
-                        "name": product.name,
-                        "product_id": id_producto,
-                        "product_uom_qty": cantidad_enviada,
-                        "product_uom": product.uom_id.id,
-                        "location_id": id_ubicacion_origen,
-                        "location_dest_id": id_ubicacion_destino,
-                        "picking_id": picking.id,
-                    }
+                    [
+                        {
+                            "name": products_by_id[linea["id_producto"]].name,
+                            "product_id": linea["id_producto"],
+                            "product_uom_qty": linea["cantidad_enviada"],
+                            "product_uom": products_by_id[linea["id_producto"]].uom_id.id,
+                            "location_id": linea["id_ubicacion_origen"],
+                            "location_dest_id": linea["id_ubicacion_destino"],
+                            "picking_id": picking.id,
+                        }
+                        for linea in lineas
+                    ]
                 )
             )
 
-            # ✅ Confirmar y asignar
+            # ✅ Confirmar (sin fusionar movimientos, cada línea conserva su movimiento) y asignar
+            moves._action_confirm(merge=False)
             picking.action_confirm()
             picking.action_assign()
 
@@ -962,52 +862,340 @@ class TransaccionTransferenciasController(http.Controller):
             if picking.state not in ["assigned", "done"]:
                 return {"code": 400, "msg": f"No se pudo asignar la transferencia. Estado: {picking.state} - id {picking.id} - {picking.name}"}
 
-            # ✅ Obtener move_line creado automáticamente
-            move_line = move.move_line_ids and move.move_line_ids[0] or False
+            # ✅ Registrar en el move_line creado automáticamente de cada movimiento los datos de su línea
+            fecha_envio = datetime.now(pytz.utc)
+            move_lines = []
+            for move, linea in zip(moves, lineas):
+                move_line = move.move_line_ids and move.move_line_ids[0] or False
 
-            if move_line:
-                move_line.write(
-                    {
-                        "lot_id": id_lote or False,
-                        "qty_done": cantidad_enviada,
-                        "user_operator_id": id_responsable or user.id,
-                        "new_observation": novedad,
-                        "time": time_line,
-                        "date_transaction": procesar_fecha_naive(fecha_transaccion, "America/Bogota") if fecha_transaccion else datetime.now(pytz.utc),
-                    }
-                )
+                if move_line:
+                    move_line.write(
+                        {
+                            "lot_id": linea["id_lote"] or False,
+                            "qty_done": linea["cantidad_enviada"],
+                            "user_operator_id": id_responsable or user.id,
+                            "new_observation": linea["novedad"],
+                            "time": linea["time_line"],
+                            "date_transaction": procesar_fecha_naive(linea["fecha_transaccion"], "America/Bogota") if linea["fecha_transaccion"] else fecha_envio,
+                        }
+                    )
+                move_lines.append(move_line)
 
-            # ✅ Validar picking (forzar validación)
+            # ✅ Validar picking una sola vez (forzar validación)
             try:
                 picking.button_validate()
             except Exception as validate_err:
                 return {"code": 400, "msg": f"Error en validación: {str(validate_err)}"}
 
-            return {
+            resultado_lineas = []
+            for move_line, linea in zip(move_lines, lineas):
+                product = products_by_id[linea["id_producto"]]
+                resultado_lineas.append(
+                    {
+                        "linea_id": move_line.id if move_line else 0,
+                        "cantidad_enviada": move_line.qty_done if move_line else 0,
+                        "id_producto": product.id,
+                        "nombre_producto": product.display_name,
+                        "ubicacion_origen": move_line.location_id.name if move_line else "",
+                        "ubicacion_destino": move_line.location_dest_id.name if move_line else "",
+                        "fecha_transaccion": move_line.date_transaction if move_line else "",
+                        "observacion": move_line.new_observation if move_line else "",
+                        "time_line": move_line.time if move_line else 0,
+                        "user_operator_id": move_line.user_operator_id.id if move_line else 0,
+                        "user_operator_name": move_line.user_operator_id.name if move_line else "",
+                        "id_lote": move_line.lot_id.id if move_line and move_line.lot_id else 0,
+                    }
+                )
+
+            respuesta = {
                 "code": 200,
                 "msg": "Transferencia creada y validada correctamente",
                 "transferencia_id": picking.id,
                 "nombre_transferencia": picking.name,
-                "linea_id": move_line.id if move_line else 0,
-                "cantidad_enviada": move_line.qty_done if move_line else 0,
-                "id_producto": product.id,
-                "nombre_producto": product.display_name,
-                "ubicacion_origen": move_line.location_id.name if move_line else "",
-                "ubicacion_destino": move_line.location_dest_id.name if move_line else "",
-                "fecha_transaccion": move_line.date_transaction if move_line else "",
-                "observacion": move_line.new_observation if move_line else "",
-                "time_line": move_line.time if move_line else 0,
-                "user_operator_id": move_line.user_operator_id.id if move_line else 0,
-                "user_operator_name": move_line.user_operator_id.name if move_line else "",
-                "id_lote": move_line.lot_id.id if move_line and move_line.lot_id else 0,
+                "lineas": resultado_lineas,
             }
 
+            # Una sola línea: se conservan los campos de la línea en la raíz de la respuesta
+            if una_linea:
+                respuesta.update(resultado_lineas[0])
+
+            return respuesta
+
         except AccessError as e:
             return {"code": 403, "msg": f"Acceso denegado: {str(e)}"}
         except Exception as err:
             return {"code": 400, "msg": f"Error inesperado: {str(err)}"}
 
 
+def stock_por_producto_y_origen(env, product_ids, origin_ids):
+    """Cantidad a la mano ``{(id producto, id ubicación origen): cantidad}`` en cada ubicación de origen
+    y sus hijas (mismo criterio que ``qty_available`` con contexto ``location``), con una consulta agrupada."""
+    # Ubicaciones hijas de los orígenes y a qué origen pertenece cada una (según parent_path)
+    origins = set(origin_ids)
+    origins_by_location = {}
+    for row in env["stock.location"].sudo().search_read([("id", "child_of", list(origins))], ["parent_path"]):
+        origins_by_location[row["id"]] = [int(part) for part in row["parent_path"].split("/") if part and int(part) in origins]
+
+    grupos = env["stock.quant"].sudo().read_group(
+        [("product_id", "in", product_ids), ("location_id", "in", list(origins_by_location))],
+        ["quantity:sum"],
+        ["product_id", "location_id"],
+        lazy=False,
+    )
+
+    disponible = {}
+    for grupo in grupos:
+        for origin_id in origins_by_location.get(grupo["location_id"][0], []):
+            key = (grupo["product_id"][0], origin_id)
+            disponible[key] = disponible.get(key, 0) + grupo["quantity"]
+    return disponible
+
+
+def dominio_transferencias_pendientes(user, warehouse):
+    """Transferencias internas pendientes del almacén asignadas al usuario o sin responsable."""
+    return [
+        ("state", "=", "assigned"),
+        ("picking_type_code", "=", "internal"),  # Transferencia interna
+        ("picking_type_id.warehouse_id", "=", warehouse.id),
+        ("picking_type_id.sequence_code", "=", "INT"),  # Transferencia interna
+        "|",  # <- OR lógico para incluir ambos casos
+        ("user_id", "=", user.id),  # Transferencias asignadas al usuario actual
+        ("user_id", "=", False),  # Transferencias sin responsable asignado
+    ]
+
+
+def construir_transferencia(env, picking, warehouse):
+    """Arma una transferencia con sus líneas pendientes y enviadas. Devuelve None si no tiene líneas."""
+    # Verificar si hay movimientos pendientes - CORREGIDO AQUÍ
+    # movimientos_pendientes = picking.move_lines.mapped("move_line_ids").filtered(lambda ml: ml.state == "assigned")
+    movimientos_pendientes = picking.move_lines.mapped("move_line_ids")
+
+    # Si no hay movimientos pendientes, omitir esta transferencia
+    if not movimientos_pendientes:
+        return None
+
+    # Calcular peso total
+    peso_total = sum(move.product_id.weight * move.qty_done for move in movimientos_pendientes if move.product_id.weight)
+
+    # Calcular número de ítems (suma total de cantidades)
+    numero_items = sum(move.qty_done for move in movimientos_pendientes)
+
+    transferencia_info = {
+        "id": picking.id,
+        "name": picking.name,  # Nombre de la transferencia
+        "fecha_creacion": picking.create_date,  # Fecha con hora
+        "location_id": picking.location_id.id,
+        "location_name": picking.location_id.display_name,  # Ubicación origen
+        "location_dest_id": picking.location_dest_id.id,
+        "location_dest_name": picking.location_dest_id.display_name,  # Ubicación destino
+        "numero_transferencia": picking.name,  # Número de transferencia
+        "peso_total": peso_total,  # Peso total
+        "numero_lineas": 0,  # Número de líneas (productos)
+        "numero_items": 0,  # Número de ítems (cantidades)
+        "state": picking.state,
+        "origin": picking.origin or "",
+        "priority": picking.priority,
+        "warehouse_id": warehouse.id,
+        "warehouse_name": warehouse.name,
+        "responsable_id": picking.user_id.id or 0,
+        "responsable": picking.user_id.name or "",
+        "picking_type": picking.picking_type_id.name,
+        "start_time_transfer": picking.start_time_transfer or "",
+        "end_time_transfer": picking.end_time_transfer or "",
+        "backorder_id": picking.backorder_id.id or 0,
+        "backorder_name": picking.backorder_id.name or "",
+        "show_check_availability": picking.show_check_availability,
+        "lineas_transferencia": [],  # Líneas pendientes (is_done_item = False)
+        "lineas_transferencia_enviadas": [],  # Líneas procesadas (is_done_item = True)
+    }
+
+    # ✅ Procesar las líneas de movimiento
+    for move_line in movimientos_pendientes:
+        product = move_line.product_id
+
+        # Obtener códigos de barras adicionales
+        array_barcodes = []
+        if "barcode_ids" in product.fields_get():
+            array_barcodes = [
+                {
+                    "barcode": barcode.name,
+                    "id_move": move_line.move_id.id,
+                    "id_product": product.id,
+                    "batch_id": picking.id,
+                }
+                for barcode in product.barcode_ids
+                if barcode.name
+            ]
+
+        # Obtener empaques del producto
+        array_packing = []
+        if "packaging_ids" in product.fields_get():
+            array_packing = [
+                {
+                    "barcode": pack.barcode,
+                    "cantidad": pack.qty,
+                    "id_move": move_line.move_id.id,
+                    "id_product": product.id,
+                    "batch_id": picking.id,
+                }
+                for pack in product.packaging_ids
+                if pack.barcode
+            ]
+
+        # Generar la información base común para todas las líneas
+        linea_info = {
+            "id": move_line.id,
+            "id_move": move_line.id,
+            "id_transferencia": picking.id,
+            "product_id": product.id,
+            "product_name": product.name,
+            "product_code": product.default_code or "",
+            "product_barcode": product.barcode or "",
+            "product_tracking": product.tracking or "",
+            "dias_vencimiento": product.expiration_time or "",
+            "other_barcodes": array_barcodes,
+            "product_packing": array_packing,
+            "quantity_ordered": move_line.product_qty,
+            "quantity_to_transfer": move_line.product_qty,
+            "quantity_done": move_line.qty_done,
+            "uom": move_line.product_uom_id.name if move_line.product_uom_id else "UND",
+            "location_dest_id": move_line.location_dest_id.id or 0,
+            "location_dest_name": move_line.location_dest_id.display_name or "",
+            "location_dest_barcode": move_line.location_dest_id.barcode or "",
+            "location_id": move_line.location_id.id or 0,
+            "location_name": move_line.location_id.display_name or "",
+            "location_barcode": move_line.location_id.barcode or "",
+            "weight": product.weight or 0,
+            "is_done_item": move_line.is_done_item,
+            "date_transaction": move_line.date_transaction or "",
+            "observation": move_line.new_observation or "",
+            "time": move_line.time or 0,
+            "user_operator_id": move_line.user_operator_id.id or 0,
+        }
+
+        # Añadir información específica del lote
+        if move_line.lot_id:
+            linea_info.update(
+                {
+                    "lot_id": move_line.lot_id.id,
+                    "lot_name": move_line.lot_id.name,
+                    "fecha_vencimiento": move_line.lot_id.expiration_date or "",
+                }
+            )
+        else:
+            linea_info.update(
+                {
+                    "lot_id": 0,
+                    "lot_name": "",
+                    "fecha_vencimiento": "",
+                }
+            )
+
+        # Determinar a qué lista añadir la línea según is_done_item
+        if hasattr(move_line, "is_done_item") and move_line.is_done_item:
+            transferencia_info["lineas_transferencia_enviadas"].append(linea_info)
+        else:
+            transferencia_info["lineas_transferencia"].append(linea_info)
+
+    transferencia_info["numero_lineas"] = len(transferencia_info["lineas_transferencia"])
+    transferencia_info["numero_items"] = sum(linea["quantity_to_transfer"] for linea in transferencia_info["lineas_transferencia"])
+    return transferencia_info
+
+
+def resolver_codigo(env, barcode):
+    """Resuelve un código escaneado a ``(producto, ubicación)`` (uno de los dos vacío).
+
+    Las coincidencias salen de ``api.barcode.index`` en una sola consulta indexada. La coincidencia
+    elegida se guarda en una cache LRU del proceso, válida mientras no cambie la versión ``codigos``
+    (cualquier escritura del índice la incrementa); en un acierto solo se comprueba ese registro.
+    Los códigos sin coincidencias no se guardan: un código recién creado se encuentra en el siguiente escaneo."""
+    key = (env.cr.dbname, barcode)
+    version = env["api.cache.version"].sudo().get(CACHE_CODIGOS)
+    with _CODIGOS_LOCK:
+        cached = _CODIGOS_CACHE.get(key)
+        if cached is not None and cached[0] == version:
+            _CODIGOS_CACHE.move_to_end(key)
+        else:
+            cached = None
+
+    if cached is not None:
+        product, location, match = primera_coincidencia(env, barcode, [cached[1]])
+        if match:
+            return product, location
+
+    Index = env["api.barcode.index"].sudo()
+    product, location, match = primera_coincidencia(env, barcode, Index.lookup(barcode))
+
+    # Códigos adicionales creados o cambiados fuera del formulario del producto: se buscan y se indexan
+    Product = env["product.product"].sudo()
+    if not match and "barcode_ids" in Product._fields:
+        fallback = Product.search([("barcode_ids.name", "=", barcode)], order="id", limit=1)
+        if fallback:
+            Index._sync_other_barcodes(fallback)
+            product, match = fallback, ("other_barcode", "product.product", fallback.id, fallback.id)
+
+    if match:
+        with _CODIGOS_LOCK:
+            _CODIGOS_CACHE[key] = (version, match)
+            _CODIGOS_CACHE.move_to_end(key)
+            while len(_CODIGOS_CACHE) > CODIGOS_CACHE_MAX:
+                _CODIGOS_CACHE.popitem(last=False)
+
+    return product, location
+
+
+def primera_coincidencia(env, barcode, matches):
+    """Primera coincidencia vigente de ``matches`` (en orden de prioridad) como ``(producto, ubicación, coincidencia)``.
+
+    Las filas desactualizadas (el registro ya no existe o ya no tiene ese código) se saltan, se
+    eliminan del índice y sus registros se vuelven a sincronizar."""
+    product = env["product.product"].sudo()
+    location = env["stock.location"].sudo()
+    result = (product, location, None)
+    stale = []
+
+    for match in matches:
+        kind, res_model, res_id, _product_id = match
+        record = env[res_model].sudo().browse(res_id).exists()
+
+        if kind == "other_barcode":
+            vigente = record and barcode in record.barcode_ids.mapped("name")
+        elif kind == "lot":
+            vigente = record and record.name == barcode
+        else:
+            vigente = record and record.barcode == barcode
+
+        if not vigente:
+            stale.append(match)
+            continue
+
+        if kind in ("product", "other_barcode"):
+            if record.active:
+                result = (record, location, match)
+                break
+        elif kind in ("packaging", "lot"):
+            result = (record.product_id, location, match)
+            break
+        elif kind == "location":
+            if record.active and record.usage == "internal":
+                result = (product, record, match)
+                break
+
+    if stale:
+        env["api.barcode.index"].sudo().discard(barcode, stale)
+
+    return result
+
+
+def iterar_transferencias(env, picking_ids):
+    """Genera las transferencias de ``picking_ids`` una a una, procesándolas por bloques."""
+    for pickings in iterar_en_bloques(env["stock.picking"].sudo().browse(picking_ids)):
+        for picking in pickings:
+            transferencia_info = construir_transferencia(env, picking, picking.picking_type_id.warehouse_id)
+            if transferencia_info:
+                yield transferencia_info
+
+
 def procesar_fecha_naive(fecha_transaccion, zona_horaria_cliente):
     if fecha_transaccion:
         # Convertir la fecha enviada a datetime y agregar la zona horaria del cliente
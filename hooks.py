@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+from .models.api_sync_tombstone import MODELOS_REGISTRADOS
+
+
+def uninstall_hook(cr, registry):
+    """Elimina los objetos creados por SQL en tablas de otros módulos, que Odoo no quita al desinstalar.
+
+    Los triggers llaman funciones que escriben en tablas de este módulo: si quedaran, cualquier
+    escritura en esas tablas fallaría una vez desinstalado."""
+    # ✅ Triggers de versión de las caches por proceso (CASCADE elimina los triggers)
+    cr.execute("DROP FUNCTION IF EXISTS api_cache_version_bump() CASCADE")
+
+    # ✅ Registro de eliminaciones de la sincronización incremental (CASCADE elimina los triggers)
+    cr.execute("DROP FUNCTION IF EXISTS api_sync_tombstone_log() CASCADE")
+    for table, _batch_column, _location_column in MODELOS_REGISTRADOS.values():
+        cr.execute(f'DROP INDEX IF EXISTS "{table}_api_write_date_idx"')
+        cr.execute("DELETE FROM ir_config_parameter WHERE key = %s", (f"api_onpoint.sync_tombstone_since.{table}",))
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+
+from . import api_cache_version
+from . import api_idempotency_key
+from . import api_picking_claim
+from . import api_package_reservation
+from . import api_validation_job
+from . import api_sync_tombstone
+from . import api_barcode_index
+from . import barcode_indexed_models
+from . import stock_quant
+from . import stock_location
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from psycopg2.extras import execute_values
+
+from odoo import api, fields, models
+
+from .api_cache_version import CACHE_CODIGOS
+
+_logger = logging.getLogger(__name__)
+
+# Prioridad de resolución de un código cuando coincide con varios registros (igual que el orden de búsqueda histórico)
+PRIORIDAD_TIPOS = ("product", "packaging", "other_barcode", "lot", "location")
+
+
+class ApiBarcodeIndex(models.Model):
+    _name = "api.barcode.index"
+    _description = "Índice unificado de códigos de barras"
+    _log_access = False
+
+    code = fields.Char("Código", required=True, index=True)
+    kind = fields.Selection(
+        [("product", "Producto"), ("packaging", "Empaque"), ("other_barcode", "Código adicional"), ("lot", "Lote"), ("location", "Ubicación")],
+        "Tipo",
+        required=True,
+    )
+    res_model = fields.Char("Modelo", required=True)
+    res_id = fields.Integer("Registro", required=True)
+    product_id = fields.Integer("Producto")
+
+    def init(self):
+        """Reconstruye el índice completo al instalar o actualizar el módulo."""
+        self._rebuild()
+
+    @api.model
+    def _rebuild(self):
+        cr = self.env.cr
+        cr.execute(f"DELETE FROM {self._table}")
+        cr.execute(
+            f"""
+            INSERT INTO {self._table} (code, kind, res_model, res_id, product_id)
+            SELECT barcode, 'product', 'product.product', id, id FROM product_product WHERE barcode IS NOT NULL AND barcode != ''
+            UNION ALL
+            SELECT barcode, 'packaging', 'product.packaging', id, product_id FROM product_packaging WHERE barcode IS NOT NULL AND barcode != ''
+            UNION ALL
+            SELECT name, 'lot', 'stock.production.lot', id, product_id FROM stock_production_lot WHERE name IS NOT NULL
+            UNION ALL
+            SELECT barcode, 'location', 'stock.location', id, NULL FROM stock_location WHERE barcode IS NOT NULL AND barcode != ''
+            """
+        )
+
+        # Códigos adicionales (barcode_ids) si el módulo que los define está instalado
+        Product = self.env["product.product"].with_context(active_test=False)
+        if "barcode_ids" in Product._fields:
+            self._sync_other_barcodes(Product.search([("barcode_ids", "!=", False)]))
+
+        self.env["api.cache.version"].sudo().bump(CACHE_CODIGOS)
+        _logger.info("Índice de códigos de barras reconstruido")
+
+    @api.model
+    def sync(self, records):
+        """Reemplaza las entradas de ``records`` con sus códigos actuales (``_barcode_index_entries``)."""
+        if not records:
+            return
+        self._delete_entries(records._name, records.ids, exclude_kind="other_barcode")
+        self._insert_entries(records._name, records.sudo()._barcode_index_entries())
+        self.env["api.cache.version"].sudo().bump(CACHE_CODIGOS)
+
+    @api.model
+    def _sync_other_barcodes(self, products):
+        """Reemplaza las entradas de los códigos adicionales (``barcode_ids``) de ``products``."""
+        if not products or "barcode_ids" not in products._fields:
+            return
+        self._delete_entries(products._name, products.ids, kind="other_barcode")
+        self._insert_entries(products._name, [(barcode.name, "other_barcode", product.id, product.id) for product in products.sudo() for barcode in product.barcode_ids if barcode.name])
+        self.env["api.cache.version"].sudo().bump(CACHE_CODIGOS)
+
+    @api.model
+    def remove(self, res_model, res_ids):
+        self._delete_entries(res_model, res_ids)
+        self.env["api.cache.version"].sudo().bump(CACHE_CODIGOS)
+
+    def _delete_entries(self, res_model, res_ids, kind=None, exclude_kind=None):
+        query = f"DELETE FROM {self._table} WHERE res_model = %s AND res_id = ANY(%s)"
+        params = [res_model, list(res_ids)]
+        if kind:
+            query += " AND kind = %s"
+            params.append(kind)
+        if exclude_kind:
+            query += " AND kind != %s"
+            params.append(exclude_kind)
+        self.env.cr.execute(query, params)
+
+    def _insert_entries(self, res_model, entries):
+        rows = [(code, kind, res_model, res_id, product_id or None) for code, kind, res_id, product_id in entries if code]
+        if rows:
+            execute_values(self.env.cr._obj, f"INSERT INTO {self._table} (code, kind, res_model, res_id, product_id) VALUES %s", rows)
+
+    @api.model
+    def discard(self, code, matches):
+        """Elimina las entradas desactualizadas ``matches`` de ``code`` y vuelve a sincronizar los registros que aún existen."""
+        for kind, res_model, res_id, _product_id in matches:
+            self.env.cr.execute(f"DELETE FROM {self._table} WHERE code = %s AND kind = %s AND res_model = %s AND res_id = %s", (code, kind, res_model, res_id))
+            record = self.env[res_model].sudo().browse(res_id).exists()
+            if record and kind == "other_barcode":
+                self._sync_other_barcodes(record)
+            elif record:
+                self.sync(record)
+        self.env["api.cache.version"].sudo().bump(CACHE_CODIGOS)
+
+    @api.model
+    def lookup(self, code):
+        """Coincidencias de ``code`` en orden de prioridad y de id: lista de ``(tipo, modelo, id, id producto)``, en una sola consulta indexada."""
+        self.env.cr.execute(
+            f"SELECT kind, res_model, res_id, product_id FROM {self._table} WHERE code = %s ORDER BY array_position(%s::varchar[], kind::varchar), res_id",
+            (code, list(PRIORIDAD_TIPOS)),
+        )
+        return self.env.cr.fetchall()
+
+
+class ApiBarcodeIndexedMixin(models.AbstractModel):
+    """Mantiene ``api.barcode.index`` al crear, modificar o eliminar registros con código de barras.
+
+    Los modelos que la heredan definen ``_barcode_index_fields`` y ``_barcode_index_entries``."""
+
+    _name = "api.barcode.indexed.mixin"
+    _description = "Sincronización con el índice de códigos de barras"
+
+    _barcode_index_fields = ()
+
+    def _barcode_index_entries(self):
+        """Lista de ``(código, tipo, id registro, id producto)`` de los registros."""
+        return []
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env["api.barcode.index"].sudo().sync(records)
+        if "barcode_ids" in self._barcode_index_fields:
+            self.env["api.barcode.index"].sudo()._sync_other_barcodes(records)
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        if any(field in vals for field in self._barcode_index_fields if field != "barcode_ids"):
+            self.env["api.barcode.index"].sudo().sync(self)
+        if "barcode_ids" in vals and "barcode_ids" in self._barcode_index_fields:
+            self.env["api.barcode.index"].sudo()._sync_other_barcodes(self)
+        return res
+
+    def unlink(self):
+        res_model, res_ids = self._name, self.ids
+        res = super().unlink()
+        self.env["api.barcode.index"].sudo().remove(res_model, res_ids)
+        return res
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# Caches por proceso versionadas en api.cache.version
+CACHE_UBICACIONES_USUARIO = "ubicaciones_usuario"
+CACHE_CODIGOS = "codigos"
+
+# Caches con triggers instalados en este proceso (verificados una vez): {(base de datos, nombre): hay triggers}
+_TRIGGERS_INSTALADOS = {}
+
+
+class ApiCacheVersion(models.Model):
+    _name = "api.cache.version"
+    _description = "Versiones de las caches por proceso de la API"
+    _log_access = False
+
+    name = fields.Char("Cache", required=True)
+    version = fields.Integer("Versión", default=0, required=True)
+
+    _sql_constraints = [
+        ("name_uniq", "unique(name)", "La cache ya tiene versión"),
+    ]
+
+    def init(self):
+        # ✅ Función de trigger que incrementa la versión indicada en el argumento
+        self.env.cr.execute(
+            f"""
+            CREATE OR REPLACE FUNCTION api_cache_version_bump() RETURNS trigger AS $$
+            BEGIN
+                INSERT INTO {self._table} (name, version) VALUES (TG_ARGV[0], 1)
+                ON CONFLICT (name) DO UPDATE SET version = {self._table}.version + 1;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            """
+        )
+
+        # ✅ Triggers de las tablas WMS que cambian las ubicaciones de cada usuario
+        for table, events in self._tablas_zonas_usuario():
+            self._create_trigger(CACHE_UBICACIONES_USUARIO, table, events)
+
+    @api.model
+    def get(self, name):
+        """Versión actual de la cache ``name`` (una lectura por el índice único)."""
+        self.env.cr.execute(f"SELECT version FROM {self._table} WHERE name = %s", (name,))
+        row = self.env.cr.fetchone()
+        return row[0] if row else 0
+
+    @api.model
+    def bump(self, name):
+        """Incrementa la versión de la cache ``name``; las caches de los demás workers la ven al confirmar la transacción.
+
+        El incremento se aplica una sola vez por transacción, justo antes del commit, así la fila del
+        contador queda bloqueada lo mínimo y las transacciones que escriben a la vez no se serializan."""
+        pendientes = self.env.cr.precommit.data.setdefault(self._name, set())
+        if not pendientes:
+            self.env.cr.precommit.add(self._apply_bumps)
+        pendientes.add(name)
+
+    def _apply_bumps(self):
+        for name in sorted(self.env.cr.precommit.data.pop(self._name, set())):
+            self.env.cr.execute(
+                f"INSERT INTO {self._table} (name, version) VALUES (%s, 1) ON CONFLICT (name) DO UPDATE SET version = {self._table}.version + 1",
+                (name,),
+            )
+
+    def _create_trigger(self, name, table, events):
+        """Crea (si no existe) un trigger por sentencia sobre ``table`` que incrementa la versión ``name``.
+
+        Se usa al instalar o actualizar el módulo, para tablas de módulos de los que este no depende,
+        donde no se pueden sobrescribir create/write/unlink. ``events`` es la lista de eventos del
+        trigger, por ejemplo ``"INSERT OR DELETE OR UPDATE OF active"``. El ``uninstall_hook`` los elimina."""
+        if not self._table_exists(table):
+            return
+
+        # Un trigger por combinación de cache y eventos, una misma tabla puede tener varios
+        trigger = f"api_cache_{name}_{hashlib.md5(f'{table} {events}'.encode()).hexdigest()[:12]}"
+        self.env.cr.execute("SELECT 1 FROM pg_trigger WHERE tgname = %s AND tgrelid = %s::regclass", (trigger, table))
+        if not self.env.cr.fetchone():
+            self.env.cr.execute(f'CREATE TRIGGER "{trigger}" AFTER {events} ON "{table}" FOR EACH STATEMENT EXECUTE PROCEDURE api_cache_version_bump(%s)', (name,))
+            _logger.info("Cache %s: trigger de versión creado en %s", name, table)
+
+    def _table_exists(self, table):
+        self.env.cr.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+        row = self.env.cr.fetchone()
+        return bool(row) and row[0] in ("r", "p")
+
+    def _tablas_zonas_usuario(self):
+        """Tablas WMS (y eventos) que cambian las zonas de un usuario o las ubicaciones de una zona:
+        las tablas de relación de ``zone_ids``/``location_ids`` si son many2many, o la columna inversa
+        si son one2many, y el borrado o archivado de las zonas.
+
+        Los campos se leen de ``ir_model_fields`` y no del registro, porque el módulo WMS puede
+        cargarse después de este."""
+        cr = self.env.cr
+
+        def campo(model, name):
+            cr.execute("SELECT ttype, relation, relation_table, relation_field FROM ir_model_fields WHERE model = %s AND name = %s", (model, name))
+            return cr.fetchone()
+
+        zone_field = campo("appwms.users_wms", "zone_ids")
+        if not zone_field:
+            return []
+        location_field = campo(zone_field[1], "location_ids")
+
+        tables = []
+        for field in filter(None, (zone_field, location_field)):
+            ttype, comodel, relation_table, inverse_name = field
+            if ttype == "many2many":
+                tables.append((relation_table, "INSERT OR UPDATE OR DELETE OR TRUNCATE"))
+            elif ttype == "one2many" and comodel != "stock.location":
+                # En stock.location la columna inversa la cubren sus hooks de escritura
+                tables.append((comodel.replace(".", "_"), f'INSERT OR DELETE OR UPDATE OF "{inverse_name}"'))
+
+        zone_table = zone_field[1].replace(".", "_")
+        cr.execute("SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = 'active'", (zone_table,))
+        tables.append((zone_table, "DELETE OR UPDATE OF active" if cr.fetchone() else "DELETE"))
+        return tables
+
+    @api.model
+    def has_triggers(self, name):
+        """Indica si están instalados los triggers de la cache ``name`` (se consulta una vez por proceso).
+
+        Sin triggers (módulo WMS instalado después de este, sin actualizar) la cache no se puede invalidar
+        y no debe usarse."""
+        key = (self.env.cr.dbname, name)
+        if key not in _TRIGGERS_INSTALADOS:
+            self.env.cr.execute("SELECT 1 FROM pg_trigger WHERE tgname LIKE %s LIMIT 1", (f"api\\_cache\\_{name}\\_%",))
+            _TRIGGERS_INSTALADOS[key] = bool(self.env.cr.fetchone())
+            if not _TRIGGERS_INSTALADOS[key]:
+                _logger.warning("Cache %s sin triggers de versión: actualice el módulo para activarla", name)
+        return _TRIGGERS_INSTALADOS[key]
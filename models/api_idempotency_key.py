@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+from datetime import timedelta
+
+import psycopg2
+
+from odoo import api, fields, models
+from odoo.tools import date_utils
+
+_logger = logging.getLogger(__name__)
+
+
+class ApiIdempotencyKey(models.Model):
+    _name = "api.idempotency.key"
+    _description = "Operaciones procesadas por la API (idempotencia)"
+
+    key = fields.Char("Id de operación", required=True)
+    endpoint = fields.Char(required=True)
+    user_id = fields.Many2one("res.users", required=True, ondelete="cascade")
+    response = fields.Text("Respuesta")
+    processed_date = fields.Datetime("Fecha de proceso", default=fields.Datetime.now, index=True)
+
+    _sql_constraints = [
+        ("key_endpoint_user_uniq", "unique(key, endpoint, user_id)", "La operación ya fue registrada"),
+    ]
+
+    @api.model
+    def run_once(self, key, endpoint, callback):
+        """Ejecuta ``callback`` una sola vez por ``key``/``endpoint``/usuario.
+
+        Un reintento con el mismo id de operación devuelve la respuesta guardada con una búsqueda
+        por el índice único, sin volver a ejecutar las escrituras. Si la operación original sigue
+        en curso en otra transacción, el insert espera a que termine y su respuesta se lee con un
+        cursor nuevo (la transacción actual no ve lo confirmado después de su inicio). Si aun así
+        no hay respuesta se devuelve 409 y el cliente debe reintentar con el mismo id."""
+        if not key:
+            return callback()
+
+        key = str(key)
+        user_id = self.env.uid
+        cached = self._get_response(key, endpoint, user_id)
+        if cached is not None:
+            return cached
+
+        # ✅ Reservar la operación antes de procesarla
+        try:
+            with self.env.cr.savepoint():
+                operation = self.create({"key": key, "endpoint": endpoint, "user_id": user_id})
+        except psycopg2.IntegrityError:
+            with self.pool.cursor() as cr:
+                cached = self.with_env(self.env(cr=cr))._get_response(key, endpoint, user_id)
+            if cached is not None:
+                return cached
+            return {"code": 409, "msg": f"La operación {key} ya está en proceso"}
+
+        response = callback()
+
+        # Solo se guardan las respuestas que reflejan escrituras realizadas
+        if isinstance(response, dict) and (response.get("code") == 200 or "result" in response):
+            operation.write({"response": json.dumps(response, default=date_utils.json_default)})
+        else:
+            operation.unlink()
+
+        return response
+
+    @api.model
+    def _get_response(self, key, endpoint, user_id):
+        operation = self.search_read([("key", "=", key), ("endpoint", "=", endpoint), ("user_id", "=", user_id), ("response", "!=", False)], ["response"], limit=1)
+        return json.loads(operation[0]["response"]) if operation else None
+
+    @api.model
+    def _cron_prune(self):
+        """Elimina las operaciones más antiguas que el TTL configurado (``api_onpoint.idempotency_ttl_hours``)."""
+        ttl_hours = int(self.env["ir.config_parameter"].sudo().get_param("api_onpoint.idempotency_ttl_hours", 24))
+        limit_date = fields.Datetime.now() - timedelta(hours=ttl_hours)
+        self.env.cr.execute(f"DELETE FROM {self._table} WHERE processed_date < %s", (limit_date,))
+        _logger.info("Idempotencia API: %s operaciones eliminadas", self.env.cr.rowcount)
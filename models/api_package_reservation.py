@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class ApiPackageReservation(models.Model):
+    _name = "api.package.reservation"
+    _description = "Nombres de paquete reservados por dispositivo"
+
+    name = fields.Char("Nombre del paquete", required=True)
+    device_id = fields.Char("Dispositivo", required=True, index=True)
+    user_id = fields.Many2one("res.users", "Usuario", required=True, ondelete="cascade")
+    expires_at = fields.Datetime("Expira", required=True, index=True)
+    package_id = fields.Many2one("stock.quant.package", "Paquete", ondelete="set null")
+
+    _sql_constraints = [
+        ("name_uniq", "unique(name)", "El nombre de paquete ya está reservado"),
+    ]
+
+    @api.model
+    def reserve(self, device_id, cantidad, ttl_hours):
+        """Reserva ``cantidad`` nombres de la secuencia de paquetes para el dispositivo, sin crear los paquetes."""
+        Sequence = self.env["ir.sequence"].sudo()
+        expires_at = fields.Datetime.now() + timedelta(hours=ttl_hours)
+        return self.create(
+            [
+                {"name": Sequence.next_by_code("stock.quant.package"), "device_id": device_id, "user_id": self.env.uid, "expires_at": expires_at}
+                for _index in range(cantidad)
+            ]
+        )
+
+    @api.model
+    def take(self, name):
+        """Devuelve la reserva vigente y sin usar de ``name`` para el usuario actual (bloqueada hasta el commit), o una vacía."""
+        self.env.cr.execute(
+            f"SELECT id FROM {self._table} WHERE name = %s AND user_id = %s AND package_id IS NULL AND expires_at > %s FOR UPDATE",
+            (name, self.env.uid, fields.Datetime.now()),
+        )
+        row = self.env.cr.fetchone()
+        return self.browse(row[0]) if row else self.browse()
+
+    @api.model
+    def _cron_prune(self):
+        """Elimina las reservas vencidas; los paquetes ya creados con esos nombres no se tocan."""
+        self.env.cr.execute(f"DELETE FROM {self._table} WHERE expires_at < %s", (fields.Datetime.now(),))
+        _logger.info("Reservas de paquetes: %s reservas vencidas eliminadas", self.env.cr.rowcount)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class ApiPickingClaim(models.Model):
+    _name = "api.picking.claim"
+    _description = "Líneas de picking reservadas por operario (batches wave)"
+
+    line_id = fields.Integer("Línea unificada", required=True, index=True)
+    batch_id = fields.Integer("Batch", required=True, index=True)
+    user_id = fields.Many2one("res.users", "Operario", required=True, ondelete="cascade")
+    expires_at = fields.Datetime("Expira", required=True, index=True)
+
+    _sql_constraints = [
+        ("line_uniq", "unique(line_id)", "La línea ya está reservada"),
+    ]
+
+    @api.model
+    def active_claims(self, batch_id):
+        """Reservas vigentes del batch: ``{id línea: id operario}``."""
+        claims = self.search_read([("batch_id", "=", batch_id), ("expires_at", ">", fields.Datetime.now())], ["line_id", "user_id"])
+        return {claim["line_id"]: claim["user_id"][0] for claim in claims}
+
+    @api.model
+    def claim_lines(self, batch_id, candidate_ids, limit, ttl_minutes):
+        """Reserva para el usuario actual hasta ``limit`` líneas de ``candidate_ids`` (en orden de preferencia).
+
+        Las filas se bloquean con ``FOR UPDATE SKIP LOCKED`` en bloques del tamaño pendiente, así dos
+        operarios que piden líneas a la vez obtienen conjuntos disjuntos sin esperar el uno al otro.
+        Devuelve los ids reservados en el orden de ``candidate_ids``."""
+        MoveUnified = self.env["move.line.unified"].sudo()
+        claimed = []
+        position = 0
+        while len(claimed) < limit and position < len(candidate_ids):
+            block = candidate_ids[position : position + limit - len(claimed)]
+            position += len(block)
+            self.env.cr.execute(
+                f"SELECT id FROM {MoveUnified._table} WHERE id = ANY(%s) AND is_done_item IS NOT TRUE FOR UPDATE SKIP LOCKED",
+                (block,),
+            )
+            locked = {row[0] for row in self.env.cr.fetchall()}
+            claimed += [line_id for line_id in block if line_id in locked]
+
+        if not claimed:
+            return []
+
+        # ✅ Registrar la reserva (o renovarla) y el operario en las líneas
+        expires_at = fields.Datetime.now() + timedelta(minutes=ttl_minutes)
+        self.env.cr.execute(
+            f"""
+            INSERT INTO {self._table} (line_id, batch_id, user_id, expires_at, create_uid, create_date, write_uid, write_date)
+            SELECT line_id, %(batch_id)s, %(uid)s, %(expires_at)s, %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+            FROM unnest(%(line_ids)s) AS line_id
+            ON CONFLICT (line_id) DO UPDATE
+            SET batch_id = EXCLUDED.batch_id, user_id = EXCLUDED.user_id, expires_at = EXCLUDED.expires_at,
+                write_uid = EXCLUDED.write_uid, write_date = EXCLUDED.write_date
+            """,
+            {"batch_id": batch_id, "uid": self.env.uid, "expires_at": expires_at, "line_ids": claimed},
+        )
+        self.invalidate_cache()
+        MoveUnified.browse(claimed).write({"user_operator_id": self.env.uid})
+        return claimed
+
+    @api.model
+    def _cron_prune(self):
+        """Elimina las reservas vencidas."""
+        self.env.cr.execute(f"DELETE FROM {self._table} WHERE expires_at < %s", (fields.Datetime.now(),))
+        _logger.info("Reservas de picking: %s reservas vencidas eliminadas", self.env.cr.rowcount)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# Modelos con el registro de eliminaciones: {modelo: (tabla, columna de batch, columna de ubicación)}.
+# Son de un módulo del que este no depende, por eso el registro se hace con un trigger sobre su tabla
+MODELOS_REGISTRADOS = {
+    "move.line.unified": ("move_line_unified", "stock_picking_batch_id", "location_id"),
+}
+
+
+class ApiSyncTombstone(models.Model):
+    _name = "api.sync.tombstone"
+    _description = "Registros eliminados (sincronización incremental de la API)"
+    _log_access = False
+
+    res_model = fields.Char("Modelo", required=True, index=True)
+    res_id = fields.Integer("Registro", required=True)
+    batch_id = fields.Integer("Batch")
+    location_id = fields.Integer("Ubicación")
+    deleted_date = fields.Datetime("Fecha de eliminación", required=True, index=True)
+
+    def init(self):
+        # ✅ Función de trigger que registra la fila eliminada; los argumentos son el modelo y las columnas de batch y ubicación
+        self.env.cr.execute(
+            f"""
+            CREATE OR REPLACE FUNCTION api_sync_tombstone_log() RETURNS trigger AS $$
+            DECLARE
+                fila jsonb := to_jsonb(OLD);
+            BEGIN
+                INSERT INTO {self._table} (res_model, res_id, batch_id, location_id, deleted_date)
+                VALUES (TG_ARGV[0], OLD.id, (fila ->> TG_ARGV[1])::integer, (fila ->> TG_ARGV[2])::integer, now() AT TIME ZONE 'UTC');
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            """
+        )
+
+        # ✅ Trigger de eliminaciones e índice de write_date (consultas delta) en las tablas que ya existen;
+        # si el módulo WMS se instala después, se crean al actualizar este módulo
+        ICP = self.env["ir.config_parameter"].sudo()
+        for res_model, (table, batch_column, location_column) in MODELOS_REGISTRADOS.items():
+            self.env.cr.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+            row = self.env.cr.fetchone()
+            if not row or row[0] not in ("r", "p"):
+                continue
+
+            self.env.cr.execute(f'CREATE INDEX IF NOT EXISTS "{table}_api_write_date_idx" ON "{table}" (write_date)')
+
+            trigger = f"api_sync_tombstone_{table}"[:63]
+            param = f"api_onpoint.sync_tombstone_since.{table}"
+            self.env.cr.execute("SELECT 1 FROM pg_trigger WHERE tgname = %s AND tgrelid = %s::regclass", (trigger, table))
+            if self.env.cr.fetchone() and ICP.get_param(param):
+                continue
+
+            self.env.cr.execute(f'DROP TRIGGER IF EXISTS "{trigger}" ON "{table}"')
+            self.env.cr.execute(f'CREATE TRIGGER "{trigger}" AFTER DELETE ON "{table}" FOR EACH ROW EXECUTE PROCEDURE api_sync_tombstone_log(%s, %s, %s)', (res_model, batch_column, location_column))
+            ICP.set_param(param, fields.Datetime.to_string(self.env.cr.now()))
+            _logger.info("Sincronización: trigger de eliminaciones creado en %s", table)
+
+    @api.model
+    def tracked_since(self, res_model):
+        """Fecha desde la que se registran las eliminaciones de ``res_model``, o None si no se registran.
+
+        Es la más reciente entre la creación del trigger (``init``) y el inicio de la retención de
+        ``_cron_prune``. Solo lee parámetros, no modifica la base de datos."""
+        table = MODELOS_REGISTRADOS[res_model][0]
+        since = self.env["ir.config_parameter"].sudo().get_param(f"api_onpoint.sync_tombstone_since.{table}")
+        if not since:
+            return None
+        return max(fields.Datetime.to_datetime(since), fields.Datetime.now() - timedelta(days=self._ttl_days()))
+
+    @api.model
+    def deleted_since(self, res_model, since):
+        """Eliminaciones de ``res_model`` desde ``since``: lista de dicts con ``res_id``, ``batch_id`` y ``location_id``."""
+        return self.search_read([("res_model", "=", res_model), ("deleted_date", ">=", since)], ["res_id", "batch_id", "location_id"])
+
+    @api.model
+    def _ttl_days(self):
+        return int(self.env["ir.config_parameter"].sudo().get_param("api_onpoint.sync_tombstone_days", 7))
+
+    @api.model
+    def _cron_prune(self):
+        """Elimina los registros más antiguos que la retención configurada (``api_onpoint.sync_tombstone_days``)."""
+        limit_date = fields.Datetime.now() - timedelta(days=self._ttl_days())
+        self.env.cr.execute(f"DELETE FROM {self._table} WHERE deleted_date < %s", (limit_date,))
+        _logger.info("Sincronización API: %s eliminaciones antiguas borradas", self.env.cr.rowcount)
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models
+from odoo.tools import date_utils
+
+_logger = logging.getLogger(__name__)
+
+# Tiempo máximo en ejecución antes de considerar un trabajo interrumpido (worker reiniciado o caído)
+JOB_TIMEOUT = timedelta(hours=1)
+
+
+class ApiValidationJob(models.Model):
+    _name = "api.validation.job"
+    _description = "Validaciones de recepciones y transferencias en segundo plano"
+    _order = "id"
+
+    picking_id = fields.Many2one("stock.picking", "Operación", required=True, ondelete="cascade", index=True)
+    kind = fields.Selection([("recepcion", "Recepción"), ("transferencia", "Transferencia")], "Tipo", required=True)
+    crear_backorder = fields.Boolean("Crear backorder", default=True)
+    user_id = fields.Many2one("res.users", "Usuario", required=True, ondelete="cascade")
+    state = fields.Selection(
+        [("queued", "En cola"), ("running", "En proceso"), ("done", "Completado"), ("failed", "Fallido")],
+        "Estado",
+        default="queued",
+        required=True,
+        index=True,
+    )
+    backorder_id = fields.Many2one("stock.picking", "Backorder", ondelete="set null")
+    response = fields.Text("Respuesta")
+    error = fields.Text("Error")
+    date_start = fields.Datetime("Inicio")
+    date_end = fields.Datetime("Fin")
+
+    @api.model
+    def enqueue(self, kind, picking, crear_backorder):
+        """Encola la validación de ``picking`` y despierta el cron. Si ya hay un trabajo pendiente
+        para la misma operación se devuelve ese, así un reintento de la app no valida dos veces."""
+        job = self.search([("picking_id", "=", picking.id), ("state", "in", ("queued", "running"))], limit=1)
+        if job:
+            return job
+
+        job = self.create({"picking_id": picking.id, "kind": kind, "crear_backorder": crear_backorder, "user_id": self.env.uid})
+        self.env.ref(f"{self._module}.ir_cron_api_validation_jobs")._trigger()
+        return job
+
+    def to_dict(self):
+        """Estado del trabajo para la respuesta de la API."""
+        self.ensure_one()
+        position = self.search_count([("state", "=", "queued"), ("id", "<", self.id)]) if self.state == "queued" else 0
+        return {
+            "id": self.id,
+            "estado": self.state,
+            "tipo": self.kind,
+            "picking_id": self.picking_id.id,
+            "posicion_en_cola": position,
+            "backorder_id": self.backorder_id.id or False,
+            "resultado": json.loads(self.response) if self.response else {},
+            "error": self.error or "",
+            "fecha_creacion": fields.Datetime.to_string(self.create_date),
+            "fecha_inicio": fields.Datetime.to_string(self.date_start) if self.date_start else "",
+            "fecha_fin": fields.Datetime.to_string(self.date_end) if self.date_end else "",
+        }
+
+    @api.model
+    def _cron_run_jobs(self, limit=20):
+        """Procesa hasta ``limit`` trabajos en cola, uno por transacción.
+
+        Cada trabajo se toma con ``FOR UPDATE SKIP LOCKED`` y se marca en proceso antes de validar,
+        así varios workers del cron no procesan el mismo trabajo."""
+        self._fail_interrupted()
+
+        for _index in range(limit):
+            self.env.cr.execute(f"SELECT id FROM {self._table} WHERE state = 'queued' ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED")
+            row = self.env.cr.fetchone()
+            if not row:
+                break
+
+            job = self.browse(row[0])
+            job.write({"state": "running", "date_start": fields.Datetime.now()})
+            self.env.cr.commit()
+
+            try:
+                with self.env.cr.savepoint():
+                    result = job._run()
+            except Exception as err:
+                _logger.exception("Validación en segundo plano: el trabajo %s falló", job.id)
+                self.invalidate_cache()
+                result = {"code": 500, "msg": f"Error interno: {str(err)}"}
+
+            values = {"date_end": fields.Datetime.now(), "response": json.dumps(result, default=date_utils.json_default)}
+            if result.get("code") == 200:
+                values.update(state="done", backorder_id=result.get("backorder_id") or False)
+            else:
+                values.update(state="failed", error=result.get("msg", ""))
+            job.write(values)
+            self.env.cr.commit()
+
+    def _fail_interrupted(self):
+        """Marca como fallidos los trabajos que quedaron en proceso más de ``JOB_TIMEOUT``."""
+        stale = self.search([("state", "=", "running"), ("date_start", "<", fields.Datetime.now() - JOB_TIMEOUT)])
+        stale.write({"state": "failed", "error": "La validación fue interrumpida", "date_end": fields.Datetime.now()})
+
+    def _run(self):
+        """Valida la operación del trabajo con el usuario que la encoló."""
+        self.ensure_one()
+        picking = self.picking_id.with_user(self.user_id).sudo()
+
+        if picking.state in ("done", "cancel"):
+            return {"code": 400, "msg": f"La operación {picking.name} ya está completada o cancelada"}
+
+        if self.kind == "recepcion":
+            result = self._validar_recepcion(picking, self.crear_backorder)
+        else:
+            result = self._validar_transferencia(picking, self.crear_backorder)
+
+        if result.get("code") == 200 and "backorder_id" not in result:
+            backorder = self.env["stock.picking"].sudo().search([("backorder_id", "=", picking.id), ("state", "not in", ["done", "cancel"])], limit=1)
+            result["backorder_id"] = backorder.id or False
+        return result
+
+    @api.model
+    def _validar_recepcion(self, recepcion, crear_backorder):
+        """Valida una recepción resolviendo los asistentes de backorder y transferencia inmediata."""
+        # Intentar validar la recepción
+        result = recepcion.sudo().button_validate()
+
+        # Si el resultado es un diccionario, significa que se requiere acción adicional (un wizard)
+        if isinstance(result, dict) and result.get("res_model"):
+            wizard_model = result.get("res_model")
+
+            # Para asistente de backorder
+            if wizard_model == "stock.backorder.confirmation":
+                # Crear el wizard con los valores del contexto
+                wizard_context = result.get("context", {})
+
+                # Crear el asistente con los valores correctos según tu JSON
+                wizard_vals = {"pick_ids": [(4, recepcion.id)], "show_transfers": wizard_context.get("default_show_transfers", False)}  # Enlazar con la recepción actual
+
+                wizard = self.env[wizard_model].sudo().with_context(**wizard_context).create(wizard_vals)
+
+                # Procesar según la opción de crear_backorder
+                if crear_backorder:
+                    wizard.sudo().process()
+                    return {"code": 200, "msg": f"Recepción parcial completada y backorder creado - ID {wizard.id or 0}"}
+                else:
+                    wizard.sudo().process_cancel_backorder()
+                    return {"code": 200, "msg": "Recepción parcial completada sin crear backorder"}
+
+            # Para asistente de transferencia inmediata
+            elif wizard_model == "stock.immediate.transfer":
+                wizard_context = result.get("context", {})
+                wizard = self.env[wizard_model].sudo().with_context(**wizard_context).create({"pick_ids": [(4, recepcion.id)]})
+
+                wizard.sudo().process()
+                return {"code": 200, "msg": "Recepción procesada con transferencia inmediata"}
+
+            else:
+                return {"code": 400, "msg": f"Se requiere un asistente no soportado: {wizard_model}"}
+
+        # Si llegamos aquí, button_validate completó la validación sin necesidad de asistentes
+        return {"code": 200, "msg": "Recepción completada correctamente"}
+
+    @api.model
+    def _validar_transferencia(self, transferencia, crear_backorder):
+        """Valida una transferencia interna completándola directamente cuando se pide un asistente."""
+        # Intentar validar la transferencia
+        result = transferencia.with_context(skip_backorder=not crear_backorder).sudo().button_validate()
+        # Si el resultado es un diccionario, significa que se requiere acción adicional (un wizard)
+        if isinstance(result, dict) and result.get("res_model"):
+            wizard_model = result.get("res_model")
+
+            # Para asistente de backorder
+            if wizard_model == "stock.backorder.confirmation":
+                wizard_context = result.get("context", {})
+
+                wizard_vals = {"pick_ids": [(6, 0, [transferencia.id])], "show_transfers": wizard_context.get("default_show_transfers", False)}
+
+                self.env[wizard_model].sudo().with_context(**wizard_context).create(wizard_vals)
+
+                # Procesar según la opción de crear_backorder
+                if crear_backorder:
+                    # En lugar de llamar al método process, vamos a completar la transferencia directamente
+                    transferencia.sudo()._action_done()
+
+                    # Verificar si se creó una backorder
+                    backorder = self.env["stock.picking"].sudo().search([("backorder_id", "=", transferencia.id), ("state", "not in", ["done", "cancel"])], limit=1)
+
+                    return {"code": 200, "msg": "Transferencia procesada directamente", "original_id": transferencia.id, "original_state": transferencia.state, "backorder_id": backorder.id if backorder else False}
+                else:
+                    transferencia.sudo()._action_done()
+
+                    return {"code": 200, "msg": "Transferencia completada sin backorder", "original_id": transferencia.id, "original_state": transferencia.state}
+
+            # Para asistente de transferencia inmediata
+            elif wizard_model == "stock.immediate.transfer":
+                wizard_context = result.get("context", {})
+                self.env[wizard_model].sudo().with_context(**wizard_context).create({})
+
+                # En lugar de usar el wizard, completar directamente
+                transferencia.sudo()._action_done()
+
+                return {"code": 200, "msg": "Transferencia completada con éxito", "original_id": transferencia.id, "original_state": transferencia.state}
+
+            else:
+                return {"code": 400, "msg": f"Acción adicional requerida no soportada: {wizard_model}"}
+
+        elif isinstance(result, bool) and result:
+            # Si button_validate retornó True, la transferencia se completó correctamente
+            return {"code": 200, "msg": "Transferencia completada directamente", "original_id": transferencia.id, "original_state": transferencia.state}
+        else:
+            return {"code": 400, "msg": f"No se pudo completar la transferencia: {result}"}
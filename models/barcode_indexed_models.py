@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from odoo import models
+
+
+class ProductProduct(models.Model):
+    _name = "product.product"
+    _inherit = ["product.product", "api.barcode.indexed.mixin"]
+
+    _barcode_index_fields = ("barcode", "barcode_ids")
+
+    def _barcode_index_entries(self):
+        return [(product.barcode, "product", product.id, product.id) for product in self]
+
+
+class ProductPackaging(models.Model):
+    _name = "product.packaging"
+    _inherit = ["product.packaging", "api.barcode.indexed.mixin"]
+
+    _barcode_index_fields = ("barcode", "product_id")
+
+    def _barcode_index_entries(self):
+        return [(packaging.barcode, "packaging", packaging.id, packaging.product_id.id) for packaging in self]
+
+
+class StockProductionLot(models.Model):
+    _name = "stock.production.lot"
+    _inherit = ["stock.production.lot", "api.barcode.indexed.mixin"]
+
+    _barcode_index_fields = ("name", "product_id")
+
+    def _barcode_index_entries(self):
+        return [(lot.name, "lot", lot.id, lot.product_id.id) for lot in self]
+
+
+class StockLocation(models.Model):
+    _name = "stock.location"
+    _inherit = ["stock.location", "api.barcode.indexed.mixin"]
+
+    _barcode_index_fields = ("barcode",)
+
+    def _barcode_index_entries(self):
+        return [(location.barcode, "location", location.id, False) for location in self]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from odoo import api, models
+
+from .api_cache_version import CACHE_UBICACIONES_USUARIO
+
+
+class StockLocation(models.Model):
+    _inherit = "stock.location"
+
+    def _campos_cache_ubicaciones(self):
+        """Campos que cambian las ubicaciones de una zona: ``active`` y las relaciones con los modelos WMS."""
+        return {"active"} | {name for name, field in self._fields.items() if field.type in ("many2one", "many2many") and field.comodel_name.startswith("appwms.")}
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.env["api.cache.version"].sudo().bump(CACHE_UBICACIONES_USUARIO)
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        if self._campos_cache_ubicaciones() & set(vals):
+            self.env["api.cache.version"].sudo().bump(CACHE_UBICACIONES_USUARIO)
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.env["api.cache.version"].sudo().bump(CACHE_UBICACIONES_USUARIO)
+        return res
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from odoo import api, fields, models
+from odoo.tools.sql import column_exists, create_column
+
+
+class StockQuant(models.Model):
+    _inherit = "stock.quant"
+
+    # Disponible almacenado (available_quantity no se almacena), para que los dominios de la app usen índices.
+    # El ORM lo recalcula en sus escrituras; _merge_quants, que escribe por SQL, lo recalcula al terminar
+    api_available_quantity = fields.Float("Disponible (API)", compute="_compute_api_available_quantity", store=True, digits="Product Unit of Measure")
+
+    @api.depends("quantity", "reserved_quantity")
+    def _compute_api_available_quantity(self):
+        for quant in self:
+            quant.api_available_quantity = quant.quantity - quant.reserved_quantity
+
+    def _auto_init(self):
+        # ✅ Crear y llenar la columna con un solo UPDATE, en lugar de recalcular quant por quant al instalar
+        if not column_exists(self.env.cr, self._table, "api_available_quantity"):
+            create_column(self.env.cr, self._table, "api_available_quantity", "numeric")
+            self.env.cr.execute(f"UPDATE {self._table} SET api_available_quantity = quantity - reserved_quantity")
+        return super()._auto_init()
+
+    @api.model
+    def _merge_quants(self):
+        res = super()._merge_quants()
+        # ✅ La fusión actualiza quantity y reserved_quantity por SQL, sin pasar por el compute
+        self._recompute_api_available_quantity_sql()
+        return res
+
+    def _recompute_api_available_quantity_sql(self):
+        self.flush(["quantity", "reserved_quantity", "api_available_quantity"])
+        self.env.cr.execute(f"UPDATE {self._table} SET api_available_quantity = quantity - reserved_quantity WHERE api_available_quantity IS DISTINCT FROM quantity - reserved_quantity")
+        self.invalidate_cache(["api_available_quantity"])
+
+    def init(self):
+        # Versiones anteriores mantenían la columna con un trigger; se elimina para que el compute sea el único mecanismo
+        self.env.cr.execute(f"DROP TRIGGER IF EXISTS stock_quant_api_available_quantity ON {self._table}")
+        self.env.cr.execute("DROP FUNCTION IF EXISTS stock_quant_api_available_quantity()")
+        self._recompute_api_available_quantity_sql()
+
+        # ✅ Índices parciales de los quants con disponible, por producto y por ubicación (consultas de quickinfo)
+        self.env.cr.execute(f"CREATE INDEX IF NOT EXISTS stock_quant_api_available_product_idx ON {self._table} (product_id, location_id) WHERE api_available_quantity > 0")
+        self.env.cr.execute(f"CREATE INDEX IF NOT EXISTS stock_quant_api_available_location_idx ON {self._table} (location_id, product_id, lot_id) WHERE api_available_quantity > 0")